@@ -2,7 +2,7 @@ from lxml import etree
 import cStringIO
 import codecs
 import csv
-import requests
+from oa_nlp.plos_api.transport import default_transport
 import string
 import re
 
@@ -39,13 +39,10 @@ class UnicodeWriter:
 
 def doGet(url, verify=False):
     """
-    Requests for Humans is not so human after all.
-    The verfiy parameter fails if the URL is not https:(
+    Use the shared pooled transport so the connection to eutils
+    is kept alive between rows.
     """
-    if url.lower().startswith('https:'):
-        return requests.get(url, verify=verify)
-    else:
-        return requests.get(url)
+    return default_transport().get(url, verify=verify)
 
 def fetchEntrez(id):
     """
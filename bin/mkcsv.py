@@ -22,14 +22,16 @@
 
 """
 # Commandline parser gitPLoS.search.query
+import sys
 import csv
 import cStringIO
 import codecs
 import string
 import re
+from collections import defaultdict
 
 from optparse import OptionParser 
-from gitPLoS.search.query import Query, mkJrnlQuery
+from oa_nlp.plos_api.solr import lookup_dois
 
 
 class UnicodeWriter:
@@ -76,34 +78,48 @@ parser.add_option('-a', '--api-key',
                  action='store', dest='api_key', default='7Jne3TIPu6DqFCK',
                  help='API key obtained from PLoS.' ) 
 
+parser.add_option('-b', '--batch-size',
+                 action='store', dest='batch_size', type='int', default=100,
+                 help='Number of DOIs looked up per request.' ) 
+
+parser.add_option('-w', '--workers',
+                 action='store', dest='workers', type='int', default=4,
+                 help='Number of lookup requests in flight.' ) 
+
 (opts, args) = parser.parse_args()
 
+# doi -> [ peopleID, ... ]
+people = defaultdict(list)
+dois = []
 with open(args.pop(0), 'rb') as csvIn:
     reader = csv.reader(csvIn, delimiter=',', quotechar='"')
-    with open('out.csv', 'wb') as csvOut:
-        writer = UnicodeWriter(csvOut)
-        delThese = "[\.\:;\(\)\,\?\+\\\\/]"
-        for row in reader:
-            peopleID = row[0]
-            doi = row[1]
-            print('Processing : ' + doi)
-            q = ['id:"{doi}"'.format(doi=doi)]
-            plos_q = Query( api_key=opts.api_key, limit=2 )
-            try:
-                plos_q.query(q, ','.join(['title','abstract']))
-
-                if opts.verbose:
-                    print "%s docs returned." % plos_q.numFound
-                #Add each result to the builder
-                for d in plos_q:
-                    abstract = string.replace(d.get('abstract')[0], '\n', ' ').strip()
-                    abstract = re.sub(delThese, " ", abstract, 0,0)
-                    title = string.replace(d.get('title'),  '\n', ' ').strip()
-                    title = re.sub(delThese, " ", title, 0,0)
-                    writer.writerow([peopleID, doi, title, abstract])
-            except:
-                print('Exception: ' + sys.exc_info()[0])
-                print('*' + peopleID + ',' + doi)
-        csvIn.close()
-        csvOut.close()
-    
+    for row in reader:
+        peopleID = row[0]
+        doi = row[1].strip()
+        if doi not in people:
+            dois.append(doi)
+        people[doi].append(peopleID)
+
+with open('out.csv', 'wb') as csvOut:
+    writer = UnicodeWriter(csvOut)
+    delThese = "[\.\:;\(\)\,\?\+\\\\/]"
+    missing = []
+    for doi, d in lookup_dois(opts.api_key, dois, ['title', 'abstract'], missing,
+                              batch_size=opts.batch_size, workers=opts.workers):
+        print('Processing : ' + doi)
+        try:
+            abstract = string.replace(d.get('abstract')[0], '\n', ' ').strip()
+            abstract = re.sub(delThese, " ", abstract, 0,0)
+            title = string.replace(d.get('title'),  '\n', ' ').strip()
+            title = re.sub(delThese, " ", title, 0,0)
+        except:
+            # A document without a usable title or abstract is reported
+            # with the DOIs that were not found.
+            print('Exception: ' + str(sys.exc_info()[0]))
+            missing.append(doi)
+            continue
+        for peopleID in people[doi]:
+            writer.writerow([peopleID, doi, title, abstract])
+    for doi in missing:
+        for peopleID in people[doi]:
+            print('*' + peopleID + ',' + doi)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.bench_parallel
+
+Compare corpus build times with different numbers of processes.
+
+  Description:
+  ===========
+
+  Builds the same corpus once for each of the given process counts and
+  reports the wall time and articles per second of each. 0 is a single
+  Plos_builder in this process, as mkcorpus without --processes, any
+  other count a build_parallel() with that many workers. All builds use
+  the DOI hash split so they give the same corpus.
+
+  Point --url at a local server, such as tests/solr_standin.py run as a
+  script, to measure the builder rather than the PLOS API:
+
+    python tests/solr_standin.py 20000 8983 0.05 &
+    bench_parallel.py --url=http://127.0.0.1:8983/search --processes=0,1,4
+
+Usage:
+  bench_parallel.py [options]
+
+Options:
+  -h --help               show this help and exit.
+
+  -u --url=<url>          Solr search URL.
+                          [default: http://api.plos.org/search]
+
+  -k --api-key=<key>      PLOS API key.
+                          [default: key]
+
+  -q --query=<q>          Solr query.
+                          [default: *:*]
+
+  -p --processes=<list>   comma separated process counts to build with.
+                          [default: 0,1,4]
+
+  -l --limit=<n>          number of articles per build.
+                          [default: 5000]
+
+  --part-size=<n>         largest number of articles in a part.
+                          [default: 1000]
+
+  --chunk-size=<n>        rows per request.
+                          [default: 100]
+
+  -w --work-dir=<dir>     directory for the corpora. A temporary
+                          directory is used and removed if not given.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+from __future__ import division
+
+import os, time, shutil, tempfile
+from oa_nlp.plos_api import solr
+from oa_nlp.plos_api.solr import Query
+from plos_builder import Plos_builder, QUERY_RTN_FLDS
+from parallel_builder import build_parallel
+
+__version__ = '0.1'
+
+def _build(api_key, queries, base_dir, processes, limit, part_size, chunk_size):
+  if processes == 0:
+    with Plos_builder(queries, base_dir, 'bench', split='hash', train=10) as builder:
+      builder.build(Query(api_key, queries, QUERY_RTN_FLDS, ['*'], limit=limit,
+                          chunk_size=chunk_size))
+    return builder.doc_total_count
+  return build_parallel(api_key, queries, ['*'], base_dir, 'bench', processes=processes,
+                        limit=limit, shard_size=part_size,
+                        query_args={ 'chunk_size' : chunk_size }, train=10)
+
+def bench(api_key, queries, process_counts, limit, part_size, chunk_size, work_dir):
+  """
+  bench - list of (processes, articles, secs).
+  """
+  rslt = []
+  for processes in process_counts:
+    base_dir = os.path.join(work_dir, 'corpus-{p}'.format(p=processes))
+    t0 = time.time()
+    n = _build(api_key, queries, base_dir, processes, limit, part_size, chunk_size)
+    rslt.append((processes, n, time.time() - t0))
+  return rslt
+
+####################### MAIN ##########################
+
+if __name__ == "__main__":
+  from docopt import docopt
+  args = docopt(__doc__,
+                argv=None,
+                version='oa_nlp.nltk.bench_parallel v.' + __version__,
+                options_first=True)
+
+  solr._search_url = args['--url']
+  process_counts = [ int(p) for p in args['--processes'].split(',') ]
+  work_dir = args['--work-dir']
+  tmp_dir = None
+  if work_dir is None:
+    work_dir = tmp_dir = tempfile.mkdtemp(prefix='bench_parallel')
+  try:
+    rslt = bench(args['--api-key'], [args['--query']], process_counts, int(args['--limit']),
+                 int(args['--part-size']), int(args['--chunk-size']), work_dir)
+  finally:
+    if tmp_dir is not None:
+      shutil.rmtree(tmp_dir)
+
+  base = rslt[0][2]
+  print('{0:>9} {1:>9} {2:>9} {3:>11} {4:>8}'.format(
+        'processes', 'articles', 'secs', 'articles/s', 'speedup'))
+  for (processes, n, secs) in rslt:
+    print('{0:>9} {1:>9} {2:>9.2f} {3:>11.1f} {4:>8.2f}'.format(
+          processes, n, secs, n / secs, base / secs))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.bench_startup
+
+Measure how long it takes to open a corpus and read its first document.
+
+  Description:
+  ===========
+
+  Opens a corpus with Plos_reader in each of several modes and reports
+  the time to construct the reader, the time until the first document has
+  been read and the time to look up the documents of one category, all
+  counted from the start of construction, and the memory the reader added
+  (peak resident set size). Each run is made in a fresh process so no
+  mode profits from the caches of another; the best of --repeat runs is
+  reported. The modes are:
+
+    info    load the corpus info file, as readers before the index did.
+    index   open the compact corpus index, build everything else eagerly.
+    lazy    open the index, defer everything else to first use.
+    lazy-db like lazy, with the metadata answered by the SQLite database.
+
+  Modes that need a file the corpus does not have are skipped.
+
+Usage:
+  bench_startup.py [options] CORPUS_DIR
+
+Examples:
+  bench_startup.py --modes=info,lazy --repeat=5 new-corpus
+
+Options:
+  -h --help               show this help and exit.
+
+  -m --modes=<list>       comma separated modes to measure.
+                          [default: info,index,lazy,lazy-db]
+
+  -c --corpus-type=<ctype> the corpus type. "full", "partial" and
+                          "training" are supported.
+                          [default: full]
+
+  -r --repeat=<n>         runs per mode.
+                          [default: 3]
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+from __future__ import division
+
+import os, time, resource, multiprocessing
+from plos_reader import Plos_reader
+from corpus_index import corpus_index_fn
+from metadb import metadata_db_fn
+
+__version__ = '0.1'
+
+_modes = {
+  'info'    : dict(use_index=False, use_db=False),
+  'index'   : dict(use_db=False),
+  'lazy'    : dict(lazy=True, use_db=False),
+  'lazy-db' : dict(lazy=True),
+  }
+
+def _available(root, mode):
+  if mode == 'info':
+    return True
+  if mode == 'lazy-db':
+    return os.path.isfile(corpus_index_fn(root)) and os.path.isfile(metadata_db_fn(root))
+  return os.path.isfile(corpus_index_fn(root))
+
+def _maxrss_mb():
+  # ru_maxrss is in kilobytes on Linux.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _run(root, corpus_type, mode, out):
+  rss0 = _maxrss_mb()
+  t0 = time.time()
+  rdr = Plos_reader(root, corpus_type=corpus_type, **_modes[mode])
+  t_open = time.time() - t0
+  fileids = rdr.fileids()
+  if fileids:
+    rdr.raw(fileids[0])
+  t_first = time.time() - t0
+  cats = rdr.categories()
+  if cats:
+    rdr.fileids(categories=cats[0])
+  t_cat = time.time() - t0
+  out.put((t_open, t_first, t_cat, _maxrss_mb() - rss0))
+  return
+
+def bench(root, corpus_type, modes, repeat):
+  """
+  bench - list of (mode, open_ms, first_doc_ms, category_ms, rss_mb).
+  """
+  rslt = []
+  for mode in modes:
+    if mode not in _modes:
+      raise ValueError('bench_startup: unknown mode ' + mode)
+    if not _available(root, mode):
+      continue
+    runs = []
+    for _ in range(repeat):
+      out = multiprocessing.Queue()
+      p = multiprocessing.Process(target=_run, args=(root, corpus_type, mode, out))
+      p.start()
+      runs.append(out.get())
+      p.join()
+    best = [ min([ r[i] for r in runs ]) for i in range(4) ]
+    rslt.append((mode, 1e3 * best[0], 1e3 * best[1], 1e3 * best[2], best[3]))
+  return rslt
+
+####################### MAIN ##########################
+
+if __name__ == "__main__":
+  from docopt import docopt
+  args = docopt(__doc__,
+                argv=None,
+                version='oa_nlp.nltk.bench_startup v.' + __version__,
+                options_first=True)
+
+  rslt = bench(args['CORPUS_DIR'], args['--corpus-type'], args['--modes'].split(','),
+               int(args['--repeat']))
+  print('{0:<8} {1:>10} {2:>13} {3:>12} {4:>8}'.format(
+        'mode', 'open_ms', 'first_doc_ms', 'category_ms', 'rss_mb'))
+  for (mode, t_open, t_first, t_cat, rss) in rslt:
+    print('{0:<8} {1:>10.1f} {2:>13.1f} {3:>12.1f} {4:>8.1f}'.format(
+          mode, t_open, t_first, t_cat, rss))
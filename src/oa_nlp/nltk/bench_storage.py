@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.bench_storage
+
+Compare the size and read latency of the corpus storage layouts.
+
+  Description:
+  ===========
+
+  Takes a corpus built with the default one file per document layout and
+  packs its text at each of the given compression levels (0 is packed but
+  not compressed). For every layout it reports the bytes and files on
+  disk and the latency of reading randomly chosen documents, the same
+  documents in the same order for each layout. The files are read once
+  before timing so all layouts are measured with a warm page cache.
+
+Usage:
+  bench_storage.py [options] CORPUS_DIR
+
+Examples:
+  bench_storage.py --levels=0,1,6,9 --reads=2000 new-corpus
+
+Options:
+  -h --help               show this help and exit.
+
+  -l --levels=<list>      comma separated zlib levels to pack with.
+                          [default: 0,1,6,9]
+
+  -r --reads=<n>          number of random document reads timed.
+                          [default: 1000]
+
+  -w --work-dir=<dir>     directory for the packed copies. A temporary
+                          directory is used and removed if not given.
+
+  --dict-docs=<n>         documents used to train the dictionary.
+                          [default: 1000]
+
+  --seed=<n>              random seed for the document order.
+                          [default: 1]
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+from __future__ import division
+
+import os, time, random, shutil, codecs, tempfile
+from packed import Packed_writer, Packed_corpus
+
+__version__ = '0.1'
+
+def _text_fileids(root):
+  return sorted([ f for f in os.listdir(root) if f.endswith('.txt') ])
+
+def _disk_usage(root, fileids=None):
+  names = os.listdir(root) if fileids is None else fileids
+  return (sum([ os.path.getsize(os.path.join(root, f)) for f in names ]), len(names))
+
+def _read_plain(root):
+  def read(fileid):
+    with codecs.open(os.path.join(root, fileid), 'r', encoding='utf-8') as fd:
+      return fd.read()
+  return read
+
+def _pack(src, dst, fileids, level, dict_docs):
+  os.mkdir(dst)
+  read = _read_plain(src)
+  writer = Packed_writer(dst, level=level, dict_docs=dict_docs)
+  for f in fileids:
+    writer.add(f, read(f))
+  writer.close()
+  return
+
+def _time_reads(read, sample):
+  for f in set(sample):
+    read(f)
+  times = []
+  for f in sample:
+    t0 = time.time()
+    read(f)
+    times.append(time.time() - t0)
+  times.sort()
+  pct = lambda p : 1e6 * times[min(int(p * len(times)), len(times) - 1)]
+  return (1e6 * sum(times) / len(times), pct(0.5), pct(0.99))
+
+def bench(root, levels, reads, work_dir, dict_docs, seed):
+  """
+  bench - list of (layout, bytes, files, mean_us, p50_us, p99_us).
+  """
+  fileids = _text_fileids(root)
+  if not fileids:
+    raise ValueError('bench_storage: no .txt documents in ' + root)
+  rnd = random.Random(seed)
+  sample = [ rnd.choice(fileids) for _ in range(reads) ]
+
+  rslt = []
+  (nbytes, nfiles) = _disk_usage(root, fileids)
+  rslt.append(('files',  nbytes, nfiles) + _time_reads(_read_plain(root), sample))
+  for level in levels:
+    dst = os.path.join(work_dir, 'packed-{l}'.format(l=level))
+    _pack(root, dst, fileids, level, dict_docs)
+    corpus = Packed_corpus(dst)
+    (nbytes, nfiles) = _disk_usage(dst)
+    rslt.append(('packed-{l}'.format(l=level), nbytes, nfiles) +
+                _time_reads(corpus.read, sample))
+    corpus.close()
+  return rslt
+
+####################### MAIN ##########################
+
+if __name__ == "__main__":
+  from docopt import docopt
+  args = docopt(__doc__,
+                argv=None,
+                version='oa_nlp.nltk.bench_storage v.' + __version__,
+                options_first=True)
+
+  levels = [ int(l) for l in args['--levels'].split(',') ]
+  work_dir = args['--work-dir']
+  tmp_dir = None
+  if work_dir is None:
+    work_dir = tmp_dir = tempfile.mkdtemp(prefix='bench_storage')
+  try:
+    rslt = bench(args['CORPUS_DIR'], levels, int(args['--reads']), work_dir,
+                 int(args['--dict-docs']), int(args['--seed']))
+  finally:
+    if tmp_dir is not None:
+      shutil.rmtree(tmp_dir)
+
+  base = rslt[0][1]
+  print('{0:<10} {1:>12} {2:>7} {3:>7} {4:>10} {5:>10} {6:>10}'.format(
+        'layout', 'bytes', 'ratio', 'files', 'mean_us', 'p50_us', 'p99_us'))
+  for (layout, nbytes, nfiles, mean, p50, p99) in rslt:
+    print('{0:<10} {1:>12} {2:>7.3f} {3:>7} {4:>10.1f} {5:>10.1f} {6:>10.1f}'.format(
+          layout, nbytes, nbytes / base, nfiles, mean, p50, p99))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.category_expr
+
+Boolean expressions over PLoS subject categories.
+
+  Description:
+  ===========
+
+  NLTK's fileids(categories=[...]) is the union of the categories' file
+  lists. A category expression also intersects and negates them:
+
+    Genetics AND NOT Medicine
+    (Biology OR Medicine) AND "Cell biology"
+    Computational biology AND NOT (Physics OR Chemistry)
+
+  AND, OR and NOT are operators, NOT binds tighter than AND, AND tighter
+  than OR. A category name with spaces can be written as is, the words
+  between operators and parentheses make up the name, or in double
+  quotes, which it needs if it contains an operator word or a
+  parenthesis.
+
+  parse() turns an expression into a tree of tuples, ('cat', name),
+  ('not', e), ('and', e1, e2) and ('or', e1, e2). evaluate() computes it
+  with a function from a category name to a columns.Mask, e.g. the
+  stored subject bitmaps of the corpus index, so every operator is a
+  single bitwise operation on the masks.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import re
+
+__all__ = ['parse', 'evaluate', 'categories_of']
+
+_token_re = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))', re.UNICODE)
+_operators = ('AND', 'OR', 'NOT')
+
+def _tokens(expr):
+  """
+  _tokens - list of ('(', None), (')', None), ('op', 'AND'|'OR'|'NOT')
+            and ('name', name). Adjacent unquoted words are one name.
+  """
+  tokens = []
+  pos = 0
+  expr = expr.strip()
+  while pos < len(expr):
+    m = _token_re.match(expr, pos)
+    if m is None or m.end() == pos:
+      raise ValueError('category expression: can not parse at "{e}"'.format(e=expr[pos:]))
+    pos = m.end()
+    (lparen, rparen, quoted, word) = m.groups()
+    if lparen:
+      tokens.append(('(', None))
+    elif rparen:
+      tokens.append((')', None))
+    elif quoted is not None:
+      tokens.append(('name', quoted))
+    elif word in _operators:
+      tokens.append(('op', word))
+    elif tokens and tokens[-1][0] == 'word':
+      tokens[-1] = ('word', tokens[-1][1] + u' ' + word)
+    else:
+      tokens.append(('word', word))
+  return [ ('name', v) if k == 'word' else (k, v) for k,v in tokens ]
+
+class _Parser(object):
+  """
+  Recursive descent over the tokens of an expression.
+  """
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.pos = 0
+
+  def peek(self):
+    return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+  def take(self, kind, value=None):
+    tok = self.peek()
+    if tok[0] != kind or (value is not None and tok[1] != value):
+      found = 'end of expression' if tok[0] is None else tok[1] or tok[0]
+      raise ValueError('category expression: expected {k}, found {f}'.format(
+                       k=value or kind, f=found))
+    self.pos += 1
+    return tok[1]
+
+  def expr(self):
+    node = self.term()
+    while self.peek() == ('op', 'OR'):
+      self.take('op', 'OR')
+      node = ('or', node, self.term())
+    return node
+
+  def term(self):
+    node = self.factor()
+    while self.peek() == ('op', 'AND'):
+      self.take('op', 'AND')
+      node = ('and', node, self.factor())
+    return node
+
+  def factor(self):
+    kind = self.peek()[0]
+    if self.peek() == ('op', 'NOT'):
+      self.take('op', 'NOT')
+      return ('not', self.factor())
+    if kind == '(':
+      self.take('(')
+      node = self.expr()
+      self.take(')')
+      return node
+    return ('cat', self.take('name'))
+
+def parse(expr):
+  """
+  parse - the tree of a category expression.
+
+  @type expr: string
+  @param expr: e.g. 'Genetics AND NOT Medicine'.
+  @rtype: tuple
+  """
+  parser = _Parser(_tokens(expr))
+  tree = parser.expr()
+  if parser.pos != len(parser.tokens):
+    raise ValueError('category expression: unexpected {t} after a complete expression'.format(
+                     t=parser.peek()[1] or parser.peek()[0]))
+  return tree
+
+def categories_of(tree):
+  """
+  categories_of - the category names used in a tree.
+  """
+  if tree[0] == 'cat':
+    return set([tree[1]])
+  return set().union(*[ categories_of(t) for t in tree[1:] ])
+
+def evaluate(tree, category_mask, universe):
+  """
+  evaluate - the articles selected by a tree.
+
+  @type category_mask: callable
+  @param category_mask: returns the Mask of the articles in a category.
+  @type universe: Mask
+  @param universe: all articles, NOT is taken relative to it.
+  @rtype: Mask
+  """
+  op = tree[0]
+  if op == 'cat':
+    return category_mask(tree[1])
+  if op == 'not':
+    return universe - evaluate(tree[1], category_mask, universe)
+  left = evaluate(tree[1], category_mask, universe)
+  right = evaluate(tree[2], category_mask, universe)
+  return left & right if op == 'and' else left | right
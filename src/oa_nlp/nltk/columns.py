@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.columns
+
+Columnar view of the corpus metadata with bitset filters.
+
+  Description:
+  ===========
+
+  The reader's accessors return one (doi, value) list per field, and
+  selecting articles by several fields means several passes over them in
+  Python. Metadata_columns keeps journal, article_type, publication_date
+  and subject as columns: a sorted list of the distinct values and an
+  array of integer codes, one per article in build order (subject, which
+  has several values per article, as codes with per article offsets).
+  The columns are stored in the corpus index by the builder and read
+  from it without parsing any JSON.
+
+  Predicates on a column, e.g. columns.journal == 'PLoS Genetics' or
+  columns.publication_date.between('2012', '2013'), evaluate to a Mask,
+  a bitset over the articles. The first predicate on a column groups its
+  codes into one bitset per value, after that every predicate is an OR
+  of value bitsets, and masks are combined with &, | and ~, so the
+  filtering is done a machine word at a time by the bitwise operations
+  of Python's integers rather than an article at a time. NumPy is not
+  needed.
+
+    cols = reader.columns()
+    m = (cols.journal == 'PLoS Genetics') & \\
+        (cols.article_type == 'Research Article') & \\
+        cols.publication_date.between('2012', '2013')
+    reader.words(cols.fileids(m))
+
+  Dates compare as strings, so '2012' is before every date in 2012. An
+  article without a value, coded as None, matches no comparison but ==
+  None, as NULL in SQL and Metadata_db.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import array
+import bisect
+from util import doi2fn, bitset, bitset_members, bitset_count
+
+__all__ = ['Metadata_columns', 'Column', 'Mask', 'encode_column', 'encode_multi_column',
+           'SINGLE_COLUMNS', 'MULTI_COLUMNS']
+
+# Article info fields with one value per article.
+SINGLE_COLUMNS = ('journal', 'article_type', 'publication_date')
+# Fields with a list of values per article.
+MULTI_COLUMNS = ('subject',)
+
+def _typecode(n):
+  return 'H' if n <= 0xffff else 'I'
+
+def _value(v):
+  # Only single values are coded, as in the metadata database.
+  return v if isinstance(v, basestring) else None
+
+def encode_column(values):
+  """
+  encode_column - (sorted distinct values, array of codes) for a column
+                  with one value per article.
+  """
+  values = [ _value(v) for v in values ]
+  distinct = sorted(set(values))
+  code = dict([ (v, i) for i,v in enumerate(distinct) ])
+  return (distinct, array.array(_typecode(len(distinct)), [ code[v] for v in values ]))
+
+def encode_multi_column(value_lists):
+  """
+  encode_multi_column - (sorted distinct values, offsets, codes) for a
+                        column with a list of values per article. The
+                        codes of article i are codes[offsets[i]:offsets[i+1]].
+  """
+  value_lists = [ [ _value(v) for v in vs ] for vs in value_lists ]
+  distinct = sorted(set([ v for vs in value_lists for v in vs ]))
+  code = dict([ (v, i) for i,v in enumerate(distinct) ])
+  offsets = array.array('I', [0])
+  codes = array.array(_typecode(len(distinct)))
+  for vs in value_lists:
+    codes.extend([ code[v] for v in vs ])
+    offsets.append(len(codes))
+  return (distinct, offsets, codes)
+
+class Mask(object):
+  """
+  A set of articles, as a bitset over the articles in build order.
+  """
+  def __init__(self, bits, size):
+    self.bits = bits
+    self.size = size
+
+  def _check(self, other):
+    if not isinstance(other, Mask) or other.size != self.size:
+      raise ValueError('Mask: can only combine masks of the same corpus')
+
+  def __and__(self, other):
+    self._check(other)
+    return Mask(self.bits & other.bits, self.size)
+
+  def __or__(self, other):
+    self._check(other)
+    return Mask(self.bits | other.bits, self.size)
+
+  def __sub__(self, other):
+    self._check(other)
+    return Mask(self.bits & ~other.bits, self.size)
+
+  def __invert__(self):
+    return Mask(self.bits ^ ((1 << self.size) - 1), self.size)
+
+  def __len__(self):
+    return bitset_count(self.bits)
+
+  def __nonzero__(self):
+    return self.bits != 0
+
+  def __eq__(self, other):
+    return isinstance(other, Mask) and (self.bits, self.size) == (other.bits, other.size)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def rows(self):
+    """
+    rows - the positions, in build order, of the articles in the mask.
+    """
+    return bitset_members(self.bits)
+
+class Column(object):
+  """
+  One metadata column. Comparisons return a Mask.
+  """
+  def __init__(self, name, values, codes, offsets=None, value_bitset=None):
+    """
+    @type values: list
+    @param values: the sorted distinct values.
+    @type codes: array
+    @param codes: the value code of each article, or of each value of
+                  each article if offsets is given.
+    @type offsets: array
+    @param offsets: start of each article's codes, for a column with a
+                    list of values per article.
+    @type value_bitset: callable
+    @param value_bitset: returns the stored bitset of the articles with
+                         value code i, if the bitsets were precomputed.
+    """
+    self.name = name
+    self.values = values
+    self._codes = codes
+    self._offsets = offsets
+    self.size = len(codes) if offsets is None else len(offsets) - 1
+    self._bits = None
+    self._value_bitset = value_bitset
+    self._stored = {}
+
+  def _bitset(self, i):
+    """
+    _bitset - the bitset of the articles with value code i.
+    """
+    if self._bits is None and self._value_bitset is not None:
+      # Stored bitsets are read one value at a time, as they are used.
+      if i not in self._stored:
+        self._stored[i] = self._value_bitset(i)
+      return self._stored[i]
+    return self._value_bits()[i]
+
+  def _value_bits(self):
+    """
+    _value_bits - the bitset of the articles with each value, made in one
+                  pass over the codes on first use.
+    """
+    if self._bits is None and self._value_bitset is not None:
+      self._bits = [ self._bitset(i) for i in range(len(self.values)) ]
+    if self._bits is None:
+      rows = [ [] for _ in self.values ]
+      if self._offsets is None:
+        for i, c in enumerate(self._codes):
+          rows[c].append(i)
+      else:
+        offsets = self._offsets
+        for i in range(self.size):
+          for c in self._codes[offsets[i]:offsets[i + 1]]:
+            rows[c].append(i)
+      self._bits = [ bitset(r, self.size) for r in rows ]
+    return self._bits
+
+  def _union(self, lo, hi):
+    # Articles with a value code in [lo, hi). None sorts first and is
+    # left out.
+    if self.values and self.values[0] is None:
+      lo = max(lo, 1)
+    bits = 0
+    for i in range(lo, hi):
+      bits |= self._bitset(i)
+    return Mask(bits, self.size)
+
+  def code(self, value):
+    """
+    code - the code of value, None if no article has it.
+    """
+    i = bisect.bisect_left(self.values, value)
+    if i < len(self.values) and self.values[i] == value:
+      return i
+    return None
+
+  def value_counts(self):
+    """
+    value_counts - list of (value, number of articles).
+    """
+    return [ (v, bitset_count(b)) for v,b in zip(self.values, self._value_bits()) ]
+
+  def isin(self, values):
+    """
+    isin - articles with any of values.
+    """
+    if isinstance(values, basestring):
+      values = [values]
+    bits = 0
+    for v in values:
+      i = self.code(v)
+      if i is not None:
+        bits |= self._bitset(i)
+    return Mask(bits, self.size)
+
+  def __eq__(self, value):
+    return self.isin([value])
+
+  def __ne__(self, value):
+    return self._union(0, len(self.values)) - self.isin([value])
+
+  def __lt__(self, value):
+    return self._union(0, bisect.bisect_left(self.values, value))
+
+  def __le__(self, value):
+    return self._union(0, bisect.bisect_right(self.values, value))
+
+  def __gt__(self, value):
+    return self._union(bisect.bisect_right(self.values, value), len(self.values))
+
+  def __ge__(self, value):
+    return self._union(bisect.bisect_left(self.values, value), len(self.values))
+
+  def between(self, lo, hi):
+    """
+    between - articles with lo <= value < hi.
+    """
+    return self._union(bisect.bisect_left(self.values, lo), bisect.bisect_left(self.values, hi))
+
+class Metadata_columns(object):
+  """
+  The metadata columns of a corpus, restricted to the articles of a view.
+  """
+  def __init__(self, dois, columns, view=None, doc_part='body'):
+    """
+    @type dois: list
+    @param dois: the DOIs of all articles in build order.
+    @type columns: dict
+    @param columns: name -> Column.
+    @type view: Mask
+    @param view: the articles that can be selected, None for all.
+    @type doc_part: string
+    @param doc_part: document part of the fileids returned, 'body' or
+                     'abstract'.
+    """
+    self._dois = dois
+    self.size = len(dois)
+    self.columns = columns
+    self.view = Mask((1 << self.size) - 1, self.size) if view is None else view
+    self.doc_part = doc_part
+    for name, col in columns.items():
+      setattr(self, name, col)
+
+  @classmethod
+  def from_values(cls, dois, infos, categories, doc_part='body'):
+    """
+    from_values - build the columns from article info dicts and subject
+                  lists, for corpora whose index has no columns.
+    """
+    columns = {}
+    for name in SINGLE_COLUMNS:
+      (values, codes) = encode_column([ info.get(name) for info in infos ])
+      columns[name] = Column(name, values, codes)
+    (values, offsets, codes) = encode_multi_column(categories)
+    columns['subject'] = Column('subject', values, codes, offsets)
+    return cls(dois, columns, doc_part=doc_part)
+
+  def all(self):
+    """
+    all - the mask of every article of the view.
+    """
+    return self.view
+
+  def select(self, journal=None, article_type=None, date_from=None, date_to=None,
+                   subject=None):
+    """
+    select - mask of the articles matching all of the given conditions,
+             as Metadata_db.select().
+    """
+    mask = self.view
+    if journal is not None:
+      mask = mask & self.journal.isin(journal)
+    if article_type is not None:
+      mask = mask & self.article_type.isin(article_type)
+    if date_from is not None:
+      mask = mask & (self.publication_date >= date_from)
+    if date_to is not None:
+      mask = mask & (self.publication_date < date_to)
+    if subject is not None:
+      mask = mask & self.subject.isin(subject)
+    return mask
+
+  def count(self, mask=None):
+    return len(self.view if mask is None else mask & self.view)
+
+  def dois(self, mask=None):
+    """
+    dois - the DOIs of the articles in mask and the view, in build order.
+    """
+    mask = self.view if mask is None else mask & self.view
+    dois = self._dois
+    return [ dois[i] for i in mask.rows() ]
+
+  def fileids(self, mask=None):
+    """
+    fileids - the fileids of the articles in mask and the view, for
+              raw(), words() etc.
+    """
+    return [ doi2fn(d, self.doc_part) for d in self.dois(mask) ]
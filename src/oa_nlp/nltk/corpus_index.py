@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.corpus_index
+
+Compact index of the articles of a corpus.
+
+  Description:
+  ===========
+
+  Opening a corpus needs the DOIs of its articles, to name the files, and
+  the view each belongs to. In the corpus info file they are spread over
+  a JSON document that has to be parsed whole. Corpus_info.finalize()
+  also writes them to {name}_corpus_index.dat:
+
+    a JSON header line {"document_count": n, "byteorder": "little",
+      "columns": {name: typecode}, "sections": {name: [offset, length]}}
+    the sections, offsets counted from the end of the header line:
+      dois          the DOIs in build order, UTF-8, newline separated.
+      view:NAME     the membership bitmap of view NAME, see util.pack_members.
+      values:NAME   the distinct values of metadata column NAME, a JSON list.
+      codes:NAME    the value codes of column NAME, an array of typecode.
+      offsets:NAME  for subject, the start of each article's codes, an
+                    array('I') of document_count + 1 items.
+      bitmaps:NAME  for subject, the category index: for each value the
+                    bitmap of its articles, zlib compressed, one after
+                    another. Articles are numbered in build order, the
+                    position of their DOI in the dois section.
+      bitmap_offsets:NAME  the start of each value's bitmap in bitmaps:NAME,
+                    an array('I') of len(values) + 1 items.
+
+  The columns are described in columns.py. The subject bitmaps let the
+  reader evaluate category expressions (see category_expr.py) without a
+  pass over the codes. Corpus_index memory maps the file and reads only
+  the header when it is opened. A section is read when it is first
+  asked for, a subject bitmap when its subject is first used.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import sys
+import json
+import mmap
+import array
+import zlib
+import base64
+from collections import OrderedDict
+from util import unpack_members, bitmap, bitset_from_bytes
+from columns import Column, Mask, encode_column, encode_multi_column, \
+                    SINGLE_COLUMNS, MULTI_COLUMNS
+
+__all__ = ['Corpus_index', 'write_corpus_index', 'corpus_index_fn']
+
+INDEX_FN = '{n}_corpus_index.dat'
+
+def corpus_index_fn(base_dir, name='full'):
+  return os.path.join(base_dir, INDEX_FN.format(n=name))
+
+def _value_bitmaps(name, nvalues, offsets, codes, size):
+  """
+  _value_bitmaps - the bitmaps:NAME and bitmap_offsets:NAME sections of
+                   a column with a list of values per article.
+  """
+  rows = [ [] for _ in range(nvalues) ]
+  for i in range(size):
+    for c in codes[offsets[i]:offsets[i + 1]]:
+      rows[c].append(i)
+  maps = [ zlib.compress(bitmap(r, size)) for r in rows ]
+  starts = array.array('I', [0])
+  for m in maps:
+    starts.append(starts[-1] + len(m))
+  return [ ('bitmaps:' + name, b''.join(maps)),
+           ('bitmap_offsets:' + name, starts.tostring()) ]
+
+def write_corpus_index(fn, records, views):
+  """
+  write_corpus_index - write the index of a corpus.
+
+  @type fn: string
+  @param fn: the index file. It is written to a temporary file and
+             renamed, so a reader never sees a partial index.
+  @type records: iterable
+  @param records: Corpus_info records in build order.
+  @type views: dict
+  @param views: view name -> {'members': bitmap, ...} as in the info file.
+  """
+  dois = []
+  single = dict([ (c, []) for c in SINGLE_COLUMNS ])
+  multi = dict([ (c, []) for c in MULTI_COLUMNS ])
+  for rec in records:
+    dois.append(rec['doi'])
+    for c in SINGLE_COLUMNS:
+      single[c].append(rec['info'].get(c))
+    multi['subject'].append(rec['categories'])
+
+  sections = [ ('dois', u'\n'.join(dois).encode('utf-8')) ] + \
+             [ ('view:' + v, m['members'].encode('ascii')) for v,m in views.items() ]
+  typecodes = OrderedDict()
+  for c in SINGLE_COLUMNS:
+    (values, codes) = encode_column(single[c])
+    typecodes[c] = codes.typecode
+    sections += [ ('values:' + c, json.dumps(values).encode('utf-8')),
+                  ('codes:' + c, codes.tostring()) ]
+  for c in MULTI_COLUMNS:
+    (values, offsets, codes) = encode_multi_column(multi[c])
+    typecodes[c] = codes.typecode
+    sections += [ ('values:' + c, json.dumps(values).encode('utf-8')),
+                  ('offsets:' + c, offsets.tostring()),
+                  ('codes:' + c, codes.tostring()) ] + \
+                _value_bitmaps(c, len(values), offsets, codes, len(dois))
+
+  offset = 0
+  layout = OrderedDict()
+  for name, data in sections:
+    layout[name] = [offset, len(data)]
+    offset += len(data)
+  header = json.dumps(OrderedDict([ ('document_count', len(dois)),
+                                    ('byteorder', sys.byteorder),
+                                    ('columns', typecodes),
+                                    ('sections', layout) ]))
+  tmp = fn + '.tmp'
+  with open(tmp, 'wb') as fd:
+    fd.write(header.encode('utf-8') + b'\n')
+    for name, data in sections:
+      fd.write(data)
+  os.rename(tmp, fn)
+  return
+
+class Corpus_index(object):
+  """
+  Read only, memory mapped access to a corpus index.
+  """
+  def __init__(self, fn):
+    self.fn = fn
+    with open(fn, 'rb') as fd:
+      self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    end = self._map.find(b'\n')
+    header = json.loads(self._map[:end].decode('utf-8'))
+    self._base = end + 1
+    self.document_count = header['document_count']
+    self._sections = header['sections']
+    self._columns = header.get('columns', {})
+    self._swap = header.get('byteorder', sys.byteorder) != sys.byteorder
+
+  def views(self):
+    return [ s[len('view:'):] for s in self._sections if s.startswith('view:') ]
+
+  def _section(self, name):
+    (offset, length) = self._sections[name]
+    start = self._base + offset
+    return self._map[start:start + length]
+
+  def dois(self, view=None):
+    """
+    dois - the DOIs in build order, of one view if view is given.
+    """
+    data = self._section('dois')
+    dois = data.decode('utf-8').split(u'\n') if data else []
+    if view is None:
+      return dois
+    if 'view:' + view not in self._sections:
+      raise ValueError('Corpus_index: corpus has no {v} view'.format(v=view))
+    members = unpack_members(self._section('view:' + view))
+    return [ d for i,d in enumerate(dois) if i in members ]
+
+  def view_mask(self, view):
+    """
+    view_mask - the articles of a view as a columns.Mask.
+    """
+    if 'view:' + view not in self._sections:
+      raise ValueError('Corpus_index: corpus has no {v} view'.format(v=view))
+    bits = bitset_from_bytes(base64.b64decode(self._section('view:' + view)))
+    return Mask(bits, self.document_count)
+
+  def has_columns(self):
+    """
+    has_columns - False for an index written before it had columns.
+    """
+    return bool(self._columns)
+
+  def _array(self, name, typecode):
+    a = array.array(typecode)
+    a.fromstring(self._section(name))
+    if self._swap:
+      a.byteswap()
+    return a
+
+  def column(self, name):
+    """
+    column - the columns.Column of a metadata column.
+    """
+    values = json.loads(self._section('values:' + name).decode('utf-8'))
+    codes = self._array('codes:' + name, self._columns[name])
+    offsets = None
+    if 'offsets:' + name in self._sections:
+      offsets = self._array('offsets:' + name, 'I')
+    value_bitset = None
+    if 'bitmaps:' + name in self._sections:
+      value_bitset = self._value_bitset(name)
+    return Column(name, values, codes, offsets, value_bitset)
+
+  def _value_bitset(self, name):
+    """
+    _value_bitset - function reading the stored bitset of a value code.
+    """
+    starts = self._array('bitmap_offsets:' + name, 'I')
+    (offset, length) = self._sections['bitmaps:' + name]
+    base = self._base + offset
+    def read(i):
+      data = zlib.decompress(self._map[base + starts[i]:base + starts[i + 1]])
+      return bitset_from_bytes(data)
+    return read
+
+  def close(self):
+    self._map.close()
+    return
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.metadb
+
+SQLite store for the corpus metadata.
+
+  Description:
+  ===========
+
+  The corpus info file is one JSON document that has to be loaded whole
+  before anything in it can be looked up, and every per field accessor
+  of the reader is a pass over all DOIs. A corpus built with
+  metadata_db=True also has its metadata in {name}_corpus_info.db, an
+  SQLite database written from the same records by Corpus_info.finalize():
+
+    corpus   (key, value)  desc, document_count, creation_date, query and
+                           views, the values JSON encoded.
+    article  one row per article in build order (seq), with its doi,
+             view, journal, publication_date, article_type and title as
+             columns and the complete article info as JSON.
+    author   (seq, position, name) one row per author of an article.
+    subject  (seq, position, name) one row per subject of an article.
+
+  journal, publication_date, article_type, view, author name and subject
+  name are indexed. Metadata_db answers the reader's accessors and the
+  filtered lookups of select() with queries on these tables, reading only
+  the rows asked for.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+
+__all__ = ['Metadata_db', 'write_metadata_db', 'metadata_db_fn']
+
+DB_FN = '{n}_corpus_info.db'
+
+# Article info fields that are also article columns.
+COLUMNS = ('journal', 'publication_date', 'article_type', 'title')
+
+_schema = (
+  'CREATE TABLE corpus (key TEXT PRIMARY KEY, value TEXT)',
+  'CREATE TABLE article (seq INTEGER PRIMARY KEY, doi TEXT NOT NULL, view TEXT, '
+  'journal TEXT, publication_date TEXT, article_type TEXT, title TEXT, info TEXT NOT NULL)',
+  'CREATE TABLE author (seq INTEGER NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL)',
+  'CREATE TABLE subject (seq INTEGER NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL)',
+  )
+
+# Built after the rows are loaded, which is faster than maintaining them.
+_indexes = (
+  'CREATE INDEX article_doi ON article (doi)',
+  'CREATE INDEX article_view ON article (view)',
+  'CREATE INDEX article_journal ON article (journal)',
+  'CREATE INDEX article_publication_date ON article (publication_date)',
+  'CREATE INDEX article_article_type ON article (article_type)',
+  'CREATE INDEX author_name ON author (name)',
+  'CREATE INDEX author_seq ON author (seq)',
+  'CREATE INDEX subject_name ON subject (name)',
+  'CREATE INDEX subject_seq ON subject (seq)',
+  )
+
+# SQLite limits the number of parameters of a statement.
+_max_params = 500
+
+def metadata_db_fn(base_dir, name='full'):
+  return os.path.join(base_dir, DB_FN.format(n=name))
+
+def _list(value):
+  if value == '' or value is None:
+    return []
+  return [value] if isinstance(value, basestring) else value
+
+def _column(value):
+  # Only single values are kept in the indexed columns.
+  return value if isinstance(value, basestring) else None
+
+def write_metadata_db(fn, header, records):
+  """
+  write_metadata_db - write the metadata database from corpus records.
+
+  @type fn: string
+  @param fn: the database file. It is written to a temporary file and
+             renamed, so a reader never sees a partial database.
+  @type header: dict
+  @param header: desc, document_count, creation_date, query and views.
+  @type records: iterable
+  @param records: Corpus_info records in build order.
+  """
+  tmp = fn + '.tmp'
+  if os.path.exists(tmp):
+    os.remove(tmp)
+  conn = sqlite3.connect(tmp)
+  try:
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    for stmt in _schema:
+      conn.execute(stmt)
+    conn.executemany('INSERT INTO corpus VALUES (?, ?)',
+                     [ (k, json.dumps(v)) for k,v in header.items() ])
+    for seq, rec in enumerate(records):
+      info = rec['info']
+      conn.execute('INSERT INTO article VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                   (seq, rec['doi'], rec['view']) +
+                   tuple([ _column(info.get(c)) for c in COLUMNS ]) + (json.dumps(info),))
+      conn.executemany('INSERT INTO author VALUES (?, ?, ?)',
+                       [ (seq, i, a) for i,a in enumerate(_list(info.get('author'))) ])
+      conn.executemany('INSERT INTO subject VALUES (?, ?, ?)',
+                       [ (seq, i, s) for i,s in enumerate(rec['categories']) ])
+    for stmt in _indexes:
+      conn.execute(stmt)
+    conn.commit()
+  finally:
+    conn.close()
+  os.rename(tmp, fn)
+  return
+
+def _chunks(items, size=_max_params):
+  for i in range(0, len(items), size):
+    yield items[i:i + size]
+
+def _in_clause(column, values):
+  return '{c} IN ({p})'.format(c=column, p=', '.join(['?'] * len(values)))
+
+class Metadata_db(object):
+  """
+  Read only access to a metadata database, optionally restricted to
+  one view.
+  """
+  def __init__(self, fn, view=None):
+    """
+    @type fn: string
+    @param fn: the database file.
+    @type view: string
+    @param view: 'partial' or 'training' to see only that view's articles,
+                 None for all of them.
+    """
+    self.fn = fn
+    self._conn = sqlite3.connect(fn, check_same_thread=False)
+    self.header = OrderedDict([ (k, json.loads(v)) for k,v in
+                                self._conn.execute('SELECT key, value FROM corpus') ])
+    if view is not None and view not in self.header.get('views', {}):
+      raise ValueError('Metadata_db: corpus has no {v} view'.format(v=view))
+    self.view = view
+
+  def _where(self, clauses=(), params=()):
+    clauses = list(clauses)
+    params = list(params)
+    if self.view is not None:
+      clauses.append('article.view = ?')
+      params.append(self.view)
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return (where, params)
+
+  def document_count(self):
+    (where, params) = self._where()
+    return self._conn.execute('SELECT COUNT(*) FROM article' + where, params).fetchone()[0]
+
+  def dois(self):
+    """
+    dois - the DOIs of the articles in build order.
+    """
+    (where, params) = self._where()
+    return [ r[0] for r in self._conn.execute(
+             'SELECT doi FROM article' + where + ' ORDER BY seq', params) ]
+
+  def _rows(self, select, dois, order='article.seq'):
+    """
+    _rows - yield (doi, ...) rows of select for dois, all articles if dois
+            is None. Rows of DOIs not in the corpus are missing.
+    """
+    if dois is None:
+      (where, params) = self._where()
+      for row in self._conn.execute(select + where + ' ORDER BY ' + order, params):
+        yield row
+      return
+    for chunk in _chunks(list(dois)):
+      (where, params) = self._where([_in_clause('article.doi', chunk)], chunk)
+      for row in self._conn.execute(select + where + ' ORDER BY ' + order, params):
+        yield row
+    return
+
+  def _lookup(self, select, dois, convert=lambda r : r[1]):
+    if dois is None:
+      return [ (r[0], convert(r)) for r in self._rows(select, None) ]
+    found = dict([ (r[0], convert(r)) for r in self._rows(select, dois) ])
+    return [ (d, found[d]) for d in dois ]
+
+  def article_info(self, dois=None):
+    """
+    article_info - list of (doi, article info dict).
+    """
+    loads = lambda r : json.loads(r[1], object_pairs_hook=OrderedDict)
+    return self._lookup('SELECT doi, info FROM article', dois, loads)
+
+  def info_field(self, field, dois=None):
+    """
+    info_field - list of (doi, value) of one article info field. Indexed
+                 columns are read directly, other fields from the info.
+    """
+    if field in COLUMNS:
+      # A value that is not a single string is only in the info.
+      value = lambda r : r[1] if r[1] is not None else json.loads(r[2])[field]
+      return self._lookup('SELECT doi, {c}, CASE WHEN {c} IS NULL THEN info END '
+                          'FROM article'.format(c=field), dois, value)
+    return [ (d, info[field]) for d,info in self.article_info(dois) ]
+
+  def _grouped(self, table, dois):
+    """
+    _grouped - list of (doi, [name, ...]) from the author or subject table.
+    """
+    select = ('SELECT article.doi, {t}.name FROM article LEFT JOIN {t} '
+              'ON {t}.seq = article.seq').format(t=table)
+    rows = self._rows(select, dois, 'article.seq, {t}.position'.format(t=table))
+    found = OrderedDict()
+    for doi, name in rows:
+      names = found.setdefault(doi, [])
+      if name is not None:
+        names.append(name)
+    if dois is None:
+      return found.items()
+    return [ (d, found[d]) for d in dois ]
+
+  def authors(self, dois=None):
+    """
+    authors - list of (doi, [author, ...]).
+    """
+    return self._grouped('author', dois)
+
+  def categories(self, dois=None):
+    """
+    categories - list of (doi, [subject, ...]).
+    """
+    return self._grouped('subject', dois)
+
+  def select(self, journal=None, article_type=None, date_from=None, date_to=None,
+                   subject=None, author=None):
+    """
+    select - DOIs of the articles matching all of the given conditions,
+             in build order.
+
+    @type journal: string or list
+    @param journal: journal name(s), e.g. 'PLoS Genetics'.
+    @type article_type: string or list
+    @param article_type: article type(s), e.g. 'Research Article'.
+    @type date_from: string
+    @param date_from: earliest publication_date, e.g. '2012' or '2012-06-01'.
+    @type date_to: string
+    @param date_to: publication_date before this, e.g. '2013'.
+    @type subject: string or list
+    @param subject: articles with at least one of these subjects.
+    @type author: string or list
+    @param author: articles with at least one of these authors.
+    """
+    clauses = []
+    params = []
+    for column, values in (('journal', journal), ('article_type', article_type)):
+      if values is not None:
+        values = _list(values)
+        clauses.append(_in_clause('article.' + column, values))
+        params += values
+    if date_from is not None:
+      clauses.append('article.publication_date >= ?')
+      params.append(date_from)
+    if date_to is not None:
+      clauses.append('article.publication_date < ?')
+      params.append(date_to)
+    for table, values in (('subject', subject), ('author', author)):
+      if values is not None:
+        values = _list(values)
+        clauses.append('article.seq IN (SELECT seq FROM {t} WHERE {c})'.format(
+                       t=table, c=_in_clause('name', values)))
+        params += values
+    (where, params) = self._where(clauses, params)
+    return [ r[0] for r in self._conn.execute(
+             'SELECT doi FROM article' + where + ' ORDER BY seq', params) ]
+
+  def close(self):
+    self._conn.close()
+    return
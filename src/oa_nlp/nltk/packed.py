@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.packed
+
+Packed storage for corpus text.
+
+  Description:
+  ===========
+
+  The default corpus layout is two small files per article. A large corpus
+  then needs hundreds of thousands of inodes and every document read is
+  an open/close. In the packed layout the UTF-8 text of each document is
+  appended to a shard file, packed-NNNNN.dat, and a line is added to the
+  index file packed.idx:
+
+    fileid <TAB> shard <TAB> offset <TAB> length <TAB> text_length
+
+  The fileid is the same name the plain layout uses for the file, so the
+  corpus info files do not change. A shard is closed once it is larger
+  than shard_bytes and a new one is started. Shards and index are only
+  ever appended to.
+
+  With level > 0 every document is stored as its own raw deflate frame,
+  so a single document is read with one seek and one decompress. Frames
+  of short documents compress poorly on their own, so the compressor is
+  primed with a dictionary trained on the first dict_docs documents: the
+  most frequent words, ordered so the most frequent end up closest to
+  the text. Priming is done by compressing the dictionary and sync
+  flushing, which works with the zlib of Python 2 as well (it has no
+  zdict). The dictionary is saved in packed.dict and the level in
+  packed.json. length is the stored size, text_length the UTF-8 size.
+
+  merge_packed() combines packed corpora built separately, for instance
+  by parallel builders, by linking their shards in under new numbers.
+  Each packed corpus trained its own dictionary, so a merged corpus
+  keeps one per shard in packed-NNNNN.dict.
+
+  Packed_corpus loads the index and memory maps the shards. Its pointer()
+  returns an NLTK PathPointer for a single document so the NLTK corpus
+  views read packed text the same way they read files.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import io
+import shutil
+import json
+import mmap
+import zlib
+import threading
+from collections import Counter
+from util import link_or_copy
+from nltk.data import PathPointer, SeekableUnicodeStreamReader
+
+__all__ = ['Packed_writer', 'Packed_corpus', 'is_packed', 'merge_packed']
+
+INDEX_FN = 'packed.idx'
+SHARD_FN = 'packed-{n:05d}.dat'
+DICT_FN = 'packed.dict'
+SHARD_DICT_FN = 'packed-{n:05d}.dict'
+CONFIG_FN = 'packed.json'
+
+# Deflate can refer back at most 32KB, a longer dictionary is wasted.
+_max_dict_bytes = 32*1024
+
+def train_dictionary(texts, max_bytes=_max_dict_bytes):
+  """
+  train_dictionary - build a compression dictionary from sample texts.
+
+  @type texts: list
+  @param texts: sample documents as unicode.
+  @rtype: bytes
+  @return: UTF-8 encoded dictionary of at most max_bytes.
+  """
+  counts = Counter()
+  for text in texts:
+    counts.update(text.split())
+  words = []
+  size = 0
+  for word, n in counts.most_common():
+    if n < 2:
+      break
+    data = word.encode('utf-8') + b' '
+    if size + len(data) > max_bytes:
+      break
+    words.append(data)
+    size += len(data)
+  return b''.join(reversed(words))
+
+class _Codec(object):
+  """
+  Raw deflate frames primed with a shared dictionary.
+  """
+  def __init__(self, level, zdict):
+    self._comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    self._decomp = zlib.decompressobj(-15)
+    if zdict:
+      prefix = self._comp.compress(zdict) + self._comp.flush(zlib.Z_SYNC_FLUSH)
+      self._decomp.decompress(prefix)
+
+  def compress(self, data):
+    c = self._comp.copy()
+    return c.compress(data) + c.flush()
+
+  def decompress(self, frame):
+    d = self._decomp.copy()
+    return d.decompress(frame) + d.flush()
+
+def _read_config(root):
+  fn = os.path.join(root, CONFIG_FN)
+  if not os.path.isfile(fn):
+    return {'level': 0}
+  with open(fn, 'r') as fd:
+    return json.load(fd)
+
+def _read_dict(root):
+  with open(os.path.join(root, DICT_FN), 'rb') as fd:
+    return fd.read()
+
+def is_packed(root):
+  """
+  True if the corpus in root uses the packed layout.
+  """
+  return os.path.isfile(os.path.join(root, INDEX_FN))
+
+def merge_packed(root, parts):
+  """
+  merge_packed - link the shards of the packed corpora in parts into
+                 root and write one index for all of them. The parts
+                 are left as they are, so a failed merge can be redone.
+
+  @type root: string
+  @param root: the corpus directory, without packed files.
+  @type parts: list
+  @param parts: directories of closed packed corpora, in merge order.
+                A fileid in more than one part is taken from the last.
+  """
+  parts = [ p for p in parts if is_packed(p) ]
+  if not parts:
+    return
+  config = None
+  shard = 0
+  with open(os.path.join(root, INDEX_FN), 'ab') as index:
+    for part in parts:
+      part_config = _read_config(part)
+      if config is not None and part_config['level'] != config['level']:
+        raise ValueError('merge_packed: {p} was written with level {l}'.format(
+                         p=part, l=part_config['level']))
+      config = part_config
+      renumber = {}
+      n = 0
+      while os.path.exists(os.path.join(part, SHARD_FN.format(n=n))):
+        renumber[n] = shard
+        link_or_copy(os.path.join(part, SHARD_FN.format(n=n)),
+                     os.path.join(root, SHARD_FN.format(n=shard)))
+        if os.path.isfile(os.path.join(part, DICT_FN)):
+          shutil.copyfile(os.path.join(part, DICT_FN),
+                          os.path.join(root, SHARD_DICT_FN.format(n=shard)))
+        n += 1
+        shard += 1
+      with open(os.path.join(part, INDEX_FN), 'rb') as fd:
+        for line in fd:
+          fields = line.rstrip(b'\n').split(b'\t')
+          if len(fields) != 5:
+            continue
+          fields[1] = str(renumber[int(fields[1])]).encode('ascii')
+          index.write(b'\t'.join(fields) + b'\n')
+  if config is not None and config['level'] > 0:
+    with open(os.path.join(root, CONFIG_FN), 'w') as fd:
+      json.dump(config, fd)
+  return
+
+class Packed_writer(object):
+  """
+  Appends documents to the shard files of a corpus. Safe to share
+  between writer threads.
+  """
+  def __init__(self, root, shard_bytes=256*1024**2, level=0, dict_docs=1000):
+    """
+    @type root: string
+    @param root: the corpus directory.
+    @type shard_bytes: int
+    @param shard_bytes: a new shard is started once the current one is
+                        larger than this.
+    @type level: int
+    @param level: zlib compression level, 0 stores plain text.
+    @type dict_docs: int
+    @param dict_docs: number of documents the dictionary is trained on.
+                      They are held in memory until then.
+    """
+    self.root = root
+    self.shard_bytes = shard_bytes
+    self._lock = threading.Lock()
+    self._codec = None
+    self._pending = None
+    config = _read_config(root)
+    if os.path.isfile(os.path.join(root, INDEX_FN)) and config['level'] != level:
+      raise ValueError('Packed_writer: {r} was written with level {l}'.format(
+                       r=root, l=config['level']))
+    self.level = level
+    self.dict_docs = dict_docs
+    if level > 0:
+      with open(os.path.join(root, CONFIG_FN), 'w') as fd:
+        json.dump({'level': level}, fd)
+      if os.path.isfile(os.path.join(root, DICT_FN)):
+        self._codec = _Codec(level, _read_dict(root))
+      else:
+        self._pending = []
+    self._shard = 0
+    while os.path.exists(self._shard_path(self._shard + 1)):
+      self._shard += 1
+    self._fd = open(self._shard_path(self._shard), 'ab')
+    self._offset = self._fd.tell()
+    self._index = open(os.path.join(root, INDEX_FN), 'ab')
+
+  def _shard_path(self, n):
+    return os.path.join(self.root, SHARD_FN.format(n=n))
+
+  def add(self, fileid, text):
+    """
+    add - append the text of one document.
+
+    @type fileid: string
+    @param fileid: the document name, see util.doi2fn.
+    @type text: unicode
+    @param text: the document text.
+    """
+    with self._lock:
+      if self._pending is not None:
+        self._pending.append((fileid, text))
+        if len(self._pending) >= self.dict_docs:
+          self._train()
+        return
+      self._append(fileid, text)
+    return
+
+  def training(self):
+    """
+    training - True while documents are held back to train the dictionary.
+    """
+    with self._lock:
+      return self._pending is not None
+
+  def sync(self):
+    """
+    sync - make the documents appended so far durable.
+    """
+    with self._lock:
+      for fd in (self._fd, self._index):
+        fd.flush()
+        os.fsync(fd.fileno())
+    return
+
+  def _train(self):
+    zdict = train_dictionary([ t for f,t in self._pending ])
+    with open(os.path.join(self.root, DICT_FN), 'wb') as fd:
+      fd.write(zdict)
+    self._codec = _Codec(self.level, zdict)
+    pending, self._pending = self._pending, None
+    for fileid, text in pending:
+      self._append(fileid, text)
+    return
+
+  def _append(self, fileid, text):
+    data = text.encode('utf-8')
+    text_len = len(data)
+    if self._codec is not None:
+      data = self._codec.compress(data)
+    if self._offset > 0 and self._offset >= self.shard_bytes:
+      self._fd.close()
+      self._shard += 1
+      self._fd = open(self._shard_path(self._shard), 'ab')
+      self._offset = 0
+    self._fd.write(data)
+    # Flush the data first so an index entry never points past it.
+    self._fd.flush()
+    entry = u'{f}\t{s}\t{o}\t{l}\t{t}\n'.format(f=fileid, s=self._shard,
+                                                o=self._offset, l=len(data), t=text_len)
+    self._index.write(entry.encode('utf-8'))
+    self._index.flush()
+    self._offset += len(data)
+    return
+
+  def close(self):
+    with self._lock:
+      if self._pending is not None:
+        self._train()
+      self._fd.close()
+      self._index.close()
+    return
+
+class Packed_pointer(PathPointer):
+  """
+  NLTK path pointer to one document in a packed corpus.
+  """
+  def __init__(self, corpus, fileid):
+    self._corpus = corpus
+    self._fileid = fileid
+
+  @property
+  def path(self):
+    return self._fileid
+
+  def open(self, encoding=None):
+    stream = io.BytesIO(self._corpus.read_bytes(self._fileid))
+    if encoding is not None:
+      stream = SeekableUnicodeStreamReader(stream, encoding)
+    return stream
+
+  def file_size(self):
+    return self._corpus.size(self._fileid)
+
+  def join(self, fileid):
+    raise IOError('Packed_pointer: {f} is not a directory'.format(f=self._fileid))
+
+  def __repr__(self):
+    return 'Packed_pointer({r!r}, {f!r})'.format(r=self._corpus.root, f=self._fileid)
+
+class Packed_corpus(object):
+  """
+  Read only access to the documents of a packed corpus.
+  """
+  def __init__(self, root):
+    self.root = root
+    self._index = {}
+    self._maps = {}
+    self._lock = threading.Lock()
+    self.level = _read_config(root)['level']
+    self._codec = None
+    self._codecs = {}
+    if self.level > 0 and os.path.isfile(os.path.join(root, DICT_FN)):
+      self._codec = _Codec(self.level, _read_dict(root))
+    with open(os.path.join(root, INDEX_FN), 'rb') as fd:
+      for line in fd:
+        fields = line.decode('utf-8').rstrip('\n').split('\t')
+        if len(fields) != 5:
+          # A partial last line from an interrupted build.
+          continue
+        self._index[fields[0]] = tuple([ int(f) for f in fields[1:] ])
+
+  def fileids(self):
+    return sorted(self._index.keys())
+
+  def __contains__(self, fileid):
+    return fileid in self._index
+
+  def size(self, fileid):
+    """
+    size - the UTF-8 size of the text, not the stored size.
+    """
+    return self._index[fileid][3]
+
+  def stored_size(self, fileid):
+    return self._index[fileid][2]
+
+  def _map(self, shard):
+    with self._lock:
+      if shard not in self._maps:
+        with open(os.path.join(self.root, SHARD_FN.format(n=shard)), 'rb') as fd:
+          self._maps[shard] = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+      return self._maps[shard]
+
+  def read_bytes(self, fileid):
+    """
+    read_bytes - the UTF-8 text of one document.
+    """
+    (shard, offset, length, text_len) = self._index[fileid]
+    if length == 0:
+      return b''
+    data = self._map(shard)[offset:offset + length]
+    if self.level > 0:
+      data = self._shard_codec(shard).decompress(data)
+    return data
+
+  def _shard_codec(self, shard):
+    with self._lock:
+      if shard not in self._codecs:
+        fn = os.path.join(self.root, SHARD_DICT_FN.format(n=shard))
+        if os.path.isfile(fn):
+          with open(fn, 'rb') as fd:
+            self._codecs[shard] = _Codec(self.level, fd.read())
+        else:
+          self._codecs[shard] = self._codec
+      return self._codecs[shard]
+
+  def read(self, fileid):
+    """
+    read - the text of one document as unicode.
+    """
+    return self.read_bytes(fileid).decode('utf-8')
+
+  def pointer(self, fileid):
+    if fileid not in self._index:
+      raise IOError('Packed_corpus: no document ' + fileid)
+    return Packed_pointer(self, fileid)
+
+  def close(self):
+    with self._lock:
+      for m in self._maps.values():
+        m.close()
+      self._maps = {}
+    return
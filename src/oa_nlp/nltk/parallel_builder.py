@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.parallel_builder
+
+Build a corpus with several processes.
+
+  Description:
+  ===========
+
+  A single Plos_builder is limited to one core for JSON decoding, string
+  handling and writing. build_parallel() splits the query into disjoint
+  parts with the ShardedQuery planner, by journal and, for journals with
+  more than shard_size hits, by publication date range. Each part is
+  built by a Plos_builder in its own directory, base_dir/parts/part-NNNNN,
+  on a pool of worker processes. When all parts are done merge_parts()
+  links their text into base_dir, combines their token arrays and their
+  metadata records, in part order, into the usual full_corpus_info.json.
+  The merge is made in base_dir/merging and only moved into base_dir
+  once it is complete, the parts are removed after that. A merge that
+  fails is made again from the parts the next time.
+
+  The training split has to be the DOI hash split, the only one that
+  does not depend on which process adds an article. A part that was
+  finished is kept when the build is run again with resume=True, and an
+  interrupted part continues from its checkpoint. So does an interrupted
+  merge.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import json
+import shutil
+import multiprocessing
+from oa_nlp.plos_api import transport
+from oa_nlp.plos_api.solr import Query
+from oa_nlp.plos_api.sharded import ShardedQuery
+from plos_builder import Plos_builder, Corpus_info, QUERY_RTN_FLDS, CHECKPOINT_FN, \
+                         read_records
+from packed import merge_packed
+from tokens import merge_tokens
+from util import link_or_copy
+
+__all__ = ['build_parallel', 'merge_parts']
+
+PARTS_DIR = 'parts'
+PART_FN = 'part-{n:05d}'
+MERGE_DIR = 'merging'
+# Written to MERGE_DIR once the merged corpus is complete.
+MERGED_FN = 'merged.json'
+
+def _init_worker():
+  # Pooled connections inherited from the parent must not be shared.
+  transport._default = None
+  return
+
+def _part_done(part_dir):
+  return os.path.isfile(os.path.join(part_dir, 'full_corpus_info.json')) and \
+         not os.path.isfile(os.path.join(part_dir, CHECKPOINT_FN))
+
+def _build_part(task):
+  """
+  _build_part - worker process entry. Builds one part and returns
+                (index, documents added, builder stats).
+  """
+  (i, part_dir, api_key, queries, journals, limit, desc, builder_args, query_args) = task
+  if _part_done(part_dir):
+    return (i, None, None)
+  resume = os.path.isdir(part_dir)
+  # merge_parts() reads the part's metadata records.
+  with Plos_builder(queries, part_dir, desc, resume=resume, keep_records=True,
+                    **builder_args) as builder:
+    point = builder.resume_point()
+    skip = 0
+    if point is None:
+      q = Query(api_key, queries, QUERY_RTN_FLDS, journals, limit=limit, **query_args)
+    else:
+      q = Query(api_key, queries, QUERY_RTN_FLDS, journals, limit=limit,
+                start=point['start'], cursor_mark=point['cursor_mark'],
+                paging=point['paging'] or 'auto', **query_args)
+      skip = point['skip']
+    builder.build(q, skip=skip)
+  return (i, builder.doc_total_count, builder.stats())
+
+def merge_parts(base_dir, part_dirs, query, desc, views, metadata_db=False):
+  """
+  merge_parts - combine finished parts into the corpus in base_dir.
+
+  @type part_dirs: list
+  @param part_dirs: part directories in the order their articles are
+                    to appear in the corpus.
+  @type views: tuple
+  @param views: views of the parts, ('partial',) or ('partial', 'training').
+  @type metadata_db: bool
+  @param metadata_db: also write the SQLite metadata database.
+
+  @rtype: int
+  @return: number of articles in the corpus.
+  """
+  staging = os.path.join(base_dir, MERGE_DIR)
+  merged_fn = os.path.join(staging, MERGED_FN)
+  if not os.path.isfile(merged_fn):
+    if os.path.isdir(staging):
+      # Left by a merge that did not complete.
+      shutil.rmtree(staging)
+    os.mkdir(staging)
+    info = Corpus_info(query, staging, desc, 'full', views, metadata_db=metadata_db)
+    for part in part_dirs:
+      for rec in read_records(os.path.join(part, 'full_corpus_info.jsonl')):
+        info.retain_record(rec)
+      for fn in os.listdir(part):
+        if fn.endswith('.txt'):
+          link_or_copy(os.path.join(part, fn), os.path.join(staging, fn))
+    merge_packed(staging, part_dirs)
+    merge_tokens(staging, part_dirs)
+    info.finalize()
+    with open(merged_fn + '.tmp', 'w') as fd:
+      json.dump({ 'document_count': info.doc_count }, fd)
+    os.rename(merged_fn + '.tmp', merged_fn)
+  with open(merged_fn, 'r') as fd:
+    count = json.load(fd)['document_count']
+  # Renaming is idempotent, so a restart moves whatever is left.
+  for fn in os.listdir(staging):
+    if fn != MERGED_FN:
+      os.rename(os.path.join(staging, fn), os.path.join(base_dir, fn))
+  os.remove(merged_fn)
+  os.rmdir(staging)
+  return count
+
+def build_parallel(api_key, queries, journals, base_dir, desc, processes=4,
+                   limit=None, shard_size=20000, query_args=None, on_part=None,
+                   resume=False, **builder_args):
+  """
+  Build a corpus from the results of a query with several processes.
+
+  @type processes: int
+  @param processes: number of worker processes.
+  @type limit: int
+  @param limit: largest number of articles, taken from the parts in
+                order. None for all.
+  @type shard_size: int
+  @param shard_size: largest number of articles in a part, see ShardedQuery.
+  @type query_args: dict
+  @param query_args: passed on to each part's Query, e.g. prefetch.
+  @type on_part: callable
+  @param on_part: called with the part index, its number of articles
+                  and its builder stats as each part finishes. The count
+                  and stats are None for a part kept from an earlier run.
+  @param builder_args: passed on to each part's Plos_builder. split
+                       defaults to, and must be, 'hash'.
+
+  @rtype: int
+  @return: number of articles in the corpus.
+  """
+  builder_args.setdefault('split', 'hash')
+  # The parts need no database of their own, the merge writes it.
+  metadata_db = builder_args.pop('metadata_db', False)
+  if builder_args['split'] != 'hash':
+    raise ValueError('build_parallel: only the hash split is supported')
+  query_args = {} if query_args is None else query_args
+  if not (resume and os.path.isdir(base_dir)):
+    os.mkdir(base_dir)
+  parts_dir = os.path.join(base_dir, PARTS_DIR)
+  if not os.path.isdir(parts_dir):
+    os.mkdir(parts_dir)
+
+  shards = ShardedQuery(api_key, queries, ['id'], journals, shard_size=shard_size).plan()
+  tasks = []
+  remaining = limit
+  for i, shard in enumerate(shards):
+    count = shard.numFound if remaining is None else min(shard.numFound, remaining)
+    if count == 0:
+      break
+    part_dir = os.path.join(parts_dir, PART_FN.format(n=i))
+    tasks.append((i, part_dir, api_key, shard.queries, shard.journals, count,
+                  desc, builder_args, query_args))
+    if remaining is not None:
+      remaining -= count
+
+  pool = multiprocessing.Pool(processes, initializer=_init_worker)
+  try:
+    for (i, count, stats) in pool.imap_unordered(_build_part, tasks):
+      if on_part is not None:
+        on_part(i, count, stats)
+    pool.close()
+  except BaseException:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+  train = builder_args.get('train', 0)
+  train_ratio = builder_args.get('train_ratio')
+  if train_ratio is None:
+    train_ratio = 1.0 / train if train > 0 else 0.0
+  views = ('partial', 'training') if train_ratio > 0 else ('partial',)
+  count = merge_parts(base_dir, [ t[1] for t in tasks ], queries, desc, views, metadata_db)
+  shutil.rmtree(parts_dir)
+  return count
@@ -11,7 +11,9 @@ PLOS solr api. http://api.plos.org/search
   There are 3 different types of corpora created "full', "partial" and "training". 
   The the "full" corpus includes both the partial and training articles. The 
   "partial" is intended for experimentation. The "training" corpus is a smaller 
-  subset of "full" that is not in "partial" that can be used to train classifiers.  
+  subset of "full" that is not in "partial" that can be used to train classifiers.
+  The article metadata is stored once, in full_corpus_info.json, together with a
+  membership bitmap for the "partial" and "training" views.  
     
   In a sense there is no such thing as a definative PLoS corpus. A corpus can
   be created based on a set of selection criteria submitted to the Solr search
@@ -63,6 +65,109 @@ Options:
                           a training corpus.
                           [default: 10]
 
+  --split=<mode>          how documents are assigned to the training
+                          corpus. "count" takes every n'th document in
+                          build order, "hash" uses a hash of the DOI so
+                          the split does not depend on the order.
+                          [default: count]
+
+  --train-ratio=<r>       fraction of documents put in the training
+                          corpus with --split=hash. Defaults to 1/n for
+                          --train=n.
+
+  --split-seed=<n>        seed of the DOI hash for --split=hash.
+                          [default: 0]
+
+  -p --prefetch=<n>       number of result pages fetched ahead of the
+                          builder on background threads. 0 disables
+                          prefetching.
+                          [default: 2]
+
+  -w --workers=<n>        number of prefetch worker threads.
+                          [default: 1]
+
+  --adaptive              adjust the page size to keep each response near
+                          --target-secs and under --max-page-mb.
+
+  --target-secs=<secs>    target response time for --adaptive.
+                          [default: 5]
+
+  --max-page-mb=<mb>      largest response size for --adaptive.
+                          [default: 16]
+
+  --stream                parse documents as they arrive instead of
+                          reading whole pages. Ignores --prefetch.
+
+  --two-phase             fetch the metadata of all matching articles first
+                          and the abstract and body only for the ones kept.
+
+  --subjects=<list>       with --two-phase, keep only articles with at
+                          least one of these subjects. Comma separated.
+
+  --text-batch=<n>        with --two-phase, number of article texts
+                          fetched per request.
+                          [default: 20]
+
+  --writers=<n>           number of threads writing article files while
+                          the next articles are fetched. 0 writes them
+                          in the fetching thread.
+                          [default: 2]
+
+  --write-queue=<n>       most articles waiting for a writer thread.
+                          [default: 64]
+
+  --storage=<fmt>         "files" writes two text files per article,
+                          "packed" appends the text to a few large
+                          shard files with an offset index.
+                          [default: files]
+
+  --shard-mb=<mb>         size of each shard file for --storage=packed.
+                          [default: 256]
+
+  --compress=<level>      zlib level (1-9) for --storage=packed text.
+                          0 stores it uncompressed.
+                          [default: 0]
+
+  --tokenize              tokenize and sentence split the text while
+                          building and store it as token-ID arrays,
+                          so words() and sents() need no tokenizing.
+
+  --sqlite                also write the metadata to an indexed SQLite
+                          database, full_corpus_info.db.
+
+  --processes=<n>         build with n worker processes, each building
+                          a disjoint part of the query that is merged
+                          into the corpus at the end. Requires
+                          --split=hash. 0 builds in this process.
+                          [default: 0]
+
+  --part-size=<n>         largest number of articles in one part for
+                          --processes.
+                          [default: 20000]
+
+  --resume                continue an interrupted build in --out-dir from
+                          its last checkpoint.
+
+  --facets=<list>         fields whose value counts are shown before the
+                          build starts. Comma separated.
+                          [default: subject]
+
+  --dry-run               show the planned corpus size and facet counts
+                          without downloading any articles.
+
+  --cache-dir=<dir>       cache solr responses on disk in this directory.
+                          Repeated builds with the same query are served
+                          from the cache.
+
+  --cache-ttl=<secs>      seconds a cached response stays valid.
+                          [default: 604800]
+
+  --cache-size=<mb>       size budget of the response cache in megabytes.
+                          Least recently used entries are evicted.
+                          [default: 2048]
+
+  --offline               serve responses only from the cache.
+
 Author:
   Bill OConnor
 
@@ -73,11 +178,18 @@ Copyright (c) 2012-2014 OA_NLP Project
 """
 from __future__ import division
 
-import os, sys, nltk, json, codecs
-from util import doi2fn, field_list_to_dict
+import os, sys, nltk, json, codecs, time, heapq, itertools, threading
+from Queue import Queue
+from util import doi2fn, field_list_to_dict, pack_members, doi_fraction
+from packed import Packed_writer
+from tokens import Token_writer
+from metadb import write_metadata_db, metadata_db_fn
+from corpus_index import write_corpus_index, corpus_index_fn
 from datetime import datetime
-from collections import defaultdict, OrderedDict
-from oa_nlp.plos_api.solr import article_page_url, article_xml_url, Query
+from collections import OrderedDict
+from oa_nlp.plos_api.solr import article_page_url, article_xml_url, Query, set_cache, \
+                                 lookup_dois
+from oa_nlp.plos_api.cache import ResponseCache
 
 __version__ = "0.1"
 __all__ = ['Plos_builder',]
@@ -87,18 +199,97 @@ QUERY_RTN_FLDS = ('id','journal','publication_date',
                   'article_type','author','subject',
                   'title','abstract','body','editor',
                  )
+# Two phase builds fetch the metadata first and the text only for the
+# articles that are kept.
+METADATA_RTN_FLDS = tuple([ f for f in QUERY_RTN_FLDS if f not in ('abstract', 'body') ])
+TEXT_RTN_FLDS = ('id', 'abstract', 'body')
+
+# Build progress, removed once the corpus is finalized.
+CHECKPOINT_FN = 'build_checkpoint.json'
+COMPLETED_FN = 'build_completed.log'
+
+def _sorted_runs(lines, tmp_prefix, run_size):
+  """
+  Sort lines with at most run_size of them in memory. Each sorted run is
+  written to a temporary file and the runs are merged while reading.
+  Yields the sorted lines.
+  """
+  runs = []
+  def flush(run):
+    fn = '{p}.{n}'.format(p=tmp_prefix, n=len(runs))
+    with open(fn, 'wb') as fd:
+      fd.writelines(sorted(run))
+    runs.append(fn)
+  run = []
+  for line in lines:
+    run.append(line)
+    if len(run) >= run_size:
+      flush(run)
+      run = []
+  if run:
+    flush(run)
+  fds = [ open(fn, 'rb') for fn in runs ]
+  try:
+    for line in heapq.merge(*fds):
+      yield line
+  finally:
+    for fd in fds:
+      fd.close()
+    for fn in runs:
+      os.remove(fn)
+  return
+
+def read_records(fn):
+  """
+  Read a Corpus_info records file. A partial last line, left by a
+  crash, is ignored.
+  """
+  with open(fn, 'rb') as fd:
+    for line in fd:
+      if line.endswith('\n'):
+        yield json.loads(line, object_pairs_hook=OrderedDict)
+  return
+
 class Corpus_info(object):
   """
   Tracks various info related to a corpus.
+
+  Nothing is kept in memory per article. Each article is appended as one
+  JSON record to {name}_corpus_info.jsonl as soon as it is retained, so
+  the metadata of a crashed build is not lost. finalize() derives
+  {name}_corpus_info.json, in the format Plos_reader loads, from the
+  records in a few passes over the file, and then removes the records
+  unless asked to keep them. categories_to_dois is grouped by an
+  external sort so memory stays bounded there as well.
+
+  Each record carries the build sequence number of the article, which
+  restore() uses to drop the records past a checkpoint, and the view the
+  article belongs to. The info file stores the views as bitmaps over the
+  articles in build order instead of repeating their metadata.
+
+  finalize() also writes the DOIs, view bitmaps and metadata columns to
+  the compact index {name}_corpus_index.dat (see corpus_index.py), from
+  which the reader opens a corpus without parsing the info file.
+
+  With metadata_db=True finalize() also writes the metadata to the
+  indexed SQLite database {name}_corpus_info.db, see metadb.py.
   """
-  def __init__(self, query, base_dir, desc):
-    self.creation_date = datetime.now().isoformat()
+  def __init__(self, query, base_dir, desc, name='full', views=(), sort_run=100000,
+                     creation_date=None, metadata_db=False):
+    if creation_date is None:
+      creation_date = datetime.now().isoformat()
+    self.creation_date = creation_date
     self.desc = desc
     self.doc_count = 0
     self.query = query
-    self.categories_to_dois = defaultdict(list)
-    self.dois_to_categories = dict()
-    self.doi_article_info = OrderedDict()
+    self.name = name
+    self.views = views
+    self.sort_run = sort_run
+    self.records_fn = '{d}/{n}_corpus_info.jsonl'.format(d=base_dir, n=name)
+    self.info_fn = '{d}/{n}_corpus_info.json'.format(d=base_dir, n=name)
+    self.index_fn = corpus_index_fn(base_dir, name)
+    self.db_fn = metadata_db_fn(base_dir, name) if metadata_db else None
+    self._records = open(self.records_fn, 'ab')
     return
 
   def _article_info(self, doc, doi):
@@ -113,53 +304,470 @@ class Corpus_info(object):
     article_info['abstract_fid'] = doi2fn(doi, 'abstract')
     return article_info
 
-  def retain_info(self, doc, doi):
+  def retain_info(self, doc, doi, seq, view=None):
     subjs = [] if 'subject' not in doc else doc['subject']
-    self.dois_to_categories[doi] = subjs
+    record = OrderedDict( [ ('seq', seq),
+                            ('view', view),
+                            ('doi', doi),
+                            ('categories', subjs),
+                            ('info', self._article_info(doc, doi)) ] )
+    self._write_record(record)
+    return
 
-    # Category -> [ f1, f2, .... ]
-    for s in subjs:
-      self.categories_to_dois[s].append(doi)
+  def retain_record(self, record):
+    """
+    Add a record read from another Corpus_info, e.g. when merging the
+    parts of a parallel build. It is renumbered to follow this one's.
+    """
+    record['seq'] = self.doc_count
+    self._write_record(record)
+    return
 
-    self.doi_article_info[doi] =  self._article_info(doc, doi)
+  def _write_record(self, record):
+    self._records.write(json.dumps(record) + '\n')
+    self._records.flush()
     self.doc_count += 1
     return
 
-  def finalize(self):
-    return OrderedDict( [
+  def sync(self):
+    """
+    sync - make the records written so far durable.
+    """
+    self._records.flush()
+    os.fsync(self._records.fileno())
+    return
+
+  def restore(self, count):
+    """
+    restore - keep only the records of the first count articles built,
+              for resuming from a checkpoint.
+    """
+    self._records.close()
+    tmp = self.records_fn + '.tmp'
+    self.doc_count = 0
+    with open(tmp, 'wb') as fd:
+      for rec in self.read_records():
+        if rec['seq'] < count:
+          fd.write(json.dumps(rec) + '\n')
+          self.doc_count += 1
+    os.rename(tmp, self.records_fn)
+    self._records = open(self.records_fn, 'ab')
+    return
+
+  def read_records(self):
+    """
+    The records retained so far, in build order.
+    """
+    return read_records(self.records_fn)
+
+  def _write_mapping(self, fd, key, items):
+    # items is a sequence of (key, value) written as one JSON object. A
+    # value that is an iterator is written as a list without building it.
+    fd.write('  {k}: {{'.format(k=json.dumps(key)))
+    sep = '\n'
+    for k, v in items:
+      fd.write('{s}    {k}: '.format(s=sep, k=json.dumps(k)))
+      if isinstance(v, (list, dict)):
+        fd.write(json.dumps(v))
+      else:
+        fd.write('[')
+        vsep = ''
+        for x in v:
+          fd.write(vsep + json.dumps(x))
+          vsep = ', '
+        fd.write(']')
+      sep = ',\n'
+    fd.write('\n  }')
+    return
+
+  def _categories_to_dois(self):
+    # Sort [category, seq, doi] lines, seq zero padded so the DOIs of each
+    # category come out in build order. Lines of one category share the
+    # prefix '["category",' so sorting the JSON text groups them.
+    def lines():
+      for seq, rec in enumerate(self.read_records()):
+        for c in rec['categories']:
+          yield json.dumps([c, '{n:012d}'.format(n=seq), rec['doi']]) + '\n'
+    rows = ( json.loads(l) for l in _sorted_runs(lines(), self.records_fn + '.sort',
+                                                 self.sort_run) )
+    for cat, grp in itertools.groupby(rows, lambda r : r[0]):
+      yield (cat, ( doi for c,seq,doi in grp ))
+    return
+
+  def _views(self):
+    members = dict([ (v, []) for v in self.views ])
+    for i, rec in enumerate(self.read_records()):
+      if rec['view'] in members:
+        members[rec['view']].append(i)
+    return OrderedDict([ (v, OrderedDict([ ('document_count', len(members[v])),
+                                           ('members', pack_members(members[v], self.doc_count)) ]))
+                         for v in self.views ])
+
+  def finalize(self, keep_records=False):
+    """
+    Write the corpus info file from the streamed records.
+
+    @type keep_records: bool
+    @param keep_records: leave the records file in place, e.g. for
+                         merge_parts() or for the caller to remove.
+    """
+    self._records.close()
+    header = OrderedDict( [
         ('desc', self.desc),
         ('document_count',  self.doc_count),
         ('creation_date', self.creation_date),
         ('query', self.query),
-        ('categories_to_dois', self.categories_to_dois),
-        ('dois_to_categories', self.dois_to_categories),
-        ('doi_article_info', self.doi_article_info)
+        ('views', self._views()),
         ] )
+    tmp = self.info_fn + '.tmp'
+    with open(tmp, 'wb') as fd:
+      fd.write('{\n')
+      for k, v in header.items():
+        fd.write('  {k}: {v},\n'.format(k=json.dumps(k), v=json.dumps(v)))
+      self._write_mapping(fd, 'categories_to_dois', self._categories_to_dois())
+      fd.write(',\n')
+      self._write_mapping(fd, 'dois_to_categories',
+                          ( (r['doi'], r['categories']) for r in self.read_records() ))
+      fd.write(',\n')
+      self._write_mapping(fd, 'doi_article_info',
+                          ( (r['doi'], r['info']) for r in self.read_records() ))
+      fd.write('\n}\n')
+    os.rename(tmp, self.info_fn)
+    write_corpus_index(self.index_fn, self.read_records(), header['views'])
+    if self.db_fn is not None:
+      # View membership is a column of the database.
+      header['views'] = OrderedDict([ (v, OrderedDict([ ('document_count', m['document_count']) ]))
+                                      for v,m in header['views'].items() ])
+      write_metadata_db(self.db_fn, header, self.read_records())
+    if not keep_records:
+      os.remove(self.records_fn)
+    return
+
+class _Stage(object):
+  """
+  Item count and busy time of one stage of the build pipeline.
+  """
+  def __init__(self, name):
+    self.name = name
+    self.items = 0
+    self.secs = 0.0
+    self._lock = threading.Lock()
+
+  def add(self, secs, items=1):
+    with self._lock:
+      self.items += items
+      self.secs += secs
+    return
+
+  def report(self):
+    rate = self.items / self.secs if self.secs > 0 else 0.0
+    return OrderedDict( [ ('items', self.items),
+                          ('busy_secs', round(self.secs, 3)),
+                          ('items_per_sec', round(rate, 1)) ] )
 
 class Plos_builder(object):
   """
   OA_NLP corpus builder for NLTK compatibility.
+
+  With writers > 0 the abstract and body files are written by a pool of
+  writer threads fed through a queue holding at most write_queue
+  documents, so fetching the next documents overlaps with disk I/O. The
+  corpus metadata is still updated only by the thread calling add().
+
+  storage selects how the text is stored: 'files' writes a body and an
+  abstract file per article, 'packed' appends the text to shard files of
+  about shard_bytes each (see packed.py). Packed text can be compressed
+  with zlib at compress_level, each document on its own so it can still
+  be read without decompressing its neighbours.
+
+  Progress is checkpointed while building. Every article whose text has
+  been written is logged in build_completed.log, and every
+  checkpoint_every articles build_checkpoint.json records how many
+  articles, in build order, are complete together with the position of
+  the input after the last of them. With resume=True an existing base_dir
+  is continued from its checkpoint: metadata past the checkpoint is
+  dropped, build() is given the input positioned by resume_point(), and
+  articles that were already written are recorded again but not
+  rewritten. The result is the same as that of an uninterrupted build.
+  Leaving a with block on an exception checkpoints instead of finalizing.
+  The checkpoint records whether the build was made by build() or
+  build_two_phase(), and it can only be resumed the same way. Passing
+  two_phase checks this when the builder is created. The checkpoint
+  and the metadata records, full_corpus_info.jsonl, are removed once the
+  build is finalized, the records are kept with keep_records=True.
+
+  split selects how articles are assigned to the training view. 'count'
+  takes every train'th article in build order. 'hash' takes an article
+  if doi_fraction(doi, split_seed) < train_ratio, 1/train if not given,
+  so the split is reproducible and does not depend on the order or on
+  which process added the article.
+
+  With tokenize=True the text is also tokenized and sentence split while
+  it is written and stored as token-ID arrays (see tokens.py), so the
+  reader serves words() and sents() without tokenizing. word_tokenizer
+  and sent_tokenizer default to those of NLTK's plaintext reader.
+
+  With metadata_db=True the metadata is also written to an indexed SQLite
+  database the reader can query instead of loading the info file.
   """
-  def __init__(self, query, base_dir, desc, train=0):
+  def __init__(self, query, base_dir, desc, train=0, writers=0, write_queue=64,
+                     storage='files', shard_bytes=256*1024**2, compress_level=0,
+                     resume=False, checkpoint_every=500,
+                     split='count', train_ratio=None, split_seed=0,
+                     tokenize=False, word_tokenizer=None, sent_tokenizer=None,
+                     metadata_db=False, two_phase=None, keep_records=False):
+    if storage not in ('files', 'packed'):
+      raise ValueError('Plos_builder: unknown storage ' + storage)
+    if split not in ('count', 'hash'):
+      raise ValueError('Plos_builder: unknown split ' + split)
+    if train_ratio is None:
+      train_ratio = 1.0 / train if train > 0 else 0.0
+    if not 0.0 <= train_ratio <= 1.0:
+      raise ValueError('Plos_builder: train_ratio must be in [0, 1]')
+    if compress_level > 0 and storage != 'packed':
+      raise ValueError('Plos_builder: compression requires packed storage')
     self.base_dir = base_dir
+    self.keep_records = keep_records
     self.doc_total_count = 0
-    self.full_corpus_info = Corpus_info(query, base_dir, desc)
-    self.corpus_info = Corpus_info(query, base_dir, desc)
+    self._checkpoint_fn = os.path.join(base_dir, CHECKPOINT_FN)
+    self._completed_fn = os.path.join(base_dir, COMPLETED_FN)
+    checkpoint = None
+    if resume and os.path.isdir(base_dir):
+      checkpoint = self._read_checkpoint()
+    else:
+      os.mkdir(base_dir)
+    created = None if checkpoint is None else checkpoint['creation_date']
     self.train = train
-    self.trainer_info = None if train < 1 else Corpus_info(query, base_dir, desc)
-    os.mkdir(base_dir)
+    self.split = split
+    self.train_ratio = train_ratio
+    self.split_seed = split_seed
+    has_training = train > 0 if split == 'count' else train_ratio > 0
+    views = ('partial', 'training') if has_training else ('partial',)
+    self.corpus_info = Corpus_info(query, base_dir, desc, 'full', views, creation_date=created,
+                                   metadata_db=metadata_db)
+    self.checkpoint_every = checkpoint_every
+    self._progress_lock = threading.Lock()
+    self._done = set()
+    self._inputs = {}
+    self._untrained = []
+    self._written = set()
+    self._prefix = 0
+    self._input_state = None
+    self._mode = None
+    if checkpoint is not None:
+      self._restore(checkpoint)
+    if two_phase is not None:
+      self._set_mode('two_phase' if two_phase else 'one_phase')
+    self.storage = storage
+    self._packed = None
+    if storage == 'packed':
+      self._packed = Packed_writer(base_dir, shard_bytes, level=compress_level)
+    self._tokens = None
+    if tokenize:
+      self._tokens = Token_writer(base_dir, word_tokenizer, sent_tokenizer)
+    self._completed = open(self._completed_fn, 'ab')
+    self._checkpointed = self._prefix
+    self._write_checkpoint()
+    self._start_time = time.time()
+    self._stages = OrderedDict([ (n, _Stage(n)) for n in ('fetch', 'metadata', 'write') ])
+    self._write_error = None
+    self._write_queue = None
+    self._writers = []
+    if writers > 0:
+      self._write_queue = Queue(maxsize=write_queue)
+      self._writers = [ threading.Thread(target=self._write_loop) for _ in range(writers) ]
+      for t in self._writers:
+        t.daemon = True
+        t.start()
     return
 
   def __enter__(self):
     return self
 
   def __exit__(self, type, value, traceback):
-    self.finalize()
+    if type is None:
+      self.finalize()
+    else:
+      # Leave the build to be resumed rather than finalize a partial corpus.
+      self.abort()
+
+  def abort(self):
+    """
+    Stop the writer threads and checkpoint what has been completed,
+    without finalizing the corpus.
+    """
+    try:
+      self._stop_writers()
+    except Exception:
+      pass
+    self._write_checkpoint()
+    return
+
+  def _read_checkpoint(self):
+    if not os.path.isfile(self._checkpoint_fn):
+      raise ValueError('Plos_builder: no build to resume in ' + self.base_dir)
+    with open(self._checkpoint_fn, 'r') as fd:
+      return json.load(fd)
+
+  def _restore(self, checkpoint):
+    """
+    Roll the metadata back to the checkpoint and find the articles past
+    it that were already written.
+    """
+    count = checkpoint['count']
+    self.corpus_info.restore(count)
+    self.doc_total_count = self._prefix = count
+    self._input_state = checkpoint['input']
+    self._mode = checkpoint.get('mode')
+    if self._mode is None and self._input_state is not None:
+      # Checkpoints written before the mode was recorded.
+      self._mode = 'two_phase' if 'selected' in self._input_state else 'one_phase'
+    with open(self._completed_fn, 'rb') as fd:
+      for line in fd:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) == 2 and int(fields[0]) >= count:
+          self._written.add(fields[1].decode('utf-8'))
+    return
+
+  def _set_mode(self, mode):
+    """
+    Record how the build is made, 'one_phase' or 'two_phase'. A resumed
+    build has to be continued the way it was started.
+    """
+    if self._mode is not None and self._mode != mode:
+      names = { 'one_phase': 'build()', 'two_phase': 'build_two_phase() (--two-phase)' }
+      raise ValueError('Plos_builder: the build in {d} was started with {s}, '
+                       'resume it the same way'.format(d=self.base_dir, s=names[self._mode]))
+    self._mode = mode
+    return
+
+  def resume_point(self):
+    """
+    The input position after the last checkpointed article, as recorded
+    by build() (see Query.checkpoint()), or None for a new build. If the
+    input had no position the whole input is to be skipped up to the
+    checkpoint.
+    """
+    if self._input_state is None and self._prefix > 0:
+      return { 'paging': None, 'start': 0, 'cursor_mark': None, 'skip': self._prefix }
+    return self._input_state
+
+  def _write_checkpoint(self):
+    """
+    Make everything up to the current prefix durable, then record it.
+    Only called from the thread calling add().
+    """
+    self.corpus_info.sync()
+    if self._packed is not None:
+      self._packed.sync()
+    if self._tokens is not None:
+      self._tokens.sync()
+    with self._progress_lock:
+      self._completed.flush()
+      os.fsync(self._completed.fileno())
+      checkpoint = { 'count': self._prefix,
+                     'input': self._input_state,
+                     'mode': self._mode,
+                     'creation_date': self.corpus_info.creation_date }
+    tmp = self._checkpoint_fn + '.tmp'
+    with open(tmp, 'w') as fd:
+      json.dump(checkpoint, fd)
+      fd.flush()
+      os.fsync(fd.fileno())
+    os.rename(tmp, self._checkpoint_fn)
+    self._checkpointed = checkpoint['count']
+    return
+
+  def _complete(self, seq, doi):
+    """
+    Log an article whose text is written and advance the prefix of
+    articles that are all complete.
+    """
+    with self._progress_lock:
+      self._completed.write(u'{s}\t{d}\n'.format(s=seq, d=doi).encode('utf-8'))
+      self._completed.flush()
+      self._done.add(seq)
+      while self._prefix in self._done:
+        self._done.remove(self._prefix)
+        self._input_state = self._inputs.pop(self._prefix, self._input_state)
+        self._prefix += 1
+    return
+
+  def _write_loop(self):
+    while True:
+      item = self._write_queue.get()
+      if item is None:
+        return
+      (doc, doi, seq) = item
+      # Keep draining after an error so add() never blocks on a full queue.
+      if self._write_error is not None:
+        continue
+      try:
+        self._timed_write(doc, doi, seq)
+      except Exception as e:
+        self._write_error = e
+
+  def _timed_write(self, doc, doi, seq):
+    t0 = time.time()
+    self._write_doc(self.base_dir, doc, doi)
+    self._stages['write'].add(time.time() - t0)
+    if self._packed is not None:
+      with self._progress_lock:
+        # Packed text held back for the dictionary is not written yet.
+        self._untrained.append((seq, doi))
+        if self._packed.training():
+          return
+        untrained, self._untrained = self._untrained, []
+      for (s, d) in untrained:
+        self._complete(s, d)
+    else:
+      self._complete(seq, doi)
+    return
+
+  def _stop_writers(self):
+    for _ in self._writers:
+      self._write_queue.put(None)
+    for t in self._writers:
+      t.join()
+    self._writers = []
+    if self._write_error is not None:
+      raise self._write_error
+    return
+
+  def _timed(self, docs):
+    """
+    Iterate over docs, charging the time spent waiting to the fetch stage.
+    """
+    it = iter(docs)
+    while True:
+      t0 = time.time()
+      try:
+        doc = next(it)
+      except StopIteration:
+        return
+      self._stages['fetch'].add(time.time() - t0)
+      yield doc
+
+  def stats(self):
+    """
+    Per stage item counts and throughput. With writer threads the write
+    stage busy time is summed over all writers.
+    """
+    stats = OrderedDict([ (n, s.report()) for n,s in self._stages.items() ])
+    stats['wall_secs'] = round(time.time() - self._start_time, 3)
+    return stats
 
   def _write_doc(self, base_dir, doc, doi):
     """
     Write the abstract and body files.
     """
+    if self._tokens is not None:
+      self._tokens.add(doi2fn(doi, 'body'), doc['body'])
+      self._tokens.add(doi2fn(doi, 'abstract'), doc['abstract'][0])
+    if self._packed is not None:
+      self._packed.add(doi2fn(doi, 'body'), doc['body'])
+      self._packed.add(doi2fn(doi, 'abstract'), doc['abstract'][0])
+      return
     fn_body = '{d}/{f}'.format(d=base_dir, f=doi2fn(doi, 'body'))
     fn_abstract = '{d}/{f}'.format(d=base_dir, f=doi2fn(doi, 'abstract'))
     with codecs.open(fn_body, 'w', encoding='utf-8') as fd_body:
@@ -168,7 +776,13 @@ class Plos_builder(object):
       fd_abstract.write(doc['abstract'][0])
     return
   
-  def build(self, docs):
+  def _set_input(self, state):
+    # Input position after the doc about to be added.
+    with self._progress_lock:
+      self._inputs[self.doc_total_count] = state
+    return
+
+  def build(self, docs, on_add=None, skip=0):
     """
     Create a txt file for each doc returned by the query.
     Then create a corpus info file.
@@ -176,13 +790,90 @@ class Plos_builder(object):
     @type docs: generator 
     @param docs: A list containing the results of a PLoS search query.
                  Each item is a dictionary with QUERY_RTN_FLDS as keys.
+                 If it has a checkpoint() method, like Query, its result
+                 is saved with the build checkpoints.
+    @type on_add: callable
+    @param on_add: called with each doc before it is added.
+    @type skip: int
+    @param skip: number of leading docs to pass over, the 'skip' of a
+                 resume_point().
 
     @return: Nothing
     """
-    for doc in docs:
+    self._set_mode('one_phase')
+    checkpoint = getattr(docs, 'checkpoint', None)
+    for doc in self._timed(docs):
+      if skip > 0:
+        skip -= 1
+        continue
+      if on_add is not None:
+        on_add(doc)
+      if checkpoint is not None:
+        self._set_input(checkpoint())
       self.add(doc)
     return
 
+  def build_two_phase(self, docs, api_key, select=None, batch_size=20, workers=4):
+    """
+    Build the corpus from metadata only documents. Documents accepted by
+    select are kept, then their abstract and body are fetched in batches
+    of DOIs and each completed document is added as in build().
+
+    @type docs: generator
+    @param docs: results of a query for METADATA_RTN_FLDS.
+    @type select: callable
+    @param select: select(doc) returns True to keep the article. None
+                   keeps all of them.
+    @type batch_size: int
+    @param batch_size: number of article texts fetched per request.
+    @type workers: int
+    @param workers: number of text requests in flight.
+
+    A resumed build passes over the selected documents before its
+    resume_point(). The text of documents that were already written is
+    not fetched again.
+
+    @rtype: list
+    @return: DOIs whose text could not be found. They are not added.
+    """
+    self._set_mode('two_phase')
+    selected = OrderedDict()
+    position = 0 if self._input_state is None else self._input_state['selected']
+    skip = position
+    for doc in docs:
+      if select is None or select(doc):
+        if skip > 0:
+          skip -= 1
+        else:
+          selected[doc['id']] = doc
+
+    missing = []
+    fetch = [ d for d in selected.keys() if d not in self._written ]
+    texts = self._timed(lookup_dois(api_key, fetch, TEXT_RTN_FLDS, missing,
+                                    batch_size=batch_size, workers=workers))
+    text = next(texts, None)
+    for doi, doc in selected.items():
+      position += 1
+      if doi not in self._written:
+        if text is None or text[0] != doi:
+          # Not found, lookup_dois went on to the next one.
+          continue
+        doc.update(text[1])
+        text = next(texts, None)
+      self._set_input({ 'selected': position })
+      self.add(doc)
+    return missing
+
+  def _view(self, doi):
+    """
+    The view, 'training' or 'partial', of the article being added.
+    """
+    if self.split == 'hash':
+      in_training = doi_fraction(doi, self.split_seed) < self.train_ratio
+    else:
+      in_training = (self.train > 0) and (self.doc_total_count % self.train) == 0
+    return 'training' if in_training else 'partial'
+
   def add(self, doc):
     """
     Create an abstract and body file for each doc in the document list.
@@ -192,38 +883,67 @@ class Plos_builder(object):
 
     @return: Nothing
     """
+    if self._write_error is not None:
+      raise self._write_error
     # Build all the lists and mappings
+    t0 = time.time()
     doi = doc['id']
+    seq = self.doc_total_count
     self.doc_total_count += 1
 
-    self.full_corpus_info.retain_info(doc, doi)
-    if (self.train > 0) and  \
-       (self.doc_total_count % train) == 0:
-      self.trainer_info.retain_info(doc, doi)
-    else:
-      self.corpus_info.retain_info(doc, doi)
+    self.corpus_info.retain_info(doc, doi, seq, self._view(doi))
+    self._stages['metadata'].add(time.time() - t0)
     
-    self._write_doc(self.base_dir, doc, doi)
+    if doi in self._written:
+      # Written before the build was resumed.
+      self._written.discard(doi)
+      self._complete(seq, doi)
+    elif self._write_queue is not None:
+      self._write_queue.put((doc, doi, seq))
+    else:
+      self._timed_write(doc, doi, seq)
+    if self._prefix - self._checkpointed >= self.checkpoint_every:
+      self._write_checkpoint()
     return
  
   def finalize(self):
     """
-    Save the corpus info files.
+    Wait for any writer threads, then save the corpus info files.
     """
-    fn = '{d}/full_corpus_info.json'.format(d=self.base_dir)
-    with open(fn, 'w') as fd:
-      json.dump(self.full_corpus_info.finalize(), fd, indent=2 )
-
-    fn = '{d}/partial_corpus_info.json'.format(d=self.base_dir)
-    with open(fn, 'w') as fd:
-      json.dump(self.corpus_info.finalize(), fd, indent=2 )
-
-    if not self.trainer_info == None:
-      fn = '{d}/training_corpus_info.json'.format(d=self.base_dir)
-      with open(fn, 'w') as fd:
-        json.dump(self.trainer_info.finalize(), fd, indent=2 )
+    self._stop_writers()
+    if self._packed is not None:
+      self._packed.close()
+      for (seq, doi) in self._untrained:
+        self._complete(seq, doi)
+      self._untrained = []
+    if self._tokens is not None:
+      self._tokens.close()
+    # The records go last, a build can be resumed until the checkpoint
+    # is gone.
+    self.corpus_info.finalize(keep_records=True)
+    self._completed.close()
+    os.remove(self._completed_fn)
+    os.remove(self._checkpoint_fn)
+    if not self.keep_records:
+      os.remove(self.corpus_info.records_fn)
     return
 
+def show_plan(query, limit, facet_fields):
+  """
+  Print the planned corpus size and the value counts of facet_fields.
+  Only rows=0 requests are made, no article bodies are downloaded.
+  """
+  num_found = query.count()
+  print('Planned corpus size: {n} of {f} matching articles.'.format(
+        n=min(limit, num_found), f=num_found))
+  facets = query.facets(facet_fields)
+  for field in facet_fields:
+    print('{f}:'.format(f=field))
+    for value, count in facets[field]:
+      pct = 100 * count / num_found if num_found > 0 else 0
+      print(u'  {c:>8} {p:5.1f}%  {v}'.format(c=count, p=pct, v=value))
+  return num_found
+
 ####################### MAIN ##########################
 
 if __name__ == "__main__":
@@ -249,10 +969,88 @@ if __name__ == "__main__":
   train = int(args['--train'])
   if train == 1:
     sys.exit('--train must be greater than 1.')
+  train_ratio = None if args['--train-ratio'] is None else float(args['--train-ratio'])
+
+  if args['--cache-dir'] is not None:
+    set_cache(ResponseCache(args['--cache-dir'], 
+                            ttl=int(args['--cache-ttl']),
+                            max_bytes=int(args['--cache-size'])*1024**2,
+                            offline=args['--offline']))
+  elif args['--offline']:
+    sys.exit('--offline requires --cache-dir.')
   
-  pq = Query(api_key, queries, QUERY_RTN_FLDS, journal_ids, limit=limit)
-  with Plos_builder(queries, out_dir, desc, train=train) as builder:
-    for r in pq:
-      print('Processing: {d}'.format(d=r['id']))
-      builder.add(r)
-    print('{n} articles added to corpus.'.format(n=str(builder.doc_total_count)))
+  prefetch = 0 if args['--stream'] else int(args['--prefetch'])
+  fields = METADATA_RTN_FLDS if args['--two-phase'] else QUERY_RTN_FLDS
+  query_args = dict(prefetch=prefetch, workers=int(args['--workers']),
+                    adaptive=args['--adaptive'], target_secs=float(args['--target-secs']),
+                    max_page_bytes=int(args['--max-page-mb'])*1024**2,
+                    stream=args['--stream'])
+  pq = Query(api_key, queries, fields, journal_ids, limit=limit, **query_args)
+  show_plan(pq, limit, args['--facets'].split(','))
+  if args['--dry-run']:
+    sys.exit(0)
+
+  def on_add(doc):
+    print('Processing: {d}'.format(d=doc['id']))
+
+  processes = int(args['--processes'])
+  if processes > 0:
+    from parallel_builder import build_parallel
+    if args['--split'] != 'hash' or args['--two-phase']:
+      sys.exit('--processes requires --split=hash and no --two-phase.')
+    def on_part(i, count, stats):
+      if count is None:
+        print('Part {i} already built.'.format(i=i))
+      else:
+        print('Part {i}: {n} articles, {s}'.format(i=i, n=count, s=json.dumps(stats)))
+    n = build_parallel(api_key, queries, journal_ids, out_dir, desc, processes=processes,
+                       limit=None if args['--limit'] == '*' else limit,
+                       shard_size=int(args['--part-size']), query_args=query_args,
+                       on_part=on_part, resume=args['--resume'],
+                       train=train, train_ratio=train_ratio,
+                       split_seed=int(args['--split-seed']),
+                       writers=int(args['--writers']),
+                       write_queue=int(args['--write-queue']),
+                       storage=args['--storage'],
+                       shard_bytes=int(args['--shard-mb'])*1024**2,
+                       compress_level=int(args['--compress']),
+                       tokenize=args['--tokenize'],
+                       metadata_db=args['--sqlite'])
+    print('{n} articles added to corpus.'.format(n=n))
+    sys.exit(0)
+
+  with Plos_builder(queries, out_dir, desc, train=train, 
+                    split=args['--split'], train_ratio=train_ratio,
+                    split_seed=int(args['--split-seed']),
+                    writers=int(args['--writers']),
+                    write_queue=int(args['--write-queue']),
+                    storage=args['--storage'],
+                    shard_bytes=int(args['--shard-mb'])*1024**2,
+                    compress_level=int(args['--compress']),
+                    tokenize=args['--tokenize'],
+                    metadata_db=args['--sqlite'],
+                    two_phase=args['--two-phase'],
+                    resume=args['--resume']) as builder:
+    skip = 0
+    point = builder.resume_point()
+    if point is not None and not args['--two-phase']:
+      print('Resuming after {n} articles.'.format(n=builder.doc_total_count))
+      pq = Query(api_key, queries, fields, journal_ids, limit=limit,
+                 start=point['start'], cursor_mark=point['cursor_mark'],
+                 paging=point['paging'] or 'auto', **query_args)
+      skip = point['skip']
+    if args['--two-phase']:
+      select = None
+      if args['--subjects'] is not None:
+        subjects = set(args['--subjects'].split(','))
+        select = lambda doc : not subjects.isdisjoint(doc.get('subject', []))
+      missing = builder.build_two_phase(pq, api_key, select,
+                                        batch_size=int(args['--text-batch']),
+                                        workers=int(args['--workers']))
+      for doi in missing:
+        print('No text found for: {d}'.format(d=doi))
+    else:
+      builder.build(pq, on_add=on_add, skip=skip)
+  print('{n} articles added to corpus.'.format(n=str(builder.doc_total_count)))
+  for stage, stats in builder.stats().items():
+    print('{s}: {v}'.format(s=stage, v=json.dumps(stats)))
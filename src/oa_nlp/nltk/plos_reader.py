@@ -32,6 +32,50 @@ PLOS solr api. http://api.plos.org/search
   and DOIs. The NLTK super class is initialized using these ids. From that point on 
   PlosReader will have all the functionality of the CategorizedPlaintextCorpusReader.
 
+  The article metadata is kept once in full_corpus_info.json. The "partial" and
+  "training" corpus types are projected from it using the view membership 
+  bitmaps stored with it. Corpora built with a separate info file per type are
+  still read from those files.
+
+  A corpus built with --storage=packed keeps the text in shard files (see 
+  packed.py). The reader detects this and serves the same file identifiers 
+  from the shards, so fileids(), raw(), words() etc. work unchanged.
+
+  A corpus built with --tokenize also has its text stored as token-ID
+  arrays (see tokens.py). words() and sents() are then served from the
+  arrays without tokenizing, if the tokenizer configuration the arrays
+  record is that of the reader's tokenizers, and unless use_tokens=False.
+  The arrays are opened, and the tokenizers compared, on first use.
+
+  A corpus built with --sqlite has its metadata in an indexed SQLite 
+  database as well (see metadb.py). The reader then opens the database 
+  instead of loading the info file, and the metadata accessors and 
+  select_dois() are answered by queries. use_db=False loads the info file.
+
+  The DOIs and views are also kept in a compact, memory mapped index (see
+  corpus_index.py), so opening a corpus does not parse the info file. With
+  lazy=True the reader also defers building the file identifiers, the 
+  category map and opening packed text until they are 
+  first used. use_index=False ignores the index. bench_startup.py 
+  measures the time and memory to open a corpus.
+
+  columns() returns journal, article_type, publication_date and subject
+  as integer coded columns read from the index. Their predicates evaluate
+  to bitset masks that combine with &, | and ~ and turn into DOI or 
+  fileid lists for raw(), words() etc. (see columns.py).
+
+  category_fileids() and category_dois() take AND/OR/NOT expressions over
+  the subject categories, evaluated on the per-subject bitmaps the builder
+  stores in the index (see category_expr.py).
+
+  token_cache=DIR keeps the sentences of every document words() and
+  sents() tokenize in a size bounded cache in DIR (see token_cache.py),
+  keyed by the text and the tokenizers, so later passes, and later
+  readers with the same tokenizers, do not tokenize again. 
+  token_cache_size sets its size in bytes and build_token_cache() fills 
+  it in one pass. Token arrays, where the corpus has them and they were
+  made with the configuration of the cache, are still used first.
+
 Usage:
   plos_reader.py [options]  COMMAND CORPUS_NAME
     
@@ -69,13 +113,54 @@ License:
 Copyright (c) 2012-2014 OA_NLP Project
     
 """
-import json
-from util import doi2fn
+import os, json
+from collections import OrderedDict
+from util import doi2fn, unpack_members
+from packed import Packed_corpus, is_packed
+from tokens import Token_corpus, has_tokens, tokenizer_config
+from token_cache import Token_cache
+from metadb import Metadata_db, metadata_db_fn
+from corpus_index import Corpus_index, corpus_index_fn
+from columns import Metadata_columns, SINGLE_COLUMNS
+from category_expr import parse, evaluate
+from nltk.util import LazyMap, LazyConcatenation
 from nltk.corpus.reader.plaintext import  CategorizedPlaintextCorpusReader
 
 __version__ = '0.1.0'
 __author__ = 'Bill OConnor'
 
+def _project_view(info, view):
+  """
+  Restrict the full corpus info to the articles of view.
+  """
+  if view not in info['views']:
+    raise ValueError('Plos_reader: corpus has no {v} view'.format(v=view))
+  members = unpack_members(info['views'][view]['members'])
+  keep = set([ d for i,d in enumerate(info['doi_article_info'].keys()) if i in members ])
+  proj = OrderedDict([ (k, v) for k,v in info.items() 
+                       if k not in ('categories_to_dois', 'dois_to_categories', 'doi_article_info') ])
+  proj['document_count'] = len(keep)
+  cat_dois = [ (c, [ d for d in dois if d in keep ]) for c,dois in info['categories_to_dois'].items() ]
+  proj['categories_to_dois'] = dict([ (c, dois) for c,dois in cat_dois if dois ])
+  proj['dois_to_categories'] = OrderedDict([ (d, c) for d,c in info['dois_to_categories'].items() if d in keep ])
+  proj['doi_article_info'] = OrderedDict([ (d, a) for d,a in info['doi_article_info'].items() if d in keep ])
+  return proj
+
+# Packed text and token arrays not opened yet.
+_unopened = object()
+
+class _Category_map(object):
+  """
+  The cat_map given to NLTK. It is only read when the categories are
+  first used.
+  """
+  def __init__(self, reader):
+    self._reader = reader
+
+  def items(self):
+    part = self._reader._doc_part
+    return [ (doi2fn(d, part), cat) for d,cat in self._reader._doi_categories() ]
+
 class Plos_reader(CategorizedPlaintextCorpusReader):
   """
   """
@@ -99,9 +184,21 @@ class Plos_reader(CategorizedPlaintextCorpusReader):
     else:
       self._corpus_type = 'full'
     
-    fn = '{d}/{t}_corpus_info.json'.format(d=root, t=self._corpus_type)
-    with open( fn, 'r' ) as fp:
-      self._corpus_info = info = json.load(fp)
+    lazy = kwargs.pop('lazy', False)
+    self._corpus_dir = root
+    self._view = None if self._corpus_type == 'full' else self._corpus_type
+    self._info = None
+    self._index = None
+    self._columns = None
+    self._db = None
+    if kwargs.pop('use_db', True) and os.path.isfile(metadata_db_fn(root)):
+      self._db = Metadata_db(metadata_db_fn(root), self._view)
+    if kwargs.pop('use_index', True) and os.path.isfile(corpus_index_fn(root)):
+      self._index = Corpus_index(corpus_index_fn(root))
+      if self._view is not None and self._view not in self._index.views():
+        raise ValueError('Plos_reader: corpus has no {v} view'.format(v=self._view))
+    elif self._db is None and not lazy:
+      self._load_info()
 
     # doc_part is specific to PLoS and research article.
 	# 'abstract' and 'body' are currently supported.
@@ -113,24 +210,224 @@ class Plos_reader(CategorizedPlaintextCorpusReader):
     else:
       self._doc_part = doc_part = 'body'
     
-    if 'fileids' not in kwargs:
+    # None is resolved from dois() when the fileids are first used.
+    fileids = kwargs.pop('fileids', None)
+    if fileids is None and not lazy:
       fileids = [ doi2fn(d, doc_part) for d in self.dois() ] 
-    else:
-	    fileids =  kwargs['fileids']
     # cat_map f -> [ c1, c2, ...]
 	# The fileids depend on what the doc_part is ('body', 'abstract')
-    kwargs['cat_map'] = { doi2fn(d, doc_part) : cat for d,cat in info['dois_to_categories'].iteritems() }
+    kwargs['cat_map'] = _Category_map(self)
+
+    self._use_tokens = kwargs.pop('use_tokens', True)
+    # Token arrays that do not record their tokenizers were made with the
+    # defaults.
+    self._default_tokenizers = 'word_tokenizer' not in kwargs and \
+                               'sent_tokenizer' not in kwargs
+    # Token arrays are opened on first use, comparing the tokenizers
+    # loads them.
+    self._packed_corpus = self._token_corpus = _unopened
+    if not lazy:
+      self._packed_corpus = self._open_packed()
+    token_cache = kwargs.pop('token_cache', None)
+    token_cache_size = kwargs.pop('token_cache_size', 1024**3)
 	  # Subclass of Categorized Plaintext Corpus Reader
     CategorizedPlaintextCorpusReader.__init__(self, root, fileids, **kwargs)
+    # The cache is for the tokenizers the NLTK reader settled on.
+    if isinstance(token_cache, basestring):
+      token_cache = Token_cache(token_cache, self._word_tokenizer, self._sent_tokenizer,
+                                self._para_block_reader, token_cache_size)
+    self._token_cache = token_cache
+
+  def _load_info(self):
+    fn = '{d}/{t}_corpus_info.json'.format(d=self._corpus_dir, t=self._corpus_type)
+    if not os.path.isfile(fn):
+      fn = '{d}/full_corpus_info.json'.format(d=self._corpus_dir)
+    with open( fn, 'r' ) as fp:
+      info = json.load(fp, object_pairs_hook=OrderedDict)
+    if self._corpus_type != 'full' and 'views' in info:
+      info = _project_view(info, self._corpus_type)
+    self._info = info
+    return info
+
+  @property
+  def _corpus_info(self):
+    """
+    The corpus info, loaded when it is first used.
+    """
+    return self._load_info() if self._info is None else self._info
+
+  @property
+  def _fileids(self):
+    if self._fileid_list is None:
+      self._fileid_list = [ doi2fn(d, self._doc_part) for d in self.dois() ]
+    return self._fileid_list
+
+  @_fileids.setter
+  def _fileids(self, fileids):
+    self._fileid_list = fileids
+
+  def _open_packed(self):
+    root = self._corpus_dir
+    return Packed_corpus(root) if is_packed(root) else None
+
+  def _open_tokens(self):
+    root = self._corpus_dir
+    if not (self._use_tokens and has_tokens(root)):
+      return None
+    tokens = Token_corpus(root)
+    if not self._same_tokenizers(tokens.config):
+      tokens.close()
+      return None
+    return tokens
+
+  def _same_tokenizers(self, config):
+    """
+    True if token arrays made with config split as this reader does.
+    """
+    if config is None:
+      return self._default_tokenizers
+    try:
+      if self._token_cache is not None:
+        return config == self._token_cache.config
+      return config == tokenizer_config(self._word_tokenizer, self._sent_tokenizer,
+                                        self._para_block_reader)
+    except ValueError:
+      # Tokenizers that can not be described are never the same.
+      return False
+
+  @property
+  def _packed(self):
+    if self._packed_corpus is _unopened:
+      self._packed_corpus = self._open_packed()
+    return self._packed_corpus
+
+  @property
+  def _tokens(self):
+    if self._token_corpus is _unopened:
+      self._token_corpus = self._open_tokens()
+    return self._token_corpus
+
+  def _doi_categories(self):
+    """
+    (doi, categories) of every article.
+    """
+    if self._db is not None:
+      return self._db.categories()
+    return self._corpus_info['dois_to_categories'].iteritems()
+
+  def abspath(self, fileid):
+    """
+    Path pointer for fileid. In a packed corpus it points into a shard.
+    """
+    if self._packed is None:
+      return CategorizedPlaintextCorpusReader.abspath(self, fileid)
+    return self._packed.pointer(fileid)
+
+  def abspaths(self, fileids=None, include_encoding=False, include_fileid=False):
+    """
+    """
+    if self._packed is None:
+      return CategorizedPlaintextCorpusReader.abspaths(self, fileids, 
+                                                       include_encoding, include_fileid)
+    if fileids is None:
+      fileids = self._fileids
+    elif isinstance(fileids, basestring):
+      fileids = [fileids]
+    rslt = []
+    for f in fileids:
+      entry = (self._packed.pointer(f),)
+      if include_encoding:
+        entry += (self.encoding(f),)
+      if include_fileid:
+        entry += (f,)
+      rslt.append(entry if len(entry) > 1 else entry[0])
+    return rslt
+
+  def open(self, fileid):
+    """
+    """
+    if self._packed is None:
+      return CategorizedPlaintextCorpusReader.open(self, fileid)
+    return self._packed.pointer(fileid).open(self.encoding(fileid))
+
+  def _token_fileids(self, fileids, categories):
+    fileids = self._resolve(fileids, categories)
+    if fileids is None:
+      return self._fileids
+    if isinstance(fileids, basestring):
+      return [fileids]
+    return fileids
+
+  def _token_view(self, read, fileids, categories):
+    """
+    Concatenate read(fileid) over the resolved fileids. Documents without
+    token arrays, or all of them if the arrays were made with other
+    tokenizers, come from the token cache, or are tokenized by the NLTK
+    reader if there is none.
+    """
+    fileids = self._token_fileids(fileids, categories)
+    tokens = self._tokens
+    cache = self._token_cache
+    nltk_read = getattr(CategorizedPlaintextCorpusReader, read)
+    def doc(f):
+      if tokens is not None and f in tokens:
+        return getattr(tokens, read)(f)
+      if cache is not None:
+        return getattr(cache, read)(self.raw(f))
+      return nltk_read(self, f)
+    return LazyConcatenation(LazyMap(doc, fileids))
+
+  def words(self, fileids=None, categories=None):
+    """
+    """
+    if self._tokens is None and self._token_cache is None:
+      return CategorizedPlaintextCorpusReader.words(self, fileids, categories)
+    return self._token_view('words', fileids, categories)
+
+  def sents(self, fileids=None, categories=None):
+    """
+    """
+    if self._tokens is None and self._token_cache is None:
+      return CategorizedPlaintextCorpusReader.sents(self, fileids, categories)
+    return self._token_view('sents', fileids, categories)
+
+  def build_token_cache(self, fileids=None, categories=None):
+    """
+    build_token_cache - tokenize the documents not in the token cache yet.
+                        Returns the number tokenized.
+    """
+    if self._token_cache is None:
+      raise ValueError('Plos_reader: reader has no token_cache')
+    misses = self._token_cache.misses
+    for f in self._token_fileids(fileids, categories):
+      if self._tokens is None or f not in self._tokens:
+        self._token_cache.sents(self.raw(f))
+    return self._token_cache.misses - misses
 
   def dois(self):
     """
 	  """
+    if self._index is not None:
+      return self._index.dois(self._view)
+    if self._db is not None:
+      return self._db.dois()
     return self._corpus_info['dois_to_categories'].keys()
+
+  def _info_field(self, field, doi_lst):
+    """
+    List of (doi, value) of one article info field.
+    """
+    if self._db is not None:
+      return self._db.info_field(field, doi_lst)
+    article_info = self._corpus_info['doi_article_info']
+    _doi_lst = self.dois() if doi_lst == None else doi_lst
+    return [ (d, article_info[d][field]) for d in _doi_lst ]
     
   def article_info(self, doi_lst=None):
     """
     """
+    if self._db is not None:
+      return self._db.article_info(doi_lst)
     article_info = self._corpus_info['doi_article_info']
     _doi_list = self.dois() if doi_lst == None else doi_lst
     return [ (d, article_info[d]) for d in _doi_list ]
@@ -138,67 +435,117 @@ class Plos_reader(CategorizedPlaintextCorpusReader):
   def article_page_url(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    page_url = lambda doi : article_info[doi]['page_url']
-    _doi_list = self.dois() if doi_lst == None else doi_lst
-    return [ (d, page_url(d)) for d in _doi_list ]
+    return self._info_field('page_url', doi_lst)
 
   def article_xml_url(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    xml_url = lambda doi : article_info[doi]['xml_url']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, xml_url(d)) for d in _doi_lst ]
+    return self._info_field('xml_url', doi_lst)
 
   def doi_body_fid(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    body_fid = lambda doi : article_info[doi]['body_fid']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, body_fid(d)) for d in _doi_lst ]
+    return self._info_field('body_fid', doi_lst)
   
   def doi_abstract_fid(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    abstract_fid = lambda doi : article_info[doi]['abstract_fid']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, abstract_fid(d)) for d in _doi_lst ]    
+    return self._info_field('abstract_fid', doi_lst)
 
   def author(self, doi_lst=None):
     """
     Build a list of (doi , author) tuples.
 	  """
-    article_info = self._corpus_info['doi_article_info']
-    auth_tuple = lambda doi : tuple(article_info[doi]['author'])
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, auth_tuple(d)) for d in _doi_lst ] 
+    if self._db is not None:
+      return [ (d, tuple(a)) for d,a in self._db.authors(doi_lst) ]
+    return [ (d, tuple(a)) for d,a in self._info_field('author', doi_lst) ]
 
   def pub_date(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    pub_date = lambda doi : article_info[doi]['publication_date']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, pub_date(d)) for d in _doi_lst ]
+    return self._info_field('publication_date', doi_lst)
 
   def article_type(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    art_type = lambda doi : article_info[doi]['article_type']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, art_type(d)) for d in _doi_lst ]
+    return self._info_field('article_type', doi_lst)
 
   def title(self, doi_lst=None):
     """
     """
-    article_info = self._corpus_info['doi_article_info']
-    title = lambda doi : article_info[doi]['title']
-    _doi_lst = self.dois() if doi_lst == None else doi_lst
-    return [ (d, title(d)) for d in _doi_lst ]
+    return self._info_field('title', doi_lst)
+
+  def columns(self):
+    """
+    The metadata columns of the articles of this corpus type, see
+    columns.py. They are read from the corpus index, or built from the
+    metadata for a corpus whose index has no columns.
+
+    @rtype: Metadata_columns
+    """
+    if self._columns is not None:
+      return self._columns
+    if self._index is not None and self._index.has_columns():
+      names = SINGLE_COLUMNS + ('subject',)
+      cols = dict([ (n, self._index.column(n)) for n in names ])
+      view = None if self._view is None else self._index.view_mask(self._view)
+      self._columns = Metadata_columns(self._index.dois(), cols, view, self._doc_part)
+    else:
+      dois = self.dois()
+      infos = [ info for d,info in self.article_info(dois) ]
+      cats = [ c for d,c in self._doi_categories() ]
+      self._columns = Metadata_columns.from_values(dois, infos, cats, self._doc_part)
+    return self._columns
+
+  def category_mask(self, expr):
+    """
+    The articles selected by a category expression such as
+    'Genetics AND NOT (Medicine OR Physics)', see category_expr.py.
+
+    @rtype: columns.Mask
+    """
+    cols = self.columns()
+    def category(name):
+      if cols.subject.code(name) is None:
+        raise ValueError(u'Plos_reader: no category {c}'.format(c=name))
+      return cols.subject == name
+    return evaluate(parse(expr), category, cols.all())
+
+  def category_fileids(self, expr):
+    """
+    The fileids of the articles selected by a category expression.
+    """
+    return self.columns().fileids(self.category_mask(expr))
+
+  def category_dois(self, expr):
+    """
+    The DOIs of the articles selected by a category expression.
+    """
+    return self.columns().dois(self.category_mask(expr))
+
+  def select_dois(self, journal=None, article_type=None, date_from=None, date_to=None,
+                        subject=None, author=None):
+    """
+    DOIs of the articles matching all of the given conditions, in build
+    order. See Metadata_db.select() for the conditions. Without a
+    metadata database the articles are scanned.
+    """
+    if self._db is not None:
+      return self._db.select(journal, article_type, date_from, date_to, subject, author)
+    as_set = lambda v : None if v is None else set([v] if isinstance(v, basestring) else v)
+    (journal, article_type, subject, author) = map(as_set, (journal, article_type, subject, author))
+    cats = self._corpus_info['dois_to_categories']
+    rslt = []
+    for d, info in self._corpus_info['doi_article_info'].iteritems():
+      if (journal is not None and info['journal'] not in journal) or \
+         (article_type is not None and info['article_type'] not in article_type) or \
+         (date_from is not None and info['publication_date'] < date_from) or \
+         (date_to is not None and info['publication_date'] >= date_to) or \
+         (subject is not None and subject.isdisjoint(cats[d])) or \
+         (author is not None and author.isdisjoint(info['author'] or [])):
+        continue
+      rslt.append(d)
+    return rslt
 
 ####################### MAIN ##########################
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.token_cache
+
+Persistent on-disk cache of tokenized documents.
+
+  Description:
+  ===========
+
+  Token arrays (see tokens.py) are made once, at build time, with the
+  default tokenizers. A reader given its own tokenizers, or a corpus
+  built without --tokenize, tokenizes the raw text again on every pass
+  over words() or sents(). Token_cache keeps the sentences of each
+  document it has tokenized in a cache directory, one file per entry:
+
+    a JSON header line {"byteorder": "little", "vocab": [token, ...],
+      "tokens": n, "sents": m}
+    the token ids of the document, indexes into vocab, array('I')
+    the end of each sentence, counted in tokens, array('I')
+
+  zlib compressed and named by the SHA-1 of the tokenizer configuration
+  and the document text. An edited document or a different tokenizer
+  hashes to another entry, so an entry never has to be invalidated; the
+  stale one is evicted in time. The configuration is the one token
+  arrays record, see tokenizer_config() in tokens.py. A tokenizer with
+  state it cannot describe is refused unless config is passed.
+
+  Entries are written to a temporary file and renamed, so processes can
+  share a cache. When the entries grow past max_bytes the least recently
+  used are removed, as in plos_api/cache.py.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import sys
+import json
+import zlib
+import array
+import hashlib
+import threading
+from nltk.corpus.reader.util import read_blankline_block
+from tokens import tokenize, tokenizer_config
+
+__all__ = ['Token_cache', 'tokenizer_config']
+
+_suffix = '.tok.z'
+
+# Eviction goes this far below max_bytes so it is not repeated on every put.
+_low_water = 0.9
+
+# array('I') is 4 bytes on the platforms we build on, 'L' where it is not.
+_typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+
+def _encode(sents):
+  vocab = {}
+  ids = array.array(_typecode)
+  ends = array.array(_typecode)
+  for sent in sents:
+    ids.extend([ vocab.setdefault(t, len(vocab)) for t in sent ])
+    ends.append(len(ids))
+  tokens = [None] * len(vocab)
+  for t, i in vocab.items():
+    tokens[i] = t
+  header = json.dumps({'byteorder': sys.byteorder, 'vocab': tokens,
+                       'tokens': len(ids), 'sents': len(ends)})
+  return header.encode('utf-8') + b'\n' + ids.tostring() + ends.tostring()
+
+def _decode(data):
+  end = data.index(b'\n')
+  header = json.loads(data[:end].decode('utf-8'))
+  ids = array.array(_typecode)
+  ids.fromstring(data[end + 1:end + 1 + header['tokens'] * ids.itemsize])
+  ends = array.array(_typecode)
+  ends.fromstring(data[end + 1 + len(ids) * ids.itemsize:])
+  if header['byteorder'] != sys.byteorder:
+    ids.byteswap()
+    ends.byteswap()
+  vocab = header['vocab']
+  tokens = [ vocab[i] for i in ids ]
+  starts = [0] + ends[:-1].tolist()
+  return [ tokens[s:e] for s,e in zip(starts, ends) ]
+
+class Token_cache(object):
+  """
+  Size bounded cache of the sentences of documents, for one tokenizer
+  configuration. Safe to share between threads.
+  """
+  def __init__(self, cache_dir, word_tokenizer, sent_tokenizer,
+                     para_block_reader=read_blankline_block,
+                     max_bytes=1024**3, config=None, level=6):
+    """
+    @type cache_dir: string
+    @param cache_dir: directory holding the cache entries. Created if needed.
+    @type word_tokenizer: nltk tokenizer
+    @param word_tokenizer: splits sentences into words.
+    @type sent_tokenizer: nltk tokenizer
+    @param sent_tokenizer: splits paragraphs into sentences.
+    @type para_block_reader: function
+    @param para_block_reader: splits a stream into paragraphs.
+    @type max_bytes: int
+    @param max_bytes: size budget for the compressed entries.
+    @type config: string
+    @param config: the tokenizer configuration, by default worked out
+                   from the tokenizers when the cache is first used.
+                   Needed for tokenizers tokenizer_config() refuses.
+    @type level: int
+    @param level: zlib compression level.
+    """
+    self.cache_dir = cache_dir
+    self.word_tokenizer = word_tokenizer
+    self.sent_tokenizer = sent_tokenizer
+    self.para_block_reader = para_block_reader
+    self.max_bytes = max_bytes
+    self.level = level
+    self._config = config
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    self._total = sum([ s for _,s,_ in self._entries() ])
+
+  @property
+  def config(self):
+    if self._config is None:
+      self._config = tokenizer_config(self.word_tokenizer, self.sent_tokenizer,
+                                      self.para_block_reader)
+    return self._config
+
+  def _path(self, text):
+    h = hashlib.sha1(self.config.encode('utf-8') + b'\0' + text.encode('utf-8'))
+    return os.path.join(self.cache_dir, h.hexdigest() + _suffix)
+
+  def _entries(self):
+    """
+    _entries - list of (atime, size, path) of the cache entries.
+    """
+    entries = []
+    for fn in os.listdir(self.cache_dir):
+      if not fn.endswith(_suffix):
+        continue
+      path = os.path.join(self.cache_dir, fn)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_atime, st.st_size, path))
+    return entries
+
+  def get(self, text):
+    """
+    get - the cached sentences of text, None if it has no entry.
+    """
+    fn = self._path(text)
+    try:
+      with open(fn, 'rb') as fd:
+        sents = _decode(zlib.decompress(fd.read()))
+      # Record the access for LRU eviction, atime is often not updated.
+      os.utime(fn, None)
+    except (OSError, IOError, zlib.error, ValueError):
+      sents = None
+    with self._lock:
+      if sents is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    return sents
+
+  def put(self, text, sents):
+    """
+    put - store the sentences of text.
+    """
+    fn = self._path(text)
+    data = zlib.compress(_encode(sents), self.level)
+    tmp = '{f}.{p}.{t}'.format(f=fn, p=os.getpid(), t=threading.current_thread().ident)
+    with open(tmp, 'wb') as fd:
+      fd.write(data)
+    os.rename(tmp, fn)
+    with self._lock:
+      self._total += len(data)
+      full = self._total > self.max_bytes
+    if full:
+      self.evict()
+    return
+
+  def sents(self, text):
+    """
+    sents - the sentences of text, each a list of words, from the cache
+            or tokenized and cached.
+    """
+    sents = self.get(text)
+    if sents is None:
+      sents = tokenize(text, self.word_tokenizer, self.sent_tokenizer, self.para_block_reader)
+      self.put(text, sents)
+    return sents
+
+  def words(self, text):
+    """
+    words - the words of text, the concatenation of its sentences as in
+            tokens.py.
+    """
+    return [ w for s in self.sents(text) for w in s ]
+
+  def evict(self):
+    """
+    evict - remove least recently used entries until the cache is
+            within max_bytes.
+    """
+    with self._lock:
+      entries = self._entries()
+      total = sum([ s for _,s,_ in entries ])
+      if total > self.max_bytes:
+        for atime, size, path in sorted(entries):
+          try:
+            os.remove(path)
+          except OSError:
+            pass
+          total -= size
+          if total <= _low_water * self.max_bytes:
+            break
+      self._total = total
+    return
+
+  def clear(self):
+    with self._lock:
+      for atime, size, path in self._entries():
+        os.remove(path)
+      self._total = 0
+    return
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+oa_nlp.nltk.tokens
+
+Token-ID arrays for corpus text tokenized at build time.
+
+  Description:
+  ===========
+
+  NLTK's plaintext reader tokenizes the raw text again on every pass over
+  words() or sents(). A corpus built with tokenize=True is tokenized once,
+  while it is built, into four files next to the text:
+
+    tokens.vocab  the corpus vocabulary, one token per line. The line
+                  number is the token id.
+    tokens.ids    the token ids of all documents, one after another, as
+                  unsigned 32 bit integers (array('I')).
+    tokens.sents  for every document the end of each sentence, counted
+                  in tokens from the start of the document.
+    tokens.idx    one line per document:
+
+      fileid <TAB> token_offset <TAB> token_count <TAB> sent_offset <TAB> sent_count
+
+  Offsets and counts are in array items, not bytes. tokens.json records
+  the item size, the byte order and the tokenizer configuration. Like the
+  packed layout every file is only ever appended to, and a fileid
+  written twice is read from its last entry.
+
+  The text is split the way CategorizedPlaintextCorpusReader.sents() does:
+  into paragraphs at blank lines, paragraphs into sentences with the
+  sentence tokenizer (Punkt by default), sentences into words with the
+  word tokenizer (WordPunctTokenizer by default). words() is served as
+  the concatenation of the sentences. It differs from NLTK's words() only
+  where the sentence tokenizer splits text that has no white space.
+
+  The tokenizer configuration, from tokenizer_config(), is the class and
+  simple attributes (regular expression, flags, ...) of the word and
+  sentence tokenizers and the paragraph block reader, and a SHA-1 of
+  their other attributes, such as the abbreviations and collocations of
+  a Punkt model, taken apart into sorted lists and dicts. Attributes
+  that are None, or a compiled copy of a pattern attribute, are left
+  out; RegexpTokenizer compiles on first use. Token_writer refuses to
+  append to arrays made with another configuration, and the reader only
+  serves arrays made with its own tokenizers.
+
+  Token_corpus memory maps tokens.ids and tokens.sents, so a document is
+  read by slicing the maps, with no tokenizing.
+
+  merge_tokens() combines token arrays built separately, for instance by
+  parallel builders, mapping each part's vocabulary onto one. The parts
+  must have been made with the same tokenizers.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import io
+import os
+import re
+import sys
+import json
+import mmap
+import array
+import types
+import hashlib
+import threading
+import nltk
+from nltk.tokenize import WordPunctTokenizer
+from nltk.corpus.reader.util import read_blankline_block
+
+__all__ = ['Token_writer', 'Token_corpus', 'has_tokens', 'merge_tokens',
+           'default_word_tokenizer', 'default_sent_tokenizer', 'tokenize',
+           'tokenizer_config']
+
+VOCAB_FN = 'tokens.vocab'
+IDS_FN = 'tokens.ids'
+SENTS_FN = 'tokens.sents'
+INDEX_FN = 'tokens.idx'
+CONFIG_FN = 'tokens.json'
+
+# array('I') is 4 bytes on the platforms we build on, 'L' where it is not.
+_typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+
+def default_word_tokenizer():
+  """
+  default_word_tokenizer - the word tokenizer of NLTK's plaintext reader.
+  """
+  return WordPunctTokenizer()
+
+def default_sent_tokenizer():
+  """
+  default_sent_tokenizer - the sentence tokenizer of NLTK's plaintext reader.
+  """
+  return nltk.data.load('tokenizers/punkt/english.pickle')
+
+def tokenize(text, word_tokenizer, sent_tokenizer, para_block_reader=read_blankline_block):
+  """
+  tokenize - split text into a list of sentences, each a list of words.
+  """
+  sents = []
+  stream = io.StringIO(text)
+  while True:
+    block = para_block_reader(stream)
+    if not block:
+      break
+    for para in block:
+      sents.extend([ word_tokenizer.tokenize(s) for s in sent_tokenizer.tokenize(para) ])
+  return sents
+
+_simple = (basestring, int, long, float, bool)
+
+_pattern_type = type(re.compile(''))
+
+def _state(value, path=()):
+  """
+  _state - value as nested lists and simple values, the same for equal
+           values whatever the order of their sets and dicts.
+  """
+  if isinstance(value, _simple) or value is None:
+    return value
+  if isinstance(value, _pattern_type):
+    return ['re', value.pattern, value.flags]
+  if isinstance(value, (type, types.ClassType, types.FunctionType, types.BuiltinFunctionType)):
+    return u'{m}.{n}'.format(m=value.__module__, n=value.__name__)
+  if id(value) in path:
+    raise ValueError('tokenizer_config: {v!r} refers to itself'.format(v=value))
+  path = path + (id(value),)
+  if isinstance(value, dict):
+    return sorted([ [_state(k, path), _state(v, path)] for k,v in value.items() ])
+  if isinstance(value, (set, frozenset)):
+    return sorted([ _state(v, path) for v in value ])
+  if isinstance(value, (list, tuple)):
+    return [ _state(v, path) for v in value ]
+  cls = value.__class__
+  name = u'{m}.{n}'.format(m=cls.__module__, n=cls.__name__)
+  if hasattr(cls, '__getstate__'):
+    return [name, _state(value.__getstate__(), path)]
+  if hasattr(value, '__dict__'):
+    return [name, _state(vars(value), path)]
+  raise ValueError('tokenizer_config: cannot describe the state of a ' + name)
+
+def _describe(obj):
+  """
+  _describe - class, plain attributes and a digest of the other
+              attributes of a tokenizer, the name of a function.
+  """
+  if obj.__class__.__name__ == 'LazyLoader':
+    # The resource replaces the loader's class and attributes when it is
+    # loaded, describe it as it will be after that.
+    getattr(obj, 'tokenize')
+  if callable(obj) and hasattr(obj, '__name__'):
+    return u'{m}.{n}'.format(m=obj.__module__, n=obj.__name__)
+  cls = obj.__class__
+  attrs = vars(obj)
+  patterns = set([ v for v in attrs.values() if isinstance(v, basestring) ])
+  simple = []
+  other = []
+  for k, v in sorted(attrs.items()):
+    if v is None or (isinstance(v, _pattern_type) and v.pattern in patterns):
+      continue
+    if isinstance(v, _simple):
+      simple.append((k, v))
+    else:
+      other.append([k, _state(v)])
+  desc = u'{m}.{n}{a}'.format(m=cls.__module__, n=cls.__name__, a=simple)
+  if other:
+    desc += u' ' + hashlib.sha1(repr(other)).hexdigest()
+  return desc
+
+def tokenizer_config(word_tokenizer, sent_tokenizer, para_block_reader=read_blankline_block):
+  """
+  tokenizer_config - a string that differs for tokenizers that split
+                     differently. Raises ValueError for tokenizers with
+                     state it cannot describe.
+  """
+  return u'\n'.join([ _describe(o) for o in (word_tokenizer, sent_tokenizer, para_block_reader) ])
+
+def has_tokens(root):
+  """
+  True if the corpus in root was tokenized when it was built.
+  """
+  return os.path.isfile(os.path.join(root, INDEX_FN))
+
+def _new_array(data=b''):
+  a = array.array(_typecode)
+  a.fromstring(data)
+  return a
+
+def _truncate_items(fn):
+  # Drop a partial item written by an interrupted build.
+  size = os.path.getsize(fn) if os.path.isfile(fn) else 0
+  itemsize = array.array(_typecode).itemsize
+  if size % itemsize:
+    with open(fn, 'r+b') as fd:
+      fd.truncate(size - size % itemsize)
+  return size // itemsize
+
+def _read_vocab(root):
+  """
+  _read_vocab - the vocabulary list. A partial last token from an
+                interrupted build is removed from the file.
+  """
+  fn = os.path.join(root, VOCAB_FN)
+  if not os.path.isfile(fn):
+    return []
+  with open(fn, 'rb') as fd:
+    data = fd.read()
+  end = data.rfind(b'\n') + 1
+  if end < len(data):
+    with open(fn, 'r+b') as fd:
+      fd.truncate(end)
+  return data[:end].decode('utf-8').split(u'\n')[:-1]
+
+def _read_index(root):
+  index = {}
+  with open(os.path.join(root, INDEX_FN), 'rb') as fd:
+    for line in fd:
+      fields = line.decode('utf-8').rstrip(u'\n').split(u'\t')
+      if len(fields) != 5:
+        # A partial last line from an interrupted build.
+        continue
+      index[fields[0]] = tuple([ int(f) for f in fields[1:] ])
+  return index
+
+def _read_config(root):
+  with open(os.path.join(root, CONFIG_FN), 'r') as fd:
+    return json.load(fd)
+
+def _write_config(root, tokenizers):
+  with open(os.path.join(root, CONFIG_FN), 'w') as fd:
+    json.dump({ 'itemsize': array.array(_typecode).itemsize,
+                'byteorder': sys.byteorder,
+                'tokenizers': tokenizers }, fd)
+  return
+
+class Token_writer(object):
+  """
+  Tokenizes documents and appends their token ids. Safe to share between
+  writer threads.
+  """
+  def __init__(self, root, word_tokenizer=None, sent_tokenizer=None, config=None):
+    """
+    @type root: string
+    @param root: the corpus directory.
+    @type word_tokenizer: nltk tokenizer
+    @param word_tokenizer: splits sentences into words. Defaults to
+                           WordPunctTokenizer.
+    @type sent_tokenizer: nltk tokenizer
+    @param sent_tokenizer: splits paragraphs into sentences. Defaults to
+                           the english Punkt tokenizer.
+    @type config: string
+    @param config: the tokenizer configuration recorded, by default
+                   tokenizer_config() of the tokenizers.
+    """
+    self.root = root
+    self.word_tokenizer = default_word_tokenizer() if word_tokenizer is None else word_tokenizer
+    self.sent_tokenizer = default_sent_tokenizer() if sent_tokenizer is None else sent_tokenizer
+    if config is None:
+      config = tokenizer_config(self.word_tokenizer, self.sent_tokenizer)
+    self.config = config
+    if has_tokens(root):
+      # Appending, e.g. to a resumed build.
+      made_with = _read_config(root).get('tokenizers')
+      if made_with != config:
+        raise ValueError('Token_writer: the token arrays in {r} were made with other '
+                         'tokenizers'.format(r=root))
+    self._lock = threading.Lock()
+    self._vocab = dict([ (t, i) for i,t in enumerate(_read_vocab(root)) ])
+    self._ids_len = _truncate_items(os.path.join(root, IDS_FN))
+    self._sents_len = _truncate_items(os.path.join(root, SENTS_FN))
+    _write_config(root, config)
+    self._vocab_fd = open(os.path.join(root, VOCAB_FN), 'ab')
+    self._ids_fd = open(os.path.join(root, IDS_FN), 'ab')
+    self._sents_fd = open(os.path.join(root, SENTS_FN), 'ab')
+    self._index = open(os.path.join(root, INDEX_FN), 'ab')
+
+  def add(self, fileid, text):
+    """
+    add - tokenize the text of one document and append its token ids.
+
+    @type fileid: string
+    @param fileid: the document name, see util.doi2fn.
+    @type text: unicode
+    @param text: the document text.
+    """
+    sents = tokenize(text, self.word_tokenizer, self.sent_tokenizer)
+    with self._lock:
+      self._append(fileid, sents)
+    return
+
+  def _token_id(self, token, new):
+    i = self._vocab.get(token)
+    if i is None:
+      i = self._vocab[token] = len(self._vocab)
+      new.append(token)
+    return i
+
+  def _append(self, fileid, sents):
+    new = []
+    ids = _new_array()
+    ends = _new_array()
+    for sent in sents:
+      ids.extend([ self._token_id(t, new) for t in sent ])
+      ends.append(len(ids))
+    self._write_vocab(new)
+    self._write(fileid, ids, ends)
+    return
+
+  def _write_vocab(self, new_tokens):
+    if new_tokens:
+      self._vocab_fd.write(u''.join([ t + u'\n' for t in new_tokens ]).encode('utf-8'))
+    return
+
+  def _write(self, fileid, ids, ends):
+    self._ids_fd.write(ids.tostring())
+    self._sents_fd.write(ends.tostring())
+    # Flush the vocabulary and arrays first so an index entry never
+    # points past them.
+    for fd in (self._vocab_fd, self._ids_fd, self._sents_fd):
+      fd.flush()
+    entry = u'{f}\t{t}\t{n}\t{s}\t{m}\n'.format(f=fileid, t=self._ids_len, n=len(ids),
+                                               s=self._sents_len, m=len(ends))
+    self._index.write(entry.encode('utf-8'))
+    self._index.flush()
+    self._ids_len += len(ids)
+    self._sents_len += len(ends)
+    return
+
+  def sync(self):
+    """
+    sync - make the documents appended so far durable.
+    """
+    with self._lock:
+      for fd in (self._vocab_fd, self._ids_fd, self._sents_fd, self._index):
+        fd.flush()
+        os.fsync(fd.fileno())
+    return
+
+  def close(self):
+    with self._lock:
+      for fd in (self._vocab_fd, self._ids_fd, self._sents_fd, self._index):
+        fd.close()
+    return
+
+def merge_tokens(root, parts):
+  """
+  merge_tokens - combine the token arrays of the corpora in parts into
+                 root, mapping their vocabularies onto one.
+
+  @type root: string
+  @param root: the corpus directory, without token files.
+  @type parts: list
+  @param parts: directories of closed tokenized corpora, in merge order,
+                made with the same tokenizers. A fileid in more than one
+                part is taken from the last.
+  """
+  parts = [ p for p in parts if has_tokens(p) ]
+  if not parts:
+    return
+  configs = set([ _read_config(p).get('tokenizers') for p in parts ])
+  if len(configs) > 1:
+    raise ValueError('merge_tokens: the parts were made with different tokenizers')
+  writer = Token_writer(root, word_tokenizer=False, sent_tokenizer=False,
+                        config=configs.pop())
+  for part in parts:
+    corpus = Token_corpus(part)
+    new = []
+    remap = [ writer._token_id(t, new) for t in corpus.vocab ]
+    writer._write_vocab(new)
+    for fileid, (tok_off, tok_n, sent_off, sent_n) in sorted(corpus._index.items(),
+                                                             key=lambda e : e[1][0]):
+      ids = _new_array()
+      ids.extend([ remap[i] for i in corpus._items(corpus._ids, tok_off, tok_n) ])
+      writer._write(fileid, ids, corpus._items(corpus._sents, sent_off, sent_n))
+    corpus.close()
+  writer.close()
+  return
+
+class Token_corpus(object):
+  """
+  Read only access to the token arrays of a corpus.
+  """
+  def __init__(self, root):
+    self.root = root
+    config = _read_config(root)
+    # None for arrays made before the configuration was recorded.
+    self.config = config.get('tokenizers')
+    if config['itemsize'] != array.array(_typecode).itemsize:
+      raise ValueError('Token_corpus: {r} has {n} byte token ids'.format(
+                       r=root, n=config['itemsize']))
+    self._swap = config['byteorder'] != sys.byteorder
+    self.vocab = _read_vocab(root)
+    self._index = _read_index(root)
+    self._ids = self._map(IDS_FN)
+    self._sents = self._map(SENTS_FN)
+
+  def _map(self, fn):
+    with open(os.path.join(self.root, fn), 'rb') as fd:
+      if os.fstat(fd.fileno()).st_size == 0:
+        # mmap can not map an empty file.
+        return b''
+      return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def _items(self, data, offset, count):
+    itemsize = array.array(_typecode).itemsize
+    a = _new_array(data[offset*itemsize:(offset + count)*itemsize])
+    if self._swap:
+      a.byteswap()
+    return a
+
+  def fileids(self):
+    return sorted(self._index.keys())
+
+  def __contains__(self, fileid):
+    return fileid in self._index
+
+  def token_ids(self, fileid):
+    """
+    token_ids - array of the token ids of one document.
+    """
+    (tok_off, tok_n, sent_off, sent_n) = self._index[fileid]
+    return self._items(self._ids, tok_off, tok_n)
+
+  def sent_ends(self, fileid):
+    """
+    sent_ends - array of the sentence ends of one document, in tokens.
+    """
+    (tok_off, tok_n, sent_off, sent_n) = self._index[fileid]
+    return self._items(self._sents, sent_off, sent_n)
+
+  def words(self, fileid):
+    """
+    words - list of the words of one document.
+    """
+    vocab = self.vocab
+    return [ vocab[i] for i in self.token_ids(fileid) ]
+
+  def sents(self, fileid):
+    """
+    sents - list of the sentences of one document, each a list of words.
+    """
+    words = self.words(fileid)
+    start = 0
+    sents = []
+    for end in self.sent_ends(fileid):
+      sents.append(words[start:end])
+      start = end
+    return sents
+
+  def close(self):
+    for m in (self._ids, self._sents):
+      if isinstance(m, mmap.mmap):
+        m.close()
+    self._ids = self._sents = b''
+    return
@@ -2,6 +2,13 @@
 Author: Bill OConnor
 
 """
+import os
+import re
+import shutil
+import base64
+import struct
+import hashlib
+import binascii
 
 def doi2fn(doi, doc_part):
     """
@@ -44,3 +51,110 @@ def field_list_to_dict(dict_, keys):
   """
   assign_if = lambda f, d : d[f] if f in d else ''
   return { key : assign_if(key,dict_) for key in keys}
+
+def pack_members(indexes, size):
+  """
+  Encode a set of article indexes as a base64 bitmap.
+
+  @type indexes: iterable
+  @param indexes: positions, in build order, of the member articles.
+  @type size: int
+  @param size: total number of articles.
+
+  @rtype: string
+  @return: bit i of the bitmap is set if article i is a member.
+  """
+  return base64.b64encode(bitmap(indexes, size))
+
+def bitmap(indexes, size):
+  """
+  The bitmap of pack_members, not base64 encoded.
+
+  @rtype: bytes
+  """
+  bits = bytearray((size + 7) // 8)
+  for i in indexes:
+    bits[i >> 3] |= 1 << (i & 7)
+  return bytes(bits)
+
+def unpack_members(bitmap):
+  """
+  Decode a bitmap made by pack_members.
+
+  @rtype: set
+  @return: the member article indexes.
+  """
+  bits = bytearray(base64.b64decode(bitmap))
+  return set([ (n << 3) + b for n,byte in enumerate(bits) if byte
+                            for b in range(8) if byte & (1 << b) ])
+
+def bitset(indexes, size):
+  """
+  Build a bitset, an int with bit i set for each i in indexes.
+
+  @type indexes: iterable
+  @param indexes: the positions to set.
+  @type size: int
+  @param size: positions are below size.
+
+  @rtype: int
+  """
+  return bitset_from_bytes(bitmap(indexes, size))
+
+def bitset_from_bytes(data):
+  """
+  Convert a bitmap, bit i at byte i // 8 as in pack_members, to a bitset.
+  """
+  data = bytearray(data)
+  data.reverse()
+  return int(binascii.hexlify(bytes(data)) or '0', 16)
+
+def bitset_members(bits):
+  """
+  The positions set in a bitset, in ascending order.
+
+  @rtype: list
+  """
+  if bits <= 0:
+    return []
+  digits = '%x' % bits
+  data = bytearray(binascii.unhexlify(('0' if len(digits) % 2 else '') + digits))
+  data.reverse()
+  data = bytes(data)
+  # Skip the zero bytes with a regexp, only set bytes are looked at.
+  return [ (m.start() << 3) + b for m in re.finditer(b'[^\x00]', data)
+                                for b in range(8) if ord(m.group()) & (1 << b) ]
+
+def bitset_count(bits):
+  """
+  The number of positions set in a bitset.
+  """
+  return bin(bits).count('1') if bits > 0 else 0
+
+def doi_fraction(doi, seed=0):
+  """
+  Map a DOI to a number in [0, 1) that only depends on the DOI and seed.
+
+  @type doi: string
+  @param doi: Digital Object Identifier of the article.
+  @type seed: int
+  @param seed: different seeds give independent mappings.
+
+  @rtype: float
+  """
+  key = u'{s}:{d}'.format(s=seed, d=doi).encode('utf-8')
+  (n,) = struct.unpack('>Q', hashlib.sha1(key).digest()[:8])
+  return n / 2.0**64
+
+def link_or_copy(src, dst):
+  """
+  Hard link src to dst, or copy it where links are not supported. The
+  source stays in place.
+  """
+  if os.path.exists(dst):
+    os.remove(dst)
+  try:
+    os.link(src, dst)
+  except (AttributeError, OSError):
+    shutil.copyfile(src, dst)
+  return
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+plos_api aio
+
+asyncio version of the PLOS solr Query. http://api.plos.org/search
+
+  Description:
+  ===========
+
+  AsyncQuery yields the same documents in the same order as Query but
+  is iterated with "async for" inside an event loop. Pages after the
+  first are requested in parallel, at most concurrency at a time, and
+  handed back in order. Since no threads are involved many queries, for
+  instance one per journal, can run concurrently on a single core:
+
+    async def pull(jid):
+      async for doc in AsyncQuery(key, ['*:*'], ['id'], [jid], limit=1000):
+        ...
+    loop.run_until_complete(asyncio.gather(*[ pull(j) for j in jids ]))
+
+  Requires Python 3.5+ and aiohttp. The rest of oa_nlp.plos_api does not
+  depend on this module.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import json
+import asyncio
+from collections import deque
+
+from oa_nlp.plos_api import solr
+from oa_nlp.plos_api.solr import _build_query_map, _build_conjunctive_query_str, \
+                                 _set_query_map, _build_solr_url
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+__all__ = ['AsyncQuery']
+
+_default_headers = {'Accept-Encoding': 'gzip, deflate'}
+
+class AsyncQuery(object):
+  """
+  Asynchronous iterable PLOS Solr query object.
+  """
+  def __init__(self, api_key, queries, return_fields, journals,
+                     start=0, limit=99, chunk_size=400, concurrency=4,
+                     session=None):
+    """
+    @type concurrency: int
+    @param concurrency: maximum number of page requests in flight. This
+                        also bounds the number of pages held in memory.
+    @type session: aiohttp.ClientSession
+    @param session: shared session, so many queries can use one
+                    connection pool. A private one is created if None.
+    """
+    if aiohttp is None:
+      raise ImportError('AsyncQuery requires aiohttp')
+    self.start = start
+    self.limit = limit
+    self.chunk_size = limit if limit < chunk_size else chunk_size
+    self.concurrency = concurrency
+    self.qmap = _build_query_map(api_key, self.start, self.chunk_size,
+                                 _build_conjunctive_query_str(queries, journals),
+                                 return_fields)
+    self.numFound = 0
+    self.cursor = start
+    self._session = session
+    self._own_session = session is None
+    self._pages = deque()
+    self._next_start = start
+    self._buffer = deque()
+
+  async def _fetch_page(self, start):
+    qmap = _set_query_map(dict(self.qmap), start, self.chunk_size)
+    url = _build_solr_url(solr._search_url, qmap)
+    cache = solr._cache
+    content = None if cache is None else cache.get(solr._search_url, qmap)
+    if content is None:
+      async with self._session.get(url) as r:
+        if r.status != 200:
+          raise Exception('AsyncQuery: failed ' + url)
+        content = await r.read()
+      if cache is not None:
+        cache.put(solr._search_url, qmap, content)
+    return json.loads(content.decode('utf-8'))['response']
+
+  def _schedule(self):
+    # Keep up to concurrency page requests running ahead of the consumer.
+    while len(self._pages) < self.concurrency and self._next_start < self.limit:
+      task = asyncio.ensure_future(self._fetch_page(self._next_start))
+      self._pages.append(task)
+      self._next_start += self.chunk_size
+    return
+
+  async def aclose(self):
+    """
+    aclose - cancel outstanding page requests and close a private session.
+    """
+    while self._pages:
+      self._pages.popleft().cancel()
+    if self._own_session and self._session is not None:
+      await self._session.close()
+      self._session = None
+    return
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, type, value, traceback):
+    await self.aclose()
+
+  def __aiter__(self):
+    return self
+
+  async def _next_page(self):
+    if self._next_start == self.start:
+      # The first page sets numFound and with it the real limit.
+      resp = await self._fetch_page(self._next_start)
+      self._next_start += self.chunk_size
+      self.numFound = int(resp['numFound'])
+      if self.numFound < self.limit:
+        self.limit = self.numFound
+    elif self._pages:
+      resp = await self._pages.popleft()
+    else:
+      return
+    self._buffer.extend(resp['docs'])
+    self._schedule()
+    return
+
+  async def __anext__(self):
+    if self._session is None:
+      self._session = aiohttp.ClientSession(headers=_default_headers)
+      self._own_session = True
+
+    if self.cursor < self.limit and not self._buffer:
+      try:
+        await self._next_page()
+      except BaseException:
+        await self.aclose()
+        raise
+
+    if self.cursor >= self.limit or not self._buffer:
+      await self.aclose()
+      raise StopAsyncIteration
+
+    self.cursor += 1
+    return self._buffer.popleft()
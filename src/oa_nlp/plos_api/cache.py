@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+plos_api cache
+
+Persistent on-disk cache for PLOS solr api responses.
+
+  Description:
+  ===========
+
+  Responses are stored zlib compressed, one file per query, named by a
+  hash of the normalized query map. The api_key is not part of the key
+  so the same query run with different keys shares an entry. Entries
+  older than ttl seconds are treated as missing. When the cache grows past
+  max_bytes the least recently used entries are removed. In offline mode
+  a miss is an error instead of a trip to the server.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import os
+import time
+import zlib
+import hashlib
+import threading
+
+__all__ = ['ResponseCache', 'CacheMiss']
+
+_suffix = '.json.z'
+
+class CacheMiss(Exception):
+  """
+  Raised by an offline cache when a query has no usable entry.
+  """
+  pass
+
+def _cache_key(url, query_map):
+  """
+  _cache_key - hash of the search url and the query map without api_key.
+  """
+  items = sorted([ (k, v) for k,v in query_map.items() if k != 'api_key' ])
+  # Repeated parameters are lists, their order does not matter to Solr.
+  items = [ (k, sorted(v) if isinstance(v, list) else v) for k,v in items ]
+  norm = url + '?' + '&'.join([ '{k}={v}'.format(k=k, v=v) for k,v in items ])
+  if not isinstance(norm, bytes):
+    norm = norm.encode('utf-8')
+  return hashlib.sha1(norm).hexdigest()
+
+class ResponseCache(object):
+  """
+  TTL and size bounded response cache.
+  """
+  def __init__(self, cache_dir, ttl=7*24*3600, max_bytes=2*1024**3,
+                     offline=False, level=6):
+    """
+    @type cache_dir: string
+    @param cache_dir: directory holding the cache entries. Created if needed.
+    @type ttl: int
+    @param ttl: seconds an entry stays valid. None never expires.
+    @type max_bytes: int
+    @param max_bytes: size budget for the compressed entries.
+    @type offline: bool
+    @param offline: serve only from the cache, raise CacheMiss otherwise.
+    @type level: int
+    @param level: zlib compression level.
+    """
+    self.cache_dir = cache_dir
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.offline = offline
+    self.level = level
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + _suffix)
+
+  def get(self, url, query_map):
+    """
+    get - return the cached response content or None.
+    """
+    fn = self._path(_cache_key(url, query_map))
+    try:
+      mtime = os.path.getmtime(fn)
+      if self.ttl is not None and time.time() - mtime > self.ttl:
+        os.remove(fn)
+        content = None
+      else:
+        with open(fn, 'rb') as fd:
+          content = zlib.decompress(fd.read())
+        # Record the access for LRU eviction, keep mtime for the TTL.
+        os.utime(fn, (time.time(), mtime))
+    except (OSError, IOError, zlib.error):
+      content = None
+
+    with self._lock:
+      if content is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    if content is None and self.offline:
+      raise CacheMiss('ResponseCache: offline and no entry for ' + url)
+    return content
+
+  def put(self, url, query_map, content):
+    """
+    put - store response content. The entry is written to a temp file
+          and renamed so readers never see a partial entry.
+    """
+    fn = self._path(_cache_key(url, query_map))
+    tmp = '{f}.{p}.{t}'.format(f=fn, p=os.getpid(), t=threading.current_thread().ident)
+    with open(tmp, 'wb') as fd:
+      fd.write(zlib.compress(content, self.level))
+    os.rename(tmp, fn)
+    self.evict()
+    return
+
+  def evict(self):
+    """
+    evict - remove least recently used entries until the cache is
+            within max_bytes.
+    """
+    with self._lock:
+      entries = []
+      total = 0
+      for fn in os.listdir(self.cache_dir):
+        if not fn.endswith(_suffix):
+          continue
+        path = os.path.join(self.cache_dir, fn)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        entries.append((st.st_atime, st.st_size, path))
+        total += st.st_size
+      if total <= self.max_bytes:
+        return
+      for atime, size, path in sorted(entries):
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+        total -= size
+        if total <= self.max_bytes:
+          break
+    return
+
+  def clear(self):
+    with self._lock:
+      for fn in os.listdir(self.cache_dir):
+        if fn.endswith(_suffix):
+          os.remove(os.path.join(self.cache_dir, fn))
+    return
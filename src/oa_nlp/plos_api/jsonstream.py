@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+plos_api jsonstream
+
+Incremental parsing of PLOS solr api JSON responses.
+
+  Description:
+  ===========
+
+  A page of full text articles can be tens of megabytes. Loading it with
+  json.loads keeps the raw bytes, the decoded text and all the parsed
+  documents in memory at the same time. SolrDocStream instead scans the
+  response as it arrives and parses each element of response.docs on its
+  own as soon as its closing brace has been seen, so the memory needed
+  scales with the largest document rather than the page.
+
+  The scanner only tracks nesting and string boundaries. It works on the
+  raw UTF-8 bytes, which is safe since multi-byte characters never
+  contain the ASCII bytes it looks for.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import re
+import json
+
+__all__ = ['SolrDocStream']
+
+_special = re.compile(br'[{}\[\]"\\]')
+_in_string = re.compile(br'["\\]')
+_num_found = re.compile(br'"numFound"\s*:\s*(\d+)')
+_start = re.compile(br'"start"\s*:\s*(\d+)')
+_next_mark = re.compile(br'"nextCursorMark"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# Depth of the docs array: top level object, response object, docs.
+_docs_depth = 3
+
+_header = object()
+
+class SolrDocStream(object):
+  """
+  Iterator over response.docs of a streamed Solr JSON response.
+
+  numFound and start are available as soon as the object is created.
+  next_cursor_mark follows the docs in Solr's output, so it is only set
+  once the iterator is exhausted. on_done(stream) is called at that point,
+  followed by close().
+  """
+  def __init__(self, chunks, on_done=None, on_close=None):
+    """
+    @type chunks: iterable
+    @param chunks: the response body as a sequence of byte strings.
+    @type on_done: callable
+    @param on_done: called with the stream once all docs have been read.
+    @type on_close: callable
+    @param on_close: called once when the stream is closed, for instance
+                     to release the connection.
+    """
+    self._chunks = iter(chunks)
+    self._on_done = on_done
+    self._on_close = on_close
+    self.numFound = None
+    self.start = None
+    self.next_cursor_mark = None
+    self.count = 0
+    self.nbytes = 0
+    self._gen = self._scan()
+    if next(self._gen, None) is not _header:
+      raise Exception('SolrDocStream: no response.docs in response')
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    doc = next(self._gen, _header)
+    if doc is _header:
+      self.close()
+      raise StopIteration
+    self.count += 1
+    return doc
+
+  __next__ = next
+
+  def close(self):
+    """
+    close - stop reading. Safe to call more than once.
+    """
+    self._gen.close()
+    if self._on_close is not None:
+      on_close, self._on_close = self._on_close, None
+      on_close()
+    return
+
+  def _set_mark(self, text):
+    m = _next_mark.search(text)
+    if m is not None:
+      self.next_cursor_mark = json.loads(b'"' + m.group(1) + b'"')
+    return
+
+  def _set_header(self, header):
+    self._set_mark(header)
+    m = _num_found.search(header)
+    if m is not None:
+      self.numFound = int(m.group(1))
+    m = _start.search(header)
+    if m is not None:
+      self.start = int(m.group(1))
+    return
+
+  def _finish(self, trailer):
+    self._set_mark(trailer)
+    if self.numFound is None:
+      self._set_header(trailer)
+    if self._on_done is not None:
+      self._on_done(self)
+    return
+
+  def _parse_whole(self, buf):
+    # Fallback for a response that does not look like the usual layout.
+    rslt = json.loads(buf)
+    resp = rslt['response']
+    self.numFound = int(resp['numFound'])
+    self.start = int(resp.get('start', 0))
+    self.next_cursor_mark = rslt.get('nextCursorMark')
+    yield _header
+    for doc in resp['docs']:
+      yield doc
+    if self._on_done is not None:
+      self._on_done(self)
+    return
+
+  def _scan(self):
+    buf = b''
+    pos = 0
+    depth = 0
+    in_str = False
+    str_start = 0
+    keys = {}
+    in_docs = False
+    doc_start = None
+    trailer_start = None
+    for chunk in self._chunks:
+      # Drop the bytes that are no longer needed: everything before the
+      # current document while inside the docs array.
+      keep = 0
+      if in_docs:
+        keep = pos if doc_start is None else doc_start
+      if keep > 0:
+        buf = buf[keep:]
+        pos -= keep
+        if doc_start is not None:
+          doc_start -= keep
+      buf += chunk
+      self.nbytes += len(chunk)
+
+      while True:
+        if in_str:
+          m = _in_string.search(buf, pos)
+          if m is None:
+            # pos may already be past the end after an escape.
+            pos = max(pos, len(buf))
+            break
+          if m.group() == b'\\':
+            # Skip the escaped character, possibly in the next chunk.
+            pos = m.start() + 2
+            continue
+          in_str = False
+          pos = m.end()
+          if depth < _docs_depth:
+            keys[depth] = buf[str_start:m.start()]
+          continue
+
+        m = _special.search(buf, pos)
+        if m is None:
+          pos = len(buf)
+          break
+        c = m.group()
+        i = m.start()
+        pos = m.end()
+        if c == b'"':
+          in_str = True
+          str_start = pos
+        elif c == b'{' or c == b'[':
+          depth += 1
+          if in_docs and depth == _docs_depth + 1 and c == b'{':
+            doc_start = i
+          elif c == b'[' and depth == _docs_depth and trailer_start is None and \
+               keys.get(2) == b'docs' and keys.get(1) == b'response':
+            self._set_header(buf[:i])
+            in_docs = True
+            yield _header
+        elif c == b'}' or c == b']':
+          if in_docs and doc_start is not None and depth == _docs_depth + 1:
+            doc = json.loads(buf[doc_start:pos])
+            doc_start = None
+            yield doc
+          elif in_docs and depth == _docs_depth:
+            in_docs = False
+            trailer_start = pos
+          depth -= 1
+
+    if trailer_start is None:
+      if in_docs:
+        raise Exception('SolrDocStream: truncated response')
+      for doc in self._parse_whole(buf):
+        yield doc
+      return
+    self._finish(buf[trailer_start:])
+    return
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+plos_api sharded
+
+Run a PLOS solr query as several disjoint sub-queries in parallel.
+
+  Description:
+  ===========
+
+  A single Query walks one result set with one request stream. ShardedQuery
+  splits the query by journal (_id_2_journal) and, where a journal has more
+  than shard_size hits, by publication_date ranges. The ranges are found by
+  bisecting the date span with rows=0 numFound probes. When all journals
+  are searched a remainder shard picks up articles from journals that are
+  not in _id_2_journal, so the shards together cover the original query.
+
+  The shards run on a pool of threads or processes. Their documents are
+  merged into one stream; documents from different shards are interleaved,
+  documents within a shard keep their order. An id seen twice, e.g. an
+  article whose publication_date changed between the probe and the fetch,
+  is only returned once. progress() reports each shard's numFound and the
+  number of documents received from it so far.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+try:
+  from Queue import Queue, Empty, Full
+except ImportError:
+  from queue import Queue, Empty, Full
+from oa_nlp.plos_api import transport
+from oa_nlp.plos_api.solr import Query, _id_2_journal, _jrnl_query_params_str, _num_found
+
+__all__ = ['ShardedQuery']
+
+# PLoS Biology, the first PLOS journal, started in 2003.
+_first_pub_date = datetime(2003, 1, 1)
+
+def _solr_date(d):
+  return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _date_clause(lo, hi, first, last):
+  """
+  _date_clause - half open publication_date range [lo TO hi}. The first
+                 and last ranges are open ended so no article falls
+                 outside the planned span.
+  """
+  lo_str = '*' if first else _solr_date(lo)
+  hi_str = '*]' if last else _solr_date(hi) + '}'
+  return 'publication_date:[{lo} TO {hi}'.format(lo=lo_str, hi=hi_str)
+
+class _Shard(object):
+  """
+  _Shard - one disjoint sub-query and its progress.
+  """
+  def __init__(self, queries, journals, numFound):
+    self.queries = queries
+    self.journals = journals
+    self.numFound = numFound
+    self.fetched = 0
+    self.done = False
+    self.error = None
+
+  def progress(self):
+    return {
+      'query': self.queries,
+      'journals': self.journals,
+      'numFound': self.numFound,
+      'fetched': self.fetched,
+      'done': self.done,
+      }
+
+def _put(out, item, stop):
+  # Blocking put that gives up once the consumer has stopped.
+  while not stop.is_set():
+    try:
+      out.put(item, timeout=0.1)
+      return True
+    except Full:
+      pass
+  return False
+
+def _run_shards(tasks, out, stop, api_key, return_fields, query_args, forked=False):
+  """
+  _run_shards - worker loop, shared by threads and processes. Pulls
+                (index, queries, journals) tasks and sends ('doc', i, doc),
+                ('error', i, msg) and ('done', i, numFound) messages.
+  """
+  if forked:
+    # Pooled connections inherited from the parent must not be shared.
+    transport._default = None
+  while not stop.is_set():
+    try:
+      task = tasks.get(timeout=0.1)
+    except Empty:
+      continue
+    if task is None:
+      return
+    (i, queries, journals) = task
+    q = Query(api_key, queries, return_fields, journals, **query_args)
+    try:
+      for doc in q:
+        if not _put(out, ('doc', i, doc), stop):
+          break
+    except Exception as e:
+      _put(out, ('error', i, str(e)), stop)
+    q.close()
+    _put(out, ('done', i, q.numFound), stop)
+  return
+
+class ShardedQuery(object):
+  """
+  Iterable PLOS Solr query split into disjoint shards run in parallel.
+  """
+  def __init__(self, api_key, queries, return_fields, journals=['*'],
+                     limit=None, shard_size=20000, workers=4, pool='thread',
+                     depth=1000, on_progress=None, **query_args):
+    """
+    @type shard_size: int
+    @param shard_size: journals with more hits are split by date range.
+    @type workers: int
+    @param workers: number of shards fetched at the same time.
+    @type pool: string
+    @param pool: 'thread' or 'process'.
+    @type depth: int
+    @param depth: number of documents buffered between shards and consumer.
+    @type on_progress: callable
+    @param on_progress: called with the shard index and progress dict
+                        whenever a shard finishes.
+    @param query_args: passed on to each shard's Query, e.g. chunk_size.
+    """
+    if pool not in ('thread', 'process'):
+      raise ValueError('ShardedQuery: unknown pool ' + pool)
+    self.api_key = api_key
+    self.queries = list(queries)
+    # Duplicates are recognized by id.
+    self.return_fields = list(return_fields)
+    if 'id' not in self.return_fields:
+      self.return_fields.append('id')
+    self.journals = journals
+    self.limit = limit
+    self.shard_size = shard_size
+    self.workers = workers
+    self.pool = pool
+    self.depth = depth
+    self.on_progress = on_progress
+    query_args.setdefault('limit', 2**62)
+    self.query_args = query_args
+    self.shards = None
+
+  def _plan_dates(self, queries, journals, lo, hi, first, last, count):
+    """
+    _plan_dates - bisect [lo, hi) until every range has at most
+                  shard_size hits or is a day wide.
+    """
+    if count == 0:
+      return []
+    if count <= self.shard_size or hi - lo <= timedelta(days=1):
+      return [ _Shard(queries + [_date_clause(lo, hi, first, last)], journals, count) ]
+    mid = lo + timedelta(days=max((hi - lo).days//2, 1))
+    left = _num_found(self.api_key, queries + [_date_clause(lo, mid, first, False)], journals)
+    return self._plan_dates(queries, journals, lo, mid, first, False, left) + \
+           self._plan_dates(queries, journals, mid, hi, False, last, count - left)
+
+  def _plan_journal(self, queries, journals):
+    count = _num_found(self.api_key, queries, journals)
+    if count == 0:
+      return []
+    if count <= self.shard_size:
+      return [ _Shard(queries, journals, count) ]
+    hi = datetime.utcnow() + timedelta(days=1)
+    return self._plan_dates(queries, journals, _first_pub_date, hi, True, True, count)
+
+  def plan(self):
+    """
+    plan - split the query into shards. Issues rows=0 probes only.
+    """
+    if self.shards is not None:
+      return self.shards
+    shards = []
+    jids = sorted(_id_2_journal.keys()) if self.journals[0] == '*' else self.journals
+    for jid in jids:
+      shards += self._plan_journal(self.queries, [jid])
+    if self.journals[0] == '*':
+      other = [ 'NOT ' + _jrnl_query_params_str(jids) ]
+      shards += self._plan_journal(self.queries + other, ['*'])
+    self.shards = shards
+    return shards
+
+  def numFound(self):
+    return sum([ s.numFound for s in self.plan() ])
+
+  def progress(self):
+    """
+    progress - list of per shard progress dicts.
+    """
+    return [ s.progress() for s in self.plan() ]
+
+  def _start(self):
+    if self.pool == 'process':
+      tasks = multiprocessing.Queue()
+      out = multiprocessing.Queue(self.depth)
+      stop = multiprocessing.Event()
+      make = lambda args : multiprocessing.Process(target=_run_shards, args=args + (True,))
+    else:
+      tasks = Queue()
+      out = Queue(self.depth)
+      stop = threading.Event()
+      make = lambda args : threading.Thread(target=_run_shards, args=args)
+    for i, s in enumerate(self.shards):
+      tasks.put((i, s.queries, s.journals))
+    nworkers = min(self.workers, len(self.shards))
+    for _ in range(nworkers):
+      tasks.put(None)
+    args = (tasks, out, stop, self.api_key, self.return_fields, self.query_args)
+    workers = [ make(args) for _ in range(nworkers) ]
+    for w in workers:
+      w.daemon = True
+      w.start()
+    return (out, stop, workers)
+
+  def __iter__(self):
+    self.plan()
+    (out, stop, workers) = self._start()
+    seen = set()
+    remaining = len(self.shards)
+    count = 0
+    try:
+      while remaining > 0:
+        if self.limit is not None and count >= self.limit:
+          break
+        (kind, i, value) = out.get()
+        shard = self.shards[i]
+        if kind == 'doc':
+          shard.fetched += 1
+          if value['id'] in seen:
+            continue
+          seen.add(value['id'])
+          count += 1
+          yield value
+        elif kind == 'error':
+          shard.error = value
+          raise Exception('ShardedQuery: shard {i} failed: {e}'.format(i=i, e=value))
+        else:
+          shard.done = True
+          shard.numFound = value
+          remaining -= 1
+          if self.on_progress is not None:
+            self.on_progress(i, shard.progress())
+    finally:
+      stop.set()
+      for w in workers:
+        w.join(1.0)
+    return
@@ -35,6 +35,33 @@ Options:
   
   -r --research_only      return research articles only. Same as specifying 
                           'article_type:"Research Article"' as part of the query.
+
+  -p --prefetch=<n>       number of result pages fetched ahead of the consumer
+                          on background threads. 0 disables prefetching.
+                          [default: 0]
+
+  -w --workers=<n>        number of prefetch worker threads.
+                          [default: 1]
+
+  --pool-size=<n>         number of pooled keep-alive connections per host.
+                          [default: 10]
+
+  --paging=<mode>         how result pages are requested. "offset" uses
+                          start/rows, "cursor" uses Solr cursorMark and
+                          "auto" uses cursor paging for large limits.
+                          [default: auto]
+
+  --adaptive              adjust the page size to keep each response near
+                          --target-secs and under --max-page-mb.
+
+  --target-secs=<secs>    target response time for --adaptive.
+                          [default: 5]
+
+  --max-page-mb=<mb>      largest response size for --adaptive.
+                          [default: 16]
+
+  --stream                parse documents as they arrive instead of
+                          reading whole pages. Ignores --prefetch.
 Author:
   Bill OConnor
   
@@ -45,14 +72,48 @@ License:
 import os
 import sys
 import json
-import requests
-from urllib2 import quote, unquote
+import time
+import random
+import itertools
+import threading
+from requests.exceptions import ConnectionError, Timeout
+try:
+  from Queue import Queue, Full
+  from urllib2 import quote, unquote
+except ImportError:
+  # Python 3, so plos_api.aio can share the query construction.
+  from queue import Queue, Full
+  from urllib.parse import quote, unquote
+  xrange = range
+from oa_nlp.plos_api.transport import default_transport, set_default_transport
+from oa_nlp.plos_api.cache import ResponseCache, CacheMiss
+from oa_nlp.plos_api.jsonstream import SolrDocStream
 	
 __version__ = "0.1"
-__all__ = ['article_page_url', 'article_xml_url', 'Query', 'mkJrnlQuery']
+__all__ = ['article_page_url', 'article_xml_url', 'Query', 'mkJrnlQuery', 'set_cache',
+           'lookup_dois']
 
 _search_url = 'http://api.plos.org/search'
 _logger = None
+_cache = None
+
+# Solr offset paging costs O(start) per request. Above this many documents
+# Query switches to cursorMark paging when paging='auto'.
+_cursor_paging_min = 10000
+
+# Responses worth retrying, rate limiting and server side trouble.
+# Retries back off exponentially from _backoff_base up to _backoff_max secs.
+_retry_statuses = (429, 500, 502, 503, 504)
+_max_retries = 6
+_backoff_base = 1.0
+_backoff_max = 120.0
+
+# Bytes read from the socket at a time when streaming responses.
+_stream_chunk_size = 64*1024
+
+# Longest request URL lookup_dois builds. Servers commonly reject
+# request lines over 8k.
+_max_url_len = 7500
 
 """
    _id_2_journal - map a 4 character journal id to quoted journal name
@@ -69,26 +130,119 @@ _id_2_journal= {
   'ppat' : ('"PLoS Pathogens"', 'http://www.plospathogens.org'),
   }	
   
-def _do_get(url):
+def _do_get(url, timeout=None, stream=False):
   """
-  Requests for Humans not so human after all.
-  The verify parameter fails if the URL is not https:(
+  All requests go through the shared pooled transport so connections
+  are kept alive between pages.
   """
-  if url.lower().startswith('https:'):
-    return requests.get(url, verify=False)
-  else:
-    return requests.get(url)
+  return default_transport().get(url, stream=stream, timeout=timeout)
     
+def set_cache(cache):
+  """
+  set_cache - install a ResponseCache under _do_query. None disables caching.
+  """
+  global _cache
+  _cache = cache
+  return cache
+
+def _backoff_delay(attempt, r=None):
+  """
+  _backoff_delay - exponential backoff with jitter. A numeric Retry-After
+                   header from the server takes precedence.
+  """
+  if r is not None:
+    retry_after = r.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+      return min(float(retry_after), _backoff_max)
+  delay = min(_backoff_base * 2**attempt, _backoff_max)
+  return delay/2 + random.uniform(0, delay/2)
+
+def _do_request(query_map, timeout=None, on_retry=None, stream=False):
+  """
+  _do_request - issue the query and return (response, url, query_map) for
+                the first 200 response. Rate limited (429), 5xx, timed out
+                and dropped requests are retried up to _max_retries times
+                with exponential backoff. on_retry(query_map) is called
+                before each retry and returns the query map to retry with,
+                which lets a caller shrink the page it is asking for.
+  """
+  attempt = 0
+  while True:
+    url = _build_solr_url(_search_url, query_map)
+    try:
+      r = _do_get(url, timeout, stream)
+    except (ConnectionError, Timeout):
+      r = None
+    if r is not None and r.status_code == 200:
+      return (r, url, query_map)
+    if r is not None:
+      r.close()
+    if attempt == _max_retries or \
+       (r is not None and r.status_code not in _retry_statuses):
+      raise Exception('_do_query: failed ' + url)
+    time.sleep(_backoff_delay(attempt, r))
+    attempt += 1
+    if on_retry is not None:
+      query_map = on_retry(query_map)
+
+def _do_query_content(query_map, timeout=None, on_retry=None):
+  """
+  _do_query_content - run the query and return (content, url), going
+                      through the response cache if one is set.
+  """
+  content = None if _cache is None else _cache.get(_search_url, query_map)
+  if content is not None:
+    return (content, _build_solr_url(_search_url, query_map))
+
+  (r, url, query_map) = _do_request(query_map, timeout, on_retry)
+  content = r.content
+  if _cache is not None:
+    _cache.put(_search_url, query_map, content)
+  return (content, url)
+
+def _do_query_stream(query_map, timeout=None, on_retry=None, on_done=None):
+  """
+  _do_query_stream - run the query and return (SolrDocStream, url). The
+                     documents are parsed as they arrive from the socket.
+                     A cached response is served from the cache, but
+                     streamed responses are not added to it since that
+                     would mean holding the whole page.
+  """
+  content = None if _cache is None else _cache.get(_search_url, query_map)
+  if content is not None:
+    url = _build_solr_url(_search_url, query_map)
+    return (SolrDocStream([content], on_done), url)
+
+  (r, url, query_map) = _do_request(query_map, timeout, on_retry, stream=True)
+  def on_close():
+    default_transport().account(r)
+    r.close()
+  docs = SolrDocStream(r.iter_content(_stream_chunk_size), on_done, on_close)
+  return (docs, url)
+
+def _do_query_json(query_map, timeout=None, on_retry=None):
+  """
+  _do_query_json - run the query and return the complete JSON result,
+                   including top level keys such as nextCursorMark.
+  """
+  (content, url) = _do_query_content(query_map, timeout, on_retry)
+  # Load JSON into a Python object and use some values from it.
+  json_rslt = json.loads(content)
+  return (json_rslt, url)
+
 def _do_query(query_map):
-  url = _build_solr_url(_search_url, query_map)
-  r = _do_get(url)
-  if r.status_code == 200:
-    # Load JSON into a Python object and use some values from it.
-    json_rslt = json.loads(r.content)
-  else:
-    raise Exception('_do_query: failed ' + url)
+  (json_rslt, url) = _do_query_json(query_map)
   return (json_rslt['response'], url)
   
+def _num_found(api_key, queries, journals):
+  """
+  _num_found - number of matching documents from a rows=0 request.
+  """
+  qmap = _build_query_map(api_key, 0, 0, 
+                          _build_conjunctive_query_str(queries, journals), ['id'])
+  (resp, url) = _do_query(qmap)
+  return int(resp['numFound'])
+
 def _build_query_map(api_key, start, rows, query='', fields=''):
   qmap = {
     'start': str(start),
@@ -117,9 +271,13 @@ def _journal_url(doi):
 def _build_solr_url(url, query):
   """	
   _build_solr_url - given a url and a dictionary of parameter keys and values
-                    create a valid url query string.
+                    create a valid url query string. A list value repeats
+                    the parameter once per item (ex: facet.field).
   """
-  params = [ '{k}={v}'.format(k=k, v=quote(v)) for k,v in query.iteritems() ] 
+  params = []
+  for k,v in query.items():
+    vals = v if isinstance(v, list) else [v]
+    params += [ '{k}={v}'.format(k=k, v=quote(i)) for i in vals ]
   return '{url}?{params}'.format(url=url, params="&".join(params)) 
 
 def _jrnl_query_params_str(journal_ids):
@@ -162,12 +320,225 @@ def article_xml_url(doi, pretty=False):
   return '{url}/article/fetchObjectAttachment.action?representation=XML'\
          '&uri={doi}'.format(url=url, doi=_doi)
     
+class _Slot(object):
+  """
+  _Slot - a placeholder for a page that has been requested but
+          possibly not yet fetched.
+  """
+  def __init__(self, start):
+    self.start = start
+    self.resp = None
+    self.error = None
+    self.done = threading.Event()
+
+class _Prefetcher(object):
+  """
+  _Prefetcher - fetch result pages ahead of the consumer on a pool of
+                worker threads. Slots are queued in request order, so pages
+                come back in the same order no matter which worker finished
+                first. The slot queue holds at most depth pages, which bounds
+                the memory used by pages waiting to be consumed.
+  """
+  def __init__(self, fetch, starts, depth=2, workers=1):
+    self._fetch = fetch
+    self._workers = workers
+    self._slots = Queue(maxsize=depth)
+    self._work = Queue()
+    self._stop = threading.Event()
+    threads = [ threading.Thread(target=self._dispatch, args=(starts,)) ]
+    threads += [ threading.Thread(target=self._run) for _ in xrange(workers) ]
+    for t in threads:
+      t.daemon = True
+      t.start()
+
+  def _put_slot(self, slot):
+    # Blocks while depth pages are queued unless the prefetcher is closed.
+    while not self._stop.is_set():
+      try:
+        self._slots.put(slot, timeout=0.1)
+        return True
+      except Full:
+        pass
+    return False
+
+  def _dispatch(self, starts):
+    try:
+      for start in starts:
+        slot = _Slot(start)
+        if not self._put_slot(slot):
+          break
+        self._work.put(slot)
+    except Exception as e:
+      # Failing to produce the next start is reported by get() in its place.
+      slot = _Slot(None)
+      slot.error = e
+      slot.done.set()
+      self._put_slot(slot)
+    finally:
+      for _ in xrange(self._workers):
+        self._work.put(None)
+      self._put_slot(None)
+
+  def _run(self):
+    while True:
+      slot = self._work.get()
+      if slot is None:
+        return
+      try:
+        if not self._stop.is_set():
+          slot.resp = self._fetch(slot.start)
+      except Exception as e:
+        slot.error = e
+      slot.done.set()
+
+  def get(self):
+    """
+    get - return the next page response in request order or None
+          when there are no more pages.
+    """
+    slot = self._slots.get()
+    if slot is None:
+      return None
+    while not slot.done.wait(0.1):
+      pass
+    if slot.error is not None:
+      raise slot.error
+    return slot.resp
+
+  def close(self):
+    self._stop.set()
+    while not self._slots.empty():
+      self._slots.get_nowait()
+
+def _doi_batches(base_len, dois, batch_size):
+  """
+  _doi_batches - group DOIs into lists whose id:( ... ) clause keeps the
+                 request URL under _max_url_len. Repeated DOIs are dropped.
+  """
+  seen = set()
+  batch = []
+  size = base_len
+  for doi in dois:
+    doi = doi.strip()
+    if not doi or doi in seen:
+      continue
+    seen.add(doi)
+    term_len = len(quote('"{d}" OR '.format(d=doi)))
+    if batch and (len(batch) == batch_size or size + term_len > _max_url_len):
+      yield batch
+      batch = []
+      size = base_len
+    batch.append(doi)
+    size += term_len
+  if batch:
+    yield batch
+
+def _doi_query_str(dois):
+  terms = [ '"{d}"'.format(d=d.replace('"', '\\"')) for d in dois ]
+  return 'id:({ids})'.format(ids=' OR '.join(terms))
+
+def lookup_dois(api_key, dois, return_fields, missing=None, 
+                batch_size=100, workers=4):
+  """
+  lookup_dois - resolve many DOIs with batched id:( ... OR ... ) queries
+                instead of one query per DOI. Batches are sized to keep the
+                URL under _max_url_len and up to workers batches are
+                fetched at the same time.
+
+  @type dois: iterable
+  @param dois: DOIs to look up. Read lazily.
+  @type missing: list
+  @param missing: if given, DOIs with no matching article are appended.
+
+  @return: generator of (doi, doc) tuples in input order.
+  """
+  fields = list(return_fields)
+  if 'id' not in fields:
+    fields.append('id')
+  qmap = _build_query_map(api_key, 0, batch_size, '', fields)
+  base_len = len(_build_solr_url(_search_url, qmap)) + len(quote('id:()'))
+
+  def fetch(batch):
+    bmap = _set_query_map(dict(qmap), 0, len(batch))
+    bmap['q'] = _doi_query_str(batch)
+    (resp, url) = _do_query(bmap)
+    return (batch, resp['docs'])
+
+  batches = _doi_batches(base_len, dois, batch_size)
+  prefetcher = _Prefetcher(fetch, batches, 2*workers, workers)
+  try:
+    while True:
+      rslt = prefetcher.get()
+      if rslt is None:
+        break
+      (batch, docs) = rslt
+      found = dict([ (d['id'], d) for d in docs ])
+      for doi in batch:
+        if doi in found:
+          yield (doi, found[doi])
+        elif missing is not None:
+          missing.append(doi)
+  finally:
+    prefetcher.close()
+  return
+
 class Query(object):
   """
   Iterable PLOS Solr query object.     
+
+  Setting prefetch to n > 0 fetches up to n pages ahead of the consumer
+  on workers background threads. Documents are returned in the same
+  order as without prefetching.
+
+  paging selects how pages are requested. 'offset' uses start/rows,
+  'cursor' uses Solr cursorMark paging sorted on id, which keeps deep
+  pages as cheap as the first one. 'auto' picks 'cursor' when more than
+  _cursor_paging_min documents are requested from the beginning of the
+  result set. Cursor pages depend on the previous page, so cursor paging
+  prefetches on a single worker.
+
+  With adaptive=True the page size starts at chunk_size and is adjusted
+  after every page so a response takes about target_secs and stays under
+  max_page_bytes, within [min_chunk, max_chunk]. A page that has to be
+  retried is asked for again at half the size. Like cursor paging,
+  adaptive paging fetches one page at a time.
+
+  With stream=True each document is parsed and returned as soon as it
+  has arrived rather than after the whole page has been read, so memory
+  use scales with one document instead of one page. Streaming can not be
+  combined with prefetching, and with adaptive paging the time measured
+  for a page includes the time the consumer spent on it.
+
+  Iterating returns a generator that closes the query, stopping any
+  prefetching, when it is exhausted, closed or collected, so a consumer
+  may stop early.
+
+  checkpoint() describes the position after the last returned document.
+  A Query created with its start and cursor_mark, and iterated past its
+  first skip documents, continues where the checkpointed one stopped.
   """
   def __init__(self, api_key, queries, return_fields, journals,
-                     start=0, limit=99, chunk_size=400          ):
+                     start=0, limit=99, chunk_size=400,
+                     prefetch=0, workers=1, paging='auto',
+                     adaptive=False, target_secs=5.0, max_page_bytes=16*1024**2,
+                     min_chunk=10, max_chunk=1000, timeout=None,
+                     stream=False, cursor_mark=None              ):
+    if stream and prefetch > 0:
+      raise ValueError('Query: stream and prefetch can not be combined')
+    if paging == 'auto':
+      if cursor_mark is not None:
+        paging = 'cursor'
+      else:
+        paging = 'cursor' if start == 0 and limit > _cursor_paging_min else 'offset'
+    if paging not in ('offset', 'cursor'):
+      raise ValueError('Query: unknown paging mode ' + paging)
+    if paging == 'cursor' and start != 0 and cursor_mark is None:
+      raise ValueError('Query: cursor paging must start at 0 or at a cursor_mark')
+    if paging == 'offset' and cursor_mark is not None:
+      raise ValueError('Query: cursor_mark requires cursor paging')
+    self.paging = paging
+    # The mark of the page starting at start.
+    self.start_mark = '*' if cursor_mark is None else cursor_mark
     self.start = start; 
     self.limit = limit; 
     self.chunk_size = limit if limit < chunk_size else chunk_size
@@ -178,43 +549,298 @@ class Query(object):
                                  return_fields)       
     self.buffer = []; 
     self.numFound = 0; self.num_returned = 0
+    if paging == 'cursor':
+      # cursorMark requires a sort that includes the unique key.
+      self.qmap['sort'] = 'id asc'
+    self.prefetch = prefetch
+    self.adaptive = adaptive
+    self.target_secs = target_secs
+    self.max_page_bytes = max_page_bytes
+    self.min_chunk = min_chunk
+    self.max_chunk = max_chunk
+    self.timeout = timeout
+    self.stream = stream
+    self._docs = None
+    self.workers = workers if not self._sequential() else 1
+    self._prefetcher = None
+    # cursor_mark is the mark of the page in the buffer. The _next_*
+    # attributes belong to whichever thread fetches sequential pages.
+    self.cursor_mark = None
+    self._reset_fetch()
+
+  def count(self):
+    """
+    count - total number of matching documents. Uses a rows=0 request, so
+            no documents are downloaded.
+    """
+    qmap = _set_query_map(dict(self.qmap), 0, 0)
+    (resp, url) = _do_query(qmap)
+    return int(resp['numFound'])
+
+  def facets(self, fields, limit=100, mincount=1):
+    """
+    facets - value counts for each of fields over all matching documents
+             from a single rows=0 facet request.
+
+    @type fields: list
+    @param fields: solr fields to facet on (ex: ['subject', 'journal']).
+    @type limit: int
+    @param limit: largest number of values returned per field. -1 for all.
+
+    @rtype: dict
+    @return: field -> list of (value, count) tuples, most frequent first.
+    """
+    qmap = _set_query_map(dict(self.qmap), 0, 0)
+    qmap['facet'] = 'true'
+    qmap['facet.field'] = list(fields)
+    qmap['facet.limit'] = str(limit)
+    qmap['facet.mincount'] = str(mincount)
+    (json_rslt, url) = _do_query_json(qmap)
+    facet_fields = json_rslt['facet_counts']['facet_fields']
+    # Solr returns each field as a flat [value, count, value, count, ...] list.
+    return dict([ (f, list(zip(facet_fields[f][::2], facet_fields[f][1::2])))
+                  for f in fields ])
+
+  def checkpoint(self):
+    """
+    checkpoint - where to resume after the last document returned.
+
+    @rtype: dict
+    @return: 'paging', 'start' and 'cursor_mark' for a new Query and the
+             number of its documents to 'skip'.
+    """
+    if self.paging == 'offset':
+      return { 'paging': 'offset', 'start': self.cursor, 'cursor_mark': None, 'skip': 0 }
+    # A cursor mark only points at the start of a page.
+    page_start = self.cursor - self.buffer_cursor
+    return { 'paging': 'cursor', 'start': page_start,
+             'cursor_mark': self.cursor_mark, 'skip': self.buffer_cursor }
+
+  def _sequential(self):
+    """
+    _sequential - True if each page depends on the one before it.
+    """
+    return self.paging == 'cursor' or self.adaptive
+
+  def _reset_fetch(self):
+    self.rows = self.chunk_size
+    self._next_start = self.start
+    self._next_mark = self.start_mark
+    self._fetch_limit = self.limit
+    self._exhausted = False
+    return
+
+  def _shrink(self, qmap):
+    """
+    _shrink - halve the page size of a request that is about to be retried.
+    """
+    self.rows = max(self.min_chunk, self.rows//2)
+    qmap['rows'] = str(min(self.rows, int(qmap['rows'])))
+    return qmap
+
+  def _adapt(self, rows, ndocs, secs, nbytes):
+    """
+    _adapt - size the next page from the cost per document of the last one.
+             Growth is limited to doubling per page.
+    """
+    if ndocs == 0:
+      return
+    by_time = self.target_secs * ndocs / max(secs, 0.001)
+    by_size = self.max_page_bytes * ndocs / max(nbytes, 1)
+    rows = int(min(by_time, by_size, 2*rows))
+    self.rows = max(self.min_chunk, min(self.max_chunk, rows))
+    return
+
+  def _request_page(self, start, rows, on_retry=None, finish=None):
+    """
+    _request_page - request a page and return the Solr response dict.
+                    finish(ndocs, nbytes, next_mark) is called once the
+                    page has been read, which for a streamed page is when
+                    its last document has been consumed.
+    """
+    qmap = _set_query_map(dict(self.qmap), start, rows)
+    mark = None
+    if self.paging == 'cursor':
+      mark = self._next_mark
+      qmap['start'] = '0'
+      qmap['cursorMark'] = mark
+    if self.stream:
+      done = None
+      if finish is not None:
+        done = lambda s : finish(s.count, s.nbytes, s.next_cursor_mark)
+      (docs, url) = _do_query_stream(qmap, self.timeout, on_retry, done)
+      resp = { 'numFound': docs.numFound, 'docs': docs }
+    else:
+      (content, url) = _do_query_content(qmap, self.timeout, on_retry)
+      json_rslt = json.loads(content)
+      resp = json_rslt['response']
+      if finish is not None:
+        finish(len(resp['docs']), len(content), json_rslt.get('nextCursorMark'))
+    resp['cursorMark'] = mark
+    return resp
     
-  def _fetch_docs(self, start, rows):
-    _set_query_map(self.qmap, start, rows)
-    (resp, url) = _do_query(self.qmap)
+  def _fetch_page(self, start, rows):
+    """
+    _fetch_page - fetch a single offset page without touching the iterator
+                  state. Safe to call from prefetch worker threads.
+    """
+    return self._request_page(start, rows)
+
+  def _fetch_next(self):
+    """
+    _fetch_next - fetch the page following the last one fetched. Used for
+                  cursor and adaptive paging. Only one thread at a time may
+                  call it.
+    """
+    if self._exhausted or self._next_start >= self._fetch_limit:
+      self._exhausted = True
+      return { 'numFound': self.numFound, 'docs': [] }
+    rows = min(self.rows, self._fetch_limit - self._next_start)
+    on_retry = self._shrink if self.adaptive else None
+    t0 = time.time()
+    def finish(ndocs, nbytes, next_mark):
+      if self.paging == 'cursor':
+        # Solr hands back the mark it was given once the results run out.
+        if next_mark == self._next_mark:
+          self._exhausted = True
+        self._next_mark = next_mark
+      self._next_start += ndocs
+      if ndocs == 0:
+        self._exhausted = True
+      if self.adaptive:
+        self._adapt(min(rows, self.rows), ndocs, time.time() - t0, nbytes)
+    resp = self._request_page(self._next_start, rows, on_retry, finish)
+    self._fetch_limit = min(self._fetch_limit, int(resp['numFound']))
+    return resp
+
+  def _load_page(self, resp):
+    self.cursor_mark = resp.get('cursorMark')
     self.numFound = int(resp['numFound'])
     if self.numFound < self.limit:
       self.limit = self.numFound
-    self.buffer = resp['docs']
-    self.num_returned = len(self.buffer)
+    self.buffer_cursor = 0
+    if isinstance(resp['docs'], SolrDocStream):
+      self._docs = resp['docs']
+      self.buffer = []
+      self.num_returned = 0
+    else:
+      self.buffer = resp['docs']
+      self.num_returned = len(self.buffer)
+    return
+
+  def _next_buffered(self):
+    """
+    _next_buffered - the next document of the current page or None.
+    """
+    if self._docs is not None:
+      doc = next(self._docs, None)
+      if doc is None:
+        self._docs = None
+      else:
+        self.num_returned += 1
+        self.buffer_cursor += 1
+      return doc
+    if self.buffer_cursor == self.num_returned:
+      return None
+    doc = self.buffer[self.buffer_cursor]   
+    self.buffer_cursor += 1 
+    return doc
+
+  def _fetch_docs(self, start, rows):
+    if self._sequential():
+      self._load_page(self._fetch_next())
+    else:
+      self._load_page(self._fetch_page(start, rows))
+    return
+
+  def _start_prefetch(self):
+    if self._sequential():
+      # The number of pages is not known up front. Once the results run
+      # out _fetch_next returns empty pages, which end the iteration.
+      starts = itertools.count()
+      fetch = lambda start : self._fetch_next()
+    else:
+      rows = self.chunk_size
+      starts = xrange(self.cursor + rows, self.limit, rows)
+      fetch = lambda start : self._fetch_page(start, rows)
+    self._prefetcher = _Prefetcher(fetch, starts, self.prefetch, self.workers)
+    return
+
+  def close(self):
+    """
+    close - stop any background prefetching and release a streamed
+            response that has not been read to the end.
+    """
+    if self._prefetcher is not None:
+      self._prefetcher.close()
+      self._prefetcher = None
+    if self._docs is not None:
+      self._docs.close()
+      self._docs = None
     return
                 
-  # Iterator Protocol       
-  def __iter__(self):
+  def _restart(self):
+    self.close()
     self.cursor = self.start
     self.buffer_cursor = 0
     self.buffer = []
+    self._reset_fetch()
     self._fetch_docs(self.cursor, self.chunk_size)   
-    return self
+    if self.prefetch > 0:
+      self._start_prefetch()
+    return
 
-  # Iterator Next    
-  def next(self):
-    if self.cursor == self.limit:
-      raise StopIteration
+  def _next_doc(self):
+    """
+    _next_doc - the next document, None at the end of the results.
+    """
+    if self.cursor >= self.limit:
+      self.close()
+      return None
 
-    if self.buffer_cursor == self.chunk_size:
-      self.buffer_cursor = 0
-      self._fetch_docs(self.cursor, self.chunk_size)
+    doc = self._next_buffered()
+    if doc is None:
+      if self._prefetcher is not None:
+        resp = self._prefetcher.get()
+        if resp is None:
+          self.close()
+          return None
+        self._load_page(resp)
+      else:
+        self._fetch_docs(self.cursor, self.chunk_size)
 
-      if self.num_returned == 0:
-        raise StopIteration
+      doc = self._next_buffered()
+      if doc is None:
+        self.close()
+        return None
 
-    doc = self.buffer[self.buffer_cursor]   
-    self.buffer_cursor += 1 
     self.cursor += 1  
 
     return doc
 
+  # Iterator Protocol       
+  def __iter__(self):
+    # A generator, so a consumer that stops early, or is stopped by an
+    # exception, closes the query when it lets go of the iterator. The
+    # prefetch threads hold the query, it is never collected while they
+    # run.
+    self._restart()
+    try:
+      while True:
+        doc = self._next_doc()
+        if doc is None:
+          return
+        yield doc
+    finally:
+      self.close()
+
+  # Next document, for callers that step the query by hand.
+  def next(self):
+    doc = self._next_doc()
+    if doc is None:
+      raise StopIteration
+    return doc
+
 ####################### MAIN ##########################
 
 if __name__ == "__main__":
@@ -226,6 +852,7 @@ if __name__ == "__main__":
                 
   api_key = args['--api-key']
   limit = sys.maxint if args['--limit'] == '*' else int(args['--limit'])
+  set_default_transport(pool_size=int(args['--pool-size']))
 
   if args['--fields'] == None:
     sys.exit('--fields option must contain one or more field identifiers.')
@@ -241,7 +868,13 @@ if __name__ == "__main__":
   if args['--research_only']:
     queries.append('article_type:"Research Article"')
  
-  pq = Query(api_key, queries, field_ids, journal_ids, limit=limit)
+  prefetch = 0 if args['--stream'] else int(args['--prefetch'])
+  pq = Query(api_key, queries, field_ids, journal_ids, limit=limit,
+             prefetch=prefetch, workers=int(args['--workers']),
+             paging=args['--paging'], adaptive=args['--adaptive'],
+             target_secs=float(args['--target-secs']),
+             max_page_bytes=int(args['--max-page-mb'])*1024**2,
+             stream=args['--stream'])
   count = 1
   for r in pq:
     json_dict = dict()
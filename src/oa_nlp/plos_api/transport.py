@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+plos_api transport
+
+Shared HTTP transport for the PLOS solr api and the Entrez fetches.
+
+  Description:
+  ===========
+
+  A single pooled requests.Session is shared by every fetch path so
+  connections to api.plos.org (and eutils) are kept alive between pages
+  instead of paying for a new TCP/TLS handshake per request. gzip and
+  deflate are requested explicitly since the article bodies compress well.
+
+  The transport keeps simple counters: requests made, bytes received over
+  the wire (compressed size) and connections reused from the pool.
+
+Author:
+  Bill OConnor
+
+License:
+  Apache 2.0
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ['Transport', 'default_transport', 'set_default_transport']
+
+_default_headers = {
+  'Accept-Encoding': 'gzip, deflate',
+  'Connection': 'keep-alive',
+  }
+
+class Transport(object):
+  """
+  Pooled keep-alive HTTP transport.
+  """
+  def __init__(self, pool_size=10, headers=None):
+    """
+    @type pool_size: int
+    @param pool_size: maximum number of connections kept per host. Should
+                      be at least the number of threads using the transport.
+    @type headers: dict
+    @param headers: extra headers sent with every request.
+    """
+    self.pool_size = pool_size
+    self.session = requests.Session()
+    self.session.headers.update(_default_headers)
+    if headers is not None:
+      self.session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self._lock = threading.Lock()
+    self.num_requests = 0
+    self.bytes_received = 0
+
+  def get(self, url, stream=False, **kwargs):
+    """
+    get - issue a GET on a pooled connection. The verify parameter
+          fails if the URL is not https:( so it is only passed for https.
+
+    With stream=True the body is not read here; call account(r) once it
+    has been consumed to include it in the byte count.
+    """
+    if url.lower().startswith('https:'):
+      kwargs.setdefault('verify', False)
+    r = self.session.get(url, stream=stream, **kwargs)
+    with self._lock:
+      self.num_requests += 1
+    if not stream:
+      # Read the body now so the byte count is complete.
+      r.content
+      self.account(r)
+    return r
+
+  def account(self, r):
+    """
+    account - add the bytes pulled over the wire for response r.
+    """
+    with self._lock:
+      self.bytes_received += r.raw.tell()
+    return
+
+  def _pools(self):
+    seen = set()
+    for adapter in self.session.adapters.values():
+      if id(adapter) in seen:
+        continue
+      seen.add(id(adapter))
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+          yield pool
+
+  def connections_opened(self):
+    return sum([ p.num_connections for p in self._pools() ])
+
+  def connections_reused(self):
+    """
+    connections_reused - requests that went out on an already open
+                         connection.
+    """
+    reqs = sum([ p.num_requests for p in self._pools() ])
+    return max(reqs - self.connections_opened(), 0)
+
+  def stats(self):
+    return {
+      'requests': self.num_requests,
+      'bytes_received': self.bytes_received,
+      'connections_opened': self.connections_opened(),
+      'connections_reused': self.connections_reused(),
+      }
+
+  def close(self):
+    self.session.close()
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_transport():
+  """
+  default_transport - the process wide transport, created on first use.
+  """
+  global _default
+  with _default_lock:
+    if _default is None:
+      _default = Transport()
+    return _default
+
+def set_default_transport(transport=None, pool_size=10):
+  """
+  set_default_transport - replace the process wide transport. If transport
+                          is None a new one is created with pool_size
+                          connections per host.
+  """
+  global _default
+  with _default_lock:
+    if _default is not None:
+      _default.close()
+    _default = transport if transport is not None else Transport(pool_size)
+    return _default
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Base test case for corpus builds against the Solr stand-in.
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import context
+from solr_standin import Solr_standin, make_docs
+from oa_nlp.plos_api import solr
+from plos_builder import Plos_builder, QUERY_RTN_FLDS
+from plos_reader import Plos_reader
+
+class Builder_case(unittest.TestCase):
+  """
+  Starts a stand-in serving ndocs documents for the test class and gives
+  each test a scratch directory for its corpora.
+  """
+  ndocs = 120
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = Solr_standin(make_docs(cls.ndocs))
+    cls.saved_url = solr._search_url
+    solr._search_url = cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    solr._search_url = cls.saved_url
+    cls.server.stop()
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def query(self, fields=QUERY_RTN_FLDS, **kwargs):
+    kwargs.setdefault('limit', self.ndocs)
+    kwargs.setdefault('chunk_size', 25)
+    return solr.Query('key', ['*:*'], fields, ['*'], **kwargs)
+
+  def build(self, name, docs=None, **kwargs):
+    """
+    build - build a corpus in the scratch directory from docs, the whole
+            stand-in by default, and return its directory.
+    """
+    base_dir = os.path.join(self.tmp, name)
+    with Plos_builder(['*:*'], base_dir, 'test', **kwargs) as b:
+      b.build(self.query() if docs is None else docs)
+    return base_dir
+
+  def info(self, base_dir):
+    """
+    info - the corpus info without its creation date.
+    """
+    with open(os.path.join(base_dir, 'full_corpus_info.json')) as fd:
+      info = json.load(fd)
+    del info['creation_date']
+    return info
+
+  def assertSameText(self, dir1, dir2, corpus_type='full'):
+    for part in ('body', 'abstract'):
+      r1 = Plos_reader(dir1, corpus_type=corpus_type, doc_part=part)
+      r2 = Plos_reader(dir2, corpus_type=corpus_type, doc_part=part)
+      self.assertEqual(r1.fileids(), r2.fileids())
+      for f in r1.fileids():
+        self.assertEqual(r1.raw(f), r2.raw(f))
+    return
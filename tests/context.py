@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""
+Put the sources on sys.path for the tests. oa_nlp.nltk uses implicit
+relative imports, so its directory goes on the path as well.
+
+  python -m unittest discover -s tests
+"""
+import os
+import sys
+
+_src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+for path in (_src, os.path.join(_src, 'oa_nlp', 'nltk')):
+  if path not in sys.path:
+    sys.path.insert(0, path)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the PLOS Solr search server.
+
+  Serves a fixed list of documents over HTTP with the parts of the Solr
+  API the package uses: q with id:"..." or id:( ... OR ... ) terms or
+  with journal:( ... ), NOT journal:( ... ) and publication_date:[lo TO
+  hi] clauses, any other q matches everything, start/rows paging,
+  cursorMark paging on the id sort, fl and rows=0 counts. Every
+  request's parameters are recorded in requests. extra_found is added to
+  numFound, as when documents are added while a query is paged, and with
+  frozen_mark set nextCursorMark is always the mark of the request.
+  Responses are held back delay seconds, the latency of a remote server.
+
+    server = Solr_standin(make_docs(100))
+    solr._search_url = server.start()
+    ...
+    server.stop()
+
+  Run as a script it serves until interrupted, for benchmarks:
+
+    python solr_standin.py NDOCS [PORT [DELAY]]
+"""
+import re
+import sys
+import json
+import time
+import urlparse
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+_journals = [ ('pone', 'PLoS ONE'), ('pbio', 'PLoS Biology'), ('pgen', 'PLoS Genetics') ]
+_subjects = [ 'Biology', 'Medicine', 'Genetics', 'Physics' ]
+
+def make_docs(n):
+  """
+  make_docs - n documents with the fields of plos_builder.QUERY_RTN_FLDS.
+              Their DOIs are not in id order, to tell the sorts apart.
+  """
+  docs = []
+  for i in range(n):
+    (jid, journal) = _journals[i % len(_journals)]
+    docs.append({
+      'id': u'10.1371/journal.{j}.{i:07d}'.format(j=jid, i=i),
+      'journal': journal,
+      'publication_date': u'20{y:02d}-{m:02d}-01T00:00:00Z'.format(y=5 + i % 10, m=1 + i % 12),
+      'article_type': u'Research Article' if i % 4 else u'Editorial',
+      'author': [ u'Author {i}'.format(i=i), u'Second Author' ],
+      'subject': [ _subjects[i % 4], _subjects[(i + 1) % 4] ],
+      'title': u'Title {i} \xe9'.format(i=i),
+      'abstract': [ u'Abstract {i}. The cells grew.'.format(i=i) ],
+      'body': u'Body of article {i}. We found things.\n\nA second paragraph \xe9.\n'.format(i=i) * 5,
+      'editor': u'Editor',
+      })
+  return docs
+
+def _matches(doc, q):
+  if q.startswith('id:'):
+    return doc['id'] in re.findall(r'"([^"]+)"', q)
+  for negated, names in re.findall(r'(NOT )?journal:\s*\(([^)]*)\)', q):
+    if (doc['journal'] in re.findall(r'"([^"]+)"', names)) == bool(negated):
+      return False
+  for lo, hi, bracket in re.findall(r'publication_date:\[(\S+) TO (\S+?)([\]}])', q):
+    date = doc['publication_date']
+    if lo != '*' and date < lo:
+      return False
+    if hi != '*' and (date > hi or (bracket == '}' and date == hi)):
+      return False
+  return True
+
+class _Handler(BaseHTTPRequestHandler):
+  # One request per connection, so no handler outlives the tests.
+  protocol_version = 'HTTP/1.0'
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    standin = self.server.standin
+    params = dict([ (k, v[0]) for k,v in urlparse.parse_qs(urlparse.urlparse(self.path).query).items() ])
+    with standin.lock:
+      standin.requests.append(params)
+    docs = [ d for d in standin.docs if _matches(d, params.get('q', '')) ]
+    rows = int(params.get('rows', '10'))
+    start = int(params.get('start', '0'))
+    rslt = { 'responseHeader': { 'status': 0 } }
+    if 'cursorMark' in params:
+      mark = params['cursorMark']
+      docs = sorted(docs, key=lambda d : d['id'])
+      after = docs if mark == '*' else [ d for d in docs if d['id'] > mark ]
+      page = after[:rows]
+      rslt['nextCursorMark'] = page[-1]['id'] if page and not standin.frozen_mark else mark
+    else:
+      page = docs[start:start + rows]
+    if params.get('fl'):
+      fields = params['fl'].split(',')
+      page = [ dict([ (k, d[k]) for k in fields if k in d ]) for d in page ]
+    rslt['response'] = { 'numFound': len(docs) + standin.extra_found, 'start': start, 'docs': page }
+    body = json.dumps(rslt)
+    if standin.delay:
+      time.sleep(standin.delay)
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+class _Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class Solr_standin(object):
+  """
+  The stand-in server, on a free port of 127.0.0.1.
+  """
+  def __init__(self, docs):
+    self.docs = docs
+    self.requests = []
+    self.extra_found = 0
+    self.frozen_mark = False
+    self.delay = 0
+    self.lock = threading.Lock()
+    self._server = None
+
+  def start(self, port=0):
+    """
+    start - serve in a background thread and return the search URL.
+    """
+    self._server = _Server(('127.0.0.1', port), _Handler)
+    self._server.standin = self
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{p}/search'.format(p=self._server.server_address[1])
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    return
+
+if __name__ == '__main__':
+  server = Solr_standin(make_docs(int(sys.argv[1])))
+  if len(sys.argv) > 3:
+    server.delay = float(sys.argv[3])
+  print(server.start(int(sys.argv[2]) if len(sys.argv) > 2 else 0))
+  sys.stdout.flush()
+  try:
+    while True:
+      time.sleep(60)
+  except KeyboardInterrupt:
+    server.stop()
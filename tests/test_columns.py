@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata column predicates.
+"""
+import unittest
+import context
+from columns import Column, Mask, encode_column
+
+_dates = [ u'2012-03-01', None, u'2013-01-01', u'2011-12-31', None, u'2012-11-30' ]
+
+class Column_test(unittest.TestCase):
+
+  def setUp(self):
+    (values, codes) = encode_column(_dates)
+    self.col = Column('publication_date', values, codes)
+
+  def rows(self, mask):
+    self.assertTrue(isinstance(mask, Mask))
+    return mask.rows()
+
+  def test_ranges_leave_out_missing_values(self):
+    self.assertEqual(self.rows(self.col < u'2012'), [3])
+    self.assertEqual(self.rows(self.col <= u'2012-03-01'), [0, 3])
+    self.assertEqual(self.rows(self.col > u'2012-03-01'), [2, 5])
+    self.assertEqual(self.rows(self.col >= u'2012'), [0, 2, 5])
+    self.assertEqual(self.rows(self.col.between(u'2000', u'2013')), [0, 3, 5])
+    self.assertEqual(self.rows(self.col != u'2013-01-01'), [0, 3, 5])
+
+  def test_missing_values(self):
+    self.assertEqual(self.rows(self.col == None), [1, 4])
+    self.assertEqual(self.rows(self.col == u'2013-01-01'), [2])
+
+if __name__ == '__main__':
+  unittest.main()
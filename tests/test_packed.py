@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Packed shard storage of the corpus text.
+"""
+import os
+import glob
+import unittest
+from builder_case import Builder_case
+from plos_reader import Plos_reader
+from packed import Packed_writer, Packed_corpus, is_packed
+
+_texts = [ (u'a-body.txt', u'First document.\n\nWith two paragraphs \xe9.'),
+           (u'a-abstract.txt', u''),
+           (u'b-body.txt', u'Second document. ' * 40),
+           (u'b-abstract.txt', u'中文 and ASCII.') ]
+
+class Packed_storage_test(Builder_case):
+
+  def write(self, texts, **kwargs):
+    w = Packed_writer(self.tmp, **kwargs)
+    for fileid, text in texts:
+      w.add(fileid, text)
+    w.close()
+    return Packed_corpus(self.tmp)
+
+  def test_round_trip(self):
+    corpus = self.write(_texts, shard_bytes=100)
+    self.assertTrue(is_packed(self.tmp))
+    self.assertEqual(corpus.fileids(), sorted([ f for f,t in _texts ]))
+    for fileid, text in _texts:
+      self.assertEqual(corpus.read(fileid), text)
+      self.assertEqual(corpus.size(fileid), len(text.encode('utf-8')))
+    self.assertTrue(len(glob.glob(os.path.join(self.tmp, 'packed-*.dat'))) > 1)
+
+  def test_append_and_rewrite(self):
+    self.write(_texts[:2], shard_bytes=100)
+    # A reopened corpus is appended to, the last entry of a fileid wins.
+    corpus = self.write(_texts[2:] + [ (u'a-body.txt', u'Replaced.') ], shard_bytes=100)
+    self.assertEqual(corpus.read(u'a-body.txt'), u'Replaced.')
+    self.assertEqual(corpus.read(u'b-body.txt'), _texts[2][1])
+
+  def test_reader_matches_files(self):
+    files = self.build('files', writers=2)
+    packed = self.build('packed', writers=2, storage='packed', shard_bytes=20000)
+    self.assertEqual(self.info(packed), self.info(files))
+    self.assertSameText(packed, files)
+    self.assertEqual(glob.glob(os.path.join(packed, '*.txt')), [])
+    self.assertTrue(len(glob.glob(os.path.join(packed, 'packed-*.dat'))) > 1)
+    r1 = Plos_reader(files)
+    r2 = Plos_reader(packed)
+    self.assertEqual(list(r2.words()), list(r1.words()))
+    category = r1.categories()[0]
+    self.assertEqual(r2.raw(categories=category), r1.raw(categories=category))
+
+class Compressed_storage_test(Builder_case):
+
+  def test_round_trip(self):
+    texts = _texts + [ (u'{i}-body.txt'.format(i=i), u'Document {i}. The cells grew. '.format(i=i) * 20)
+                       for i in range(20) ]
+    # The first dict_docs documents wait for the dictionary, the rest
+    # are compressed with it.
+    w = Packed_writer(self.tmp, shard_bytes=2000, level=6, dict_docs=5)
+    for fileid, text in texts:
+      w.add(fileid, text)
+    w.close()
+    corpus = Packed_corpus(self.tmp)
+    self.assertTrue(os.path.isfile(os.path.join(self.tmp, 'packed.dict')))
+    for fileid, text in texts:
+      self.assertEqual(corpus.read(fileid), text)
+    long_doc = texts[-1][0]
+    self.assertTrue(corpus.stored_size(long_doc) < corpus.size(long_doc) // 4)
+
+  def test_level_must_match(self):
+    Packed_writer(self.tmp, level=6).close()
+    self.assertRaises(ValueError, Packed_writer, self.tmp, level=0)
+
+  def test_reader_matches_files(self):
+    files = self.build('files')
+    packed = self.build('packed', writers=2, storage='packed', shard_bytes=20000,
+                        compress_level=6)
+    self.assertEqual(self.info(packed), self.info(files))
+    self.assertSameText(packed, files)
+
+if __name__ == '__main__':
+  unittest.main()
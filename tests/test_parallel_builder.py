@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Corpora built by several processes and merged.
+"""
+import os
+import unittest
+from builder_case import Builder_case
+from plos_reader import Plos_reader
+import parallel_builder
+
+class Interrupted(Exception):
+  pass
+
+def _crash(*args):
+  raise Interrupted()
+
+class _Crashing_os(object):
+  """
+  The os module, except that rename raises Interrupted after n calls.
+  """
+  def __init__(self, n):
+    self.n = n
+
+  def __getattr__(self, name):
+    return getattr(os, name)
+
+  def rename(self, src, dst):
+    if self.n == 0:
+      raise Interrupted()
+    self.n -= 1
+    os.rename(src, dst)
+    return
+
+class Parallel_builder_test(Builder_case):
+
+  def parallel(self, name, resume=False, **kwargs):
+    base_dir = os.path.join(self.tmp, name)
+    parallel_builder.build_parallel('key', ['*:*'], ['*'], base_dir, 'test', processes=2,
+                                    shard_size=30, query_args={ 'chunk_size' : 25 },
+                                    resume=resume, train=10, **kwargs)
+    return base_dir
+
+  def assertSameCorpus(self, base_dir, ref):
+    # The parts are merged by journal and date, not in the query order.
+    info = self.info(base_dir)
+    ref_info = self.info(ref)
+    for key in ('document_count', 'doi_article_info', 'dois_to_categories', 'query', 'desc'):
+      self.assertEqual(info[key], ref_info[key])
+    for cat, dois in ref_info['categories_to_dois'].items():
+      self.assertEqual(sorted(info['categories_to_dois'][cat]), sorted(dois))
+    for corpus_type in ('full', 'training'):
+      self.assertEqual(sorted(Plos_reader(base_dir, corpus_type=corpus_type).dois()),
+                       sorted(Plos_reader(ref, corpus_type=corpus_type).dois()))
+    for part in ('body', 'abstract'):
+      r1 = Plos_reader(base_dir, doc_part=part)
+      r2 = Plos_reader(ref, doc_part=part)
+      self.assertEqual(sorted(r1.fileids()), sorted(r2.fileids()))
+      for f in r2.fileids():
+        self.assertEqual(r1.raw(f), r2.raw(f))
+    # Each part wrote its own shards.
+    def listing(d):
+      return sorted([ fn for fn in os.listdir(d) if not fn.startswith('packed-') ])
+    self.assertEqual(listing(base_dir), listing(ref))
+    self.assertFalse(os.path.exists(os.path.join(base_dir, 'full_corpus_info.jsonl')))
+
+  def test_same_corpus_as_one_process(self):
+    ref = self.build('ref', split='hash', train=10)
+    self.assertSameCorpus(self.parallel('parallel'), ref)
+
+  def test_merge_is_restartable(self):
+    ref = self.build('ref', split='hash', train=10, storage='packed', shard_bytes=20000)
+    saved = parallel_builder.merge_tokens
+    parallel_builder.merge_tokens = _crash
+    try:
+      self.assertRaises(Interrupted, self.parallel, 'parallel', storage='packed',
+                        shard_bytes=20000)
+    finally:
+      parallel_builder.merge_tokens = saved
+    base_dir = self.parallel('parallel', True, storage='packed', shard_bytes=20000)
+    self.assertSameCorpus(base_dir, ref)
+
+  def test_move_is_restartable(self):
+    ref = self.build('ref', split='hash', train=10)
+    parallel_builder.os = _Crashing_os(40)
+    try:
+      self.assertRaises(Interrupted, self.parallel, 'parallel')
+    finally:
+      parallel_builder.os = os
+    self.assertSameCorpus(self.parallel('parallel', True), ref)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpointed builds resumed after an interruption.
+"""
+import os
+import unittest
+from builder_case import Builder_case
+from plos_builder import Plos_builder, METADATA_RTN_FLDS
+
+class Interrupted(Exception):
+  pass
+
+class _Crashing(object):
+  """
+  Iterates over docs and raises Interrupted after n of them. Passes the
+  checkpoint() of a Query through unless hide_checkpoint is set.
+  """
+  def __init__(self, docs, n, hide_checkpoint=False):
+    self.docs = docs
+    self.n = n
+    if hasattr(docs, 'checkpoint') and not hide_checkpoint:
+      self.checkpoint = docs.checkpoint
+
+  def __iter__(self):
+    for i, doc in enumerate(self.docs):
+      if i == self.n:
+        raise Interrupted()
+      yield doc
+
+class _Crashing_builder(Plos_builder):
+  """
+  Raises Interrupted instead of adding the article at crash_at.
+  """
+  crash_at = None
+
+  def add(self, doc):
+    if self.doc_total_count == self.crash_at:
+      raise Interrupted()
+    return Plos_builder.add(self, doc)
+
+class Resume_test(Builder_case):
+  ndocs = 300
+
+  def resumed(self, crashes, paging='offset', hide_checkpoint=False, **kwargs):
+    """
+    resumed - build, interrupted after each number of documents in
+              crashes, resuming each time, and return the directory.
+    """
+    base_dir = os.path.join(self.tmp, 'resumed')
+    resume = False
+    for n in crashes + [None]:
+      try:
+        with Plos_builder(['*:*'], base_dir, 'test', train=10, checkpoint_every=20,
+                          resume=resume, **kwargs) as b:
+          point = b.resume_point()
+          skip = 0
+          if point is None:
+            docs = self.query(paging=paging)
+          else:
+            docs = self.query(start=point['start'], cursor_mark=point['cursor_mark'],
+                              paging=point['paging'] or paging)
+            skip = point['skip']
+          b.build(docs if n is None else _Crashing(docs, n, hide_checkpoint), skip=skip)
+      except Interrupted:
+        resume = True
+    return base_dir
+
+  def check(self, crashes, paging='offset', **kwargs):
+    ref = self.build('ref', self.query(paging=paging), train=10, **kwargs)
+    base_dir = self.resumed(crashes, paging, **kwargs)
+    self.assertEqual(self.info(base_dir), self.info(ref))
+    self.assertEqual(sorted(os.listdir(base_dir)), sorted(os.listdir(ref)))
+    self.assertFalse(os.path.exists(os.path.join(base_dir, 'full_corpus_info.jsonl')))
+    for corpus_type in ('full', 'training'):
+      self.assertSameText(base_dir, ref, corpus_type)
+
+  def test_offset(self):
+    self.check([77, 130], writers=2)
+
+  def test_cursor(self):
+    self.check([77, 130], 'cursor', writers=2)
+
+  def test_packed(self):
+    self.check([45, 101], 'cursor', storage='packed', compress_level=6, shard_bytes=5000)
+
+  def test_input_without_position(self):
+    # The input is replayed from the start and the checkpointed
+    # documents passed over.
+    ref = self.build('ref', train=10)
+    base_dir = self.resumed([77, 130], hide_checkpoint=True, writers=2)
+    self.assertEqual(self.info(base_dir), self.info(ref))
+    self.assertSameText(base_dir, ref)
+
+  def test_two_phase(self):
+    def two_phase(base_dir, crash_at=None, resume=False):
+      with _Crashing_builder(['*:*'], base_dir, 'test', train=10, checkpoint_every=20,
+                             resume=resume) as b:
+        b.crash_at = crash_at
+        b.build_two_phase(self.query(METADATA_RTN_FLDS), 'key', batch_size=9)
+    ref = os.path.join(self.tmp, 'ref')
+    two_phase(ref)
+    base_dir = os.path.join(self.tmp, 'resumed')
+    self.assertRaises(Interrupted, two_phase, base_dir, 77)
+    self.assertRaises(Interrupted, two_phase, base_dir, 130, True)
+    two_phase(base_dir, resume=True)
+    self.assertEqual(self.info(base_dir), self.info(ref))
+    self.assertSameText(base_dir, ref)
+
+  def interrupted(self, two_phase):
+    base_dir = os.path.join(self.tmp, 'two' if two_phase else 'one')
+    try:
+      with Plos_builder(['*:*'], base_dir, 'test', checkpoint_every=20) as b:
+        if two_phase:
+          b.build_two_phase(_Crashing(self.query(METADATA_RTN_FLDS), 50), 'key')
+        else:
+          b.build(_Crashing(self.query(), 50))
+    except Interrupted:
+      pass
+    return base_dir
+
+  def test_mode_is_checked(self):
+    one = self.interrupted(False)
+    two = self.interrupted(True)
+    self.assertRaises(ValueError, Plos_builder, ['*:*'], one, 'test', resume=True, two_phase=True)
+    self.assertRaises(ValueError, Plos_builder, ['*:*'], two, 'test', resume=True, two_phase=False)
+    with self.assertRaises(ValueError):
+      with Plos_builder(['*:*'], one, 'test', resume=True) as b:
+        b.build_two_phase(self.query(METADATA_RTN_FLDS), 'key')
+    with self.assertRaises(ValueError):
+      with Plos_builder(['*:*'], two, 'test', resume=True) as b:
+        b.build(self.query())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Query paging against the Solr stand-in.
+"""
+import time
+import unittest
+import threading
+import context
+from solr_standin import Solr_standin, make_docs
+from oa_nlp.plos_api import solr
+
+class Query_paging_test(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = Solr_standin(make_docs(250))
+    cls.saved_url = solr._search_url
+    solr._search_url = cls.server.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    solr._search_url = cls.saved_url
+    cls.server.stop()
+
+  def setUp(self):
+    del self.server.requests[:]
+    self.by_id = sorted([ d['id'] for d in self.server.docs ])
+
+  def query(self, **kwargs):
+    return solr.Query('key', ['*:*'], ['id'], ['*'], chunk_size=40, **kwargs)
+
+  def test_cursor_pages_in_id_order(self):
+    ids = [ d['id'] for d in self.query(limit=1000, paging='cursor') ]
+    self.assertEqual(ids, self.by_id)
+    marks = [ r['cursorMark'] for r in self.server.requests ]
+    self.assertEqual(marks[0], '*')
+    # Each page asks for the documents after the last one returned.
+    self.assertEqual(marks[1:], [ self.by_id[i] for i in range(39, 250, 40) ])
+    for r in self.server.requests:
+      self.assertEqual((r['sort'], r['start']), ('id asc', '0'))
+
+  def test_cursor_prefetch_matches(self):
+    ids = [ d['id'] for d in self.query(limit=1000, paging='cursor', prefetch=2, workers=3) ]
+    self.assertEqual(ids, self.by_id)
+
+  def test_cursor_stops_on_empty_page(self):
+    # numFound does not end the paging, the empty last page does. Its
+    # next mark is the mark it was requested with.
+    self.server.extra_found = 100
+    try:
+      ids = [ d['id'] for d in self.query(limit=1000, paging='cursor') ]
+    finally:
+      self.server.extra_found = 0
+    self.assertEqual(ids, self.by_id)
+    self.assertEqual(len(self.server.requests), 250 // 40 + 2)
+    self.assertEqual(self.server.requests[-1]['cursorMark'], self.by_id[-1])
+
+  def test_cursor_stops_when_mark_stops_changing(self):
+    # A server that does not advance the mark would serve the same page
+    # forever.
+    self.server.frozen_mark = True
+    try:
+      ids = [ d['id'] for d in self.query(limit=1000, paging='cursor') ]
+    finally:
+      self.server.frozen_mark = False
+    self.assertEqual(ids, self.by_id[:40])
+    self.assertEqual(len(self.server.requests), 1)
+
+  def test_limit_truncates(self):
+    for paging in ('cursor', 'offset'):
+      del self.server.requests[:]
+      ids = [ d['id'] for d in self.query(limit=95, paging=paging) ]
+      self.assertEqual(len(ids), 95)
+      if paging == 'cursor':
+        self.assertEqual(ids, self.by_id[:95])
+        # The last page asks for no more than the limit.
+        self.assertEqual([ r['rows'] for r in self.server.requests ], ['40', '40', '15'])
+      else:
+        self.assertEqual(ids, [ d['id'] for d in self.server.docs[:95] ])
+
+  def test_early_break_stops_prefetching(self):
+    def threads():
+      # Give stopped threads time to see the stop and finish.
+      deadline = time.time() + 5
+      while threading.active_count() > before and time.time() < deadline:
+        time.sleep(0.05)
+      return threading.active_count()
+    before = threading.active_count()
+    for paging in ('offset', 'cursor', 'offset'):
+      for i, doc in enumerate(self.query(limit=1000, paging=paging, prefetch=4, workers=2)):
+        if i == 50:
+          break
+    self.assertEqual(threads(), before)
+    # So does an exception raised by the consumer.
+    try:
+      for doc in self.query(limit=1000, prefetch=4, workers=2):
+        raise KeyError()
+    except KeyError:
+      pass
+    self.assertEqual(threads(), before)
+
+  def test_auto_paging(self):
+    saved = solr._cursor_paging_min
+    solr._cursor_paging_min = 100
+    try:
+      self.assertEqual(self.query(limit=101).paging, 'cursor')
+      self.assertEqual(self.query(limit=100).paging, 'offset')
+      # Cursor paging can only start at the beginning of the results.
+      self.assertEqual(self.query(limit=1000, start=10).paging, 'offset')
+      ids = [ d['id'] for d in self.query(limit=1000) ]
+      self.assertEqual(ids, self.by_id)
+    finally:
+      solr._cursor_paging_min = saved
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Assignment of articles to the training view.
+"""
+import unittest
+from builder_case import Builder_case
+from plos_reader import Plos_reader
+from util import doi_fraction
+
+class Split_test(Builder_case):
+  ndocs = 300
+
+  def views(self, base_dir):
+    return dict([ (t, Plos_reader(base_dir, corpus_type=t).dois())
+                  for t in ('full', 'partial', 'training') ])
+
+  def test_count_split(self):
+    views = self.views(self.build('count', train=10))
+    # Every train'th article, counting from one.
+    self.assertEqual(views['training'], views['full'][9::10])
+
+  def test_hash_split(self):
+    views = self.views(self.build('hash', split='hash', train=10))
+    expected = [ d for d in views['full'] if doi_fraction(d, 0) < 0.1 ]
+    self.assertEqual(views['training'], expected)
+    self.assertEqual(sorted(views['training'] + views['partial']), sorted(views['full']))
+    self.assertTrue(15 <= len(expected) <= 45)
+
+  def test_hash_split_ignores_order(self):
+    docs = list(self.query())
+    forward = self.views(self.build('forward', docs, split='hash', train_ratio=0.3))
+    docs.reverse()
+    backward = self.views(self.build('backward', docs, split='hash', train_ratio=0.3))
+    self.assertEqual(sorted(forward['training']), sorted(backward['training']))
+    self.assertEqual(forward['full'], list(reversed(backward['full'])))
+
+  def test_seed(self):
+    split0 = self.views(self.build('seed0', split='hash', train_ratio=0.3))
+    split7 = self.views(self.build('seed7', split='hash', train_ratio=0.3, split_seed=7))
+    self.assertNotEqual(split0['training'], split7['training'])
+
+if __name__ == '__main__':
+  unittest.main()
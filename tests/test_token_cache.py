@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tokenizer configurations and the token cache.
+"""
+import shutil
+import tempfile
+import unittest
+import context
+from nltk.tokenize import WordPunctTokenizer
+from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters
+from token_cache import Token_cache, tokenizer_config
+
+def punkt(abbrevs):
+  params = PunktParameters()
+  params.abbrev_types = set(abbrevs)
+  return PunktSentenceTokenizer(params)
+
+class _Opaque(object):
+  __slots__ = ('table',)
+
+class _Opaque_tokenizer(object):
+  def __init__(self):
+    self.table = _Opaque()
+
+  def tokenize(self, text):
+    return [text]
+
+_text = u'See Fig. 2 of the paper by Dr. Smith. It grew.\n\nA second paragraph.'
+
+class Token_cache_test(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_punkt_parameters(self):
+    words = WordPunctTokenizer()
+    default = tokenizer_config(words, PunktSentenceTokenizer())
+    abbrevs = tokenizer_config(words, punkt(['dr', 'fig']))
+    self.assertNotEqual(default, abbrevs)
+    # Set order does not matter.
+    many = [ u'abbr{i}'.format(i=i) for i in range(200) ]
+    self.assertEqual(tokenizer_config(words, punkt(many)),
+                     tokenizer_config(words, punkt(reversed(many))))
+
+  def test_same_before_and_after_use(self):
+    words = WordPunctTokenizer()
+    sents = PunktSentenceTokenizer()
+    before = tokenizer_config(words, sents)
+    words.tokenize(_text)
+    sents.tokenize(_text)
+    self.assertEqual(tokenizer_config(words, sents), before)
+
+  def test_models_do_not_share_entries(self):
+    words = WordPunctTokenizer()
+    cache = Token_cache(self.tmp, words, PunktSentenceTokenizer())
+    self.assertEqual(len(cache.sents(_text)), 5)
+    cache = Token_cache(self.tmp, words, punkt(['dr', 'fig']))
+    self.assertEqual(len(cache.sents(_text)), 3)
+    self.assertEqual(cache.misses, 1)
+
+  def test_opaque_state_is_refused(self):
+    cache = Token_cache(self.tmp, WordPunctTokenizer(), _Opaque_tokenizer())
+    self.assertRaises(ValueError, cache.sents, _text)
+    cache = Token_cache(self.tmp, WordPunctTokenizer(), _Opaque_tokenizer(), config=u'split')
+    self.assertEqual(len(cache.sents(_text)), 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Token arrays made at build time and the tokenizers they were made with.
+"""
+import os
+import unittest
+import nltk
+from nltk.tokenize import WhitespaceTokenizer, LineTokenizer, WordPunctTokenizer
+from builder_case import Builder_case
+from plos_reader import Plos_reader
+from tokens import Token_writer, Token_corpus, merge_tokens, tokenizer_config
+
+def _have_punkt():
+  try:
+    nltk.data.find('tokenizers/punkt/english.pickle')
+  except LookupError:
+    return False
+  return True
+
+class Tokens_test(Builder_case):
+
+  def build_whitespace(self):
+    return self.build('ws', tokenize=True, word_tokenizer=WhitespaceTokenizer(),
+                      sent_tokenizer=LineTokenizer())
+
+  def test_reader_with_the_build_tokenizers(self):
+    base_dir = self.build_whitespace()
+    r = Plos_reader(base_dir, word_tokenizer=WhitespaceTokenizer(),
+                    sent_tokenizer=LineTokenizer())
+    self.assertTrue(r._tokens is not None)
+    f = r.fileids()[0]
+    self.assertEqual(list(r.words(f)), r.raw(f).split())
+
+  def test_reader_with_other_tokenizers(self):
+    base_dir = self.build_whitespace()
+    r = Plos_reader(base_dir, word_tokenizer=WordPunctTokenizer(),
+                    sent_tokenizer=LineTokenizer())
+    self.assertTrue(r._tokens is None)
+    f = r.fileids()[0]
+    self.assertEqual(list(r.words(f)), WordPunctTokenizer().tokenize(r.raw(f)))
+
+  @unittest.skipUnless(_have_punkt(), 'needs the Punkt models')
+  def test_reader_with_default_tokenizers(self):
+    r = Plos_reader(self.build_whitespace())
+    self.assertTrue(r._tokens is None)
+    self.assertTrue(u'.' in list(r.words(r.fileids()[0])))
+
+  def test_token_cache(self):
+    base_dir = self.build_whitespace()
+    cache_dir = os.path.join(self.tmp, 'cache')
+    r = Plos_reader(base_dir, word_tokenizer=WordPunctTokenizer(),
+                    sent_tokenizer=LineTokenizer(), token_cache=cache_dir)
+    f = r.fileids()[0]
+    self.assertEqual(list(r.words(f)), WordPunctTokenizer().tokenize(r.raw(f)))
+    self.assertEqual(r._token_cache.misses, 1)
+    # The arrays are used when they were made with the cache's tokenizers.
+    r = Plos_reader(base_dir, word_tokenizer=WhitespaceTokenizer(),
+                    sent_tokenizer=LineTokenizer(), token_cache=cache_dir)
+    self.assertEqual(list(r.words(f)), r.raw(f).split())
+    self.assertEqual(r._token_cache.misses, 0)
+
+  def test_append_with_other_tokenizers(self):
+    root = os.path.join(self.tmp, 'tokens')
+    os.mkdir(root)
+    w = Token_writer(root, WhitespaceTokenizer(), LineTokenizer())
+    w.add(u'a-body.txt', u'One, two.')
+    w.close()
+    self.assertRaises(ValueError, Token_writer, root, WordPunctTokenizer(), LineTokenizer())
+    Token_writer(root, WhitespaceTokenizer(), LineTokenizer()).close()
+
+  def test_merge_keeps_the_configuration(self):
+    def part(name, word_tokenizer):
+      root = os.path.join(self.tmp, name)
+      os.mkdir(root)
+      w = Token_writer(root, word_tokenizer, LineTokenizer())
+      w.add(name + u'-body.txt', u'Text of {n}.'.format(n=name))
+      w.close()
+      return root
+    parts = [ part(u'a', WhitespaceTokenizer()), part(u'b', WhitespaceTokenizer()) ]
+    merged = os.path.join(self.tmp, 'merged')
+    os.mkdir(merged)
+    merge_tokens(merged, parts)
+    corpus = Token_corpus(merged)
+    self.assertEqual(corpus.config, tokenizer_config(WhitespaceTokenizer(), LineTokenizer()))
+    self.assertEqual(corpus.words(u'b-body.txt'), [u'Text', u'of', u'b.'])
+    other = os.path.join(self.tmp, 'other')
+    os.mkdir(other)
+    self.assertRaises(ValueError, merge_tokens, other,
+                      parts + [ part(u'c', WordPunctTokenizer()) ])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Two-phase, metadata then text, builds.
+"""
+import os
+import unittest
+from builder_case import Builder_case
+from plos_builder import Plos_builder, METADATA_RTN_FLDS, TEXT_RTN_FLDS
+
+def physics(doc):
+  return 'Physics' in doc['subject']
+
+class Two_phase_test(Builder_case):
+
+  def test_same_corpus_as_one_phase(self):
+    ref = self.build('ref', [ d for d in self.query() if physics(d) ])
+    base_dir = os.path.join(self.tmp, 'two')
+    del self.server.requests[:]
+    with Plos_builder(['*:*'], base_dir, 'test') as b:
+      missing = b.build_two_phase(self.query(METADATA_RTN_FLDS), 'key', select=physics,
+                                  batch_size=7)
+    self.assertEqual(missing, [])
+    self.assertEqual(self.info(base_dir), self.info(ref))
+    self.assertSameText(base_dir, ref)
+    # The text is only fetched for the selected articles.
+    text_requests = [ r for r in self.server.requests if r['q'].startswith('id:') ]
+    self.assertEqual(sum([ int(r['rows']) for r in text_requests ]),
+                     len(self.info(ref)['doi_article_info']))
+    for r in text_requests:
+      self.assertEqual(r['fl'].split(','), list(TEXT_RTN_FLDS))
+
+  def test_missing_text(self):
+    docs = list(self.query(METADATA_RTN_FLDS, limit=10))
+    gone = dict(docs[3], id=u'10.1371/journal.pone.9999999')
+    docs.insert(3, gone)
+    base_dir = os.path.join(self.tmp, 'two')
+    with Plos_builder(['*:*'], base_dir, 'test') as b:
+      missing = b.build_two_phase(docs, 'key')
+    self.assertEqual(missing, [gone['id']])
+    self.assertEqual(self.info(base_dir)['document_count'], 10)
+
+if __name__ == '__main__':
+  unittest.main()